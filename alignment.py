@@ -0,0 +1,169 @@
+"""
+Time alignment of two streams by cross-correlation.
+
+A feature of both streams (yaw rate, accel magnitude...) is put on a common
+uniform grid and cross-correlated with FFTs over sliding windows. The lags of all
+windows give the time offset and the drift between the two clocks, and one stream
+is then resampled onto the timebase of the other.
+"""
+
+import math
+import numpy as np
+import attitude
+
+# sample rate of the common grid, Hz
+grid_rate = 100.0
+# length of the sliding windows and step between them, s
+window_time = 60.0
+step_time = 30.0
+# largest offset searched, s
+max_offset = 2.0
+# windows with a lower normalized correlation peak are not used
+min_quality = 0.5
+
+
+def next_pow2(n):
+    return 1 << int(math.ceil(math.log(max(n, 1), 2)))
+
+
+def xcorr(a, b, max_lag):
+    '''
+    Normalized cross-correlation of two equally long signals by FFT.
+    Args:
+        a, b: n samples
+        max_lag: largest lag in samples
+    Returns:
+        lags (-max_lag..max_lag) and correlation c[k] = sum a[i] * b[i + k], normalized
+    '''
+    a = np.asarray(a, dtype=np.float64) - np.mean(a)
+    b = np.asarray(b, dtype=np.float64) - np.mean(b)
+    n = a.shape[0]
+    nfft = next_pow2(2 * n)
+    c = np.fft.irfft(np.conj(np.fft.rfft(a, nfft)) * np.fft.rfft(b, nfft), nfft)
+    max_lag = min(max_lag, n - 1)
+    c = np.concatenate((c[nfft-max_lag:], c[:max_lag+1]))
+    norm = math.sqrt(np.dot(a, a) * np.dot(b, b))
+    if norm > 0:
+        c /= norm
+    return np.arange(-max_lag, max_lag + 1), c
+
+
+def peak_lag(lags, c):
+    '''
+    Lag of the correlation peak, refined by a parabola through the 3 highest points.
+    Returns:
+        lag in samples (float), peak value
+    '''
+    i = int(np.argmax(c))
+    lag = float(lags[i])
+    if 0 < i < c.shape[0] - 1:
+        den = c[i-1] - 2.0 * c[i] + c[i+1]
+        if den < 0:
+            lag += 0.5 * (c[i-1] - c[i+1]) / den
+    return lag, float(c[i])
+
+
+def to_grid(t, x, fs=grid_rate, t0=None, t1=None):
+    '''
+    Linear interpolation of a stream onto a uniform grid.
+    Returns:
+        grid time, values
+    '''
+    t0 = t[0] if t0 is None else t0
+    t1 = t[-1] if t1 is None else t1
+    tg = t0 + np.arange(int(math.floor((t1 - t0) * fs)) + 1) / fs
+    return tg, np.interp(tg, t, x)
+
+
+def yaw_rate(t, yaw):
+    '''
+    Yaw rate of a yaw angle sequence, deg/s. Wrapping is removed first.
+    '''
+    yaw = np.unwrap(np.asarray(yaw) * attitude.D2R) * attitude.R2D
+    return np.gradient(yaw, t)
+
+
+def acc_norm(acc):
+    return np.sqrt(np.sum(np.asarray(acc)**2, axis=1))
+
+
+def estimate(t_a, a, t_b, b, fs=grid_rate, window=window_time, step=step_time,\
+             max_off=max_offset, quality=min_quality):
+    '''
+    Offset and drift of stream b relative to stream a, from one feature of each.
+    b is late by offset(t) = offset + drift * (t - t_ref), so the feature of b at
+    t + offset(t) matches the feature of a at t.
+    Args:
+        t_a, a: time (s) and feature of stream a
+        t_b, b: time (s) and feature of stream b
+    Returns:
+        dict of 'offset' (s), 'drift' (s/s), 't_ref' (s), 'windows' (nx3 of window
+        center, offset and correlation peak), None if no window correlates well.
+    '''
+    t0 = max(t_a[0], t_b[0])
+    t1 = min(t_a[-1], t_b[-1])
+    if t1 <= t0:
+        return None
+    tg, ga = to_grid(t_a, a, fs, t0, t1)
+    tg, gb = to_grid(t_b, b, fs, t0, t1)
+    n = tg.shape[0]
+    nw = min(int(window * fs), n)
+    ns = max(int(step * fs), 1)
+    max_lag = int(max_off * fs)
+    res = []
+    for start in range(0, n - nw + 1, ns):
+        lags, c = xcorr(ga[start:start+nw], gb[start:start+nw], max_lag)
+        lag, peak = peak_lag(lags, c)
+        res.append([tg[start] + 0.5 * nw / fs, lag / fs, peak])
+    res = np.array(res).reshape(-1, 3)
+    good = res[:, 2] >= quality
+    if not good.any():
+        return None
+    tc = res[good, 0]
+    off = res[good, 1]
+    w = res[good, 2]
+    t_ref = float(np.average(tc, weights=w))
+    if good.sum() >= 2 and np.ptp(tc) > 0:
+        drift, offset = np.polyfit(tc - t_ref, off, 1, w=w)
+    else:
+        drift, offset = 0.0, float(np.average(off, weights=w))
+    return {'offset': float(offset), 'drift': float(drift), 't_ref': t_ref, 'windows': res}
+
+
+def correct_time(t_b, model):
+    '''
+    Time of stream b on the clock of stream a.
+    '''
+    t_b = np.asarray(t_b, dtype=np.float64)
+    # offset is a function of a's time, ta + off(ta) = tb solved for ta
+    return (t_b - model['offset'] + model['drift'] * model['t_ref']) / (1.0 + model['drift'])
+
+
+def resample(t_b, x_b, t_a, model=None, angles=None):
+    '''
+    Resample stream b onto the times of stream a.
+    Args:
+        t_b: n times of stream b
+        x_b: n or nxk values of stream b
+        t_a: m target times
+        model: result of estimate(), no correction if None
+        angles: columns of x_b that are angles in deg, interpolated without the
+            jump at +/-180
+    Returns:
+        m or mxk values, NaN outside stream b
+    '''
+    t = correct_time(t_b, model) if model is not None else np.asarray(t_b, dtype=np.float64)
+    x = np.asarray(x_b, dtype=np.float64)
+    single = x.ndim == 1
+    x = x.reshape(x.shape[0], -1)
+    out = np.empty((np.asarray(t_a).shape[0], x.shape[1]))
+    for j in range(x.shape[1]):
+        col = x[:, j]
+        if angles is not None and j in angles:
+            col = np.unwrap(col * attitude.D2R) * attitude.R2D
+            out[:, j] = (np.interp(t_a, t, col) + 180.0) % 360.0 - 180.0
+        else:
+            out[:, j] = np.interp(t_a, t, col)
+    outside = (np.asarray(t_a) < t[0]) | (np.asarray(t_a) > t[-1])
+    out[outside] = np.nan
+    return out[:, 0] if single else out
@@ -0,0 +1,289 @@
+"""
+Allan, modified Allan and Hadamard deviations of long static logs.
+
+The rate samples are integrated once into phase (and once more for the modified
+Allan deviation), then every cluster time is a weighted sum of a few shifted slices
+of those integrals, O(N) per cluster time. Integrals larger than in_memory_samples
+are kept in temporary memory-mapped files and all passes go chunk by chunk, so
+memory does not grow with the length of the log.
+"""
+
+import os
+import sys
+import math
+import shutil
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+
+# samples processed at a time
+chunk_samples = 1 << 22
+# integrals longer than this go to temporary files
+in_memory_samples = 1 << 24
+# cluster times per decade
+taus_per_decade = 10
+# deviations computed by default
+all_kinds = ('adev', 'mdev', 'hdev')
+# coefficients of the differences of each deviation
+diff_coeffs = {'adev': (1.0, -2.0, 1.0),\
+               'hdev': (1.0, -3.0, 3.0, -1.0),\
+               'mdev': (1.0, -3.0, 3.0, -1.0)}
+# bias instability is the flat bottom of ADEV, scaled by sqrt(2*ln2/pi)
+bi_scale = math.sqrt(2.0 * math.log(2.0) / math.pi)
+# axes of S1/SH data
+axis_names = ['wx', 'wy', 'wz', 'ax', 'ay', 'az']
+
+
+def cluster_sizes(n, max_factor=3, per_decade=taus_per_decade):
+    '''
+    Log-spaced cluster sizes, in samples.
+    Args:
+        n: number of samples
+        max_factor: the largest cluster is n // max_factor, 2 for ADEV and 3 for
+            MDEV and HDEV
+    Returns:
+        unique int64 array
+    '''
+    m_max = (n - 1) // max_factor
+    if m_max < 1:
+        return np.zeros((0,), dtype=np.int64)
+    num = int(math.floor(math.log10(m_max) * per_decade)) + 1
+    m = np.unique(np.floor(np.logspace(0, math.log10(m_max), num)).astype(np.int64))
+    return m[m >= 1]
+
+
+def _new_array(n, work_dir):
+    if n <= in_memory_samples or work_dir is None:
+        return np.empty((n,), dtype=np.float64)
+    fd, name = tempfile.mkstemp(suffix='.dat', dir=work_dir)
+    os.close(fd)
+    return np.memmap(name, dtype=np.float64, mode='w+', shape=(n,))
+
+
+def integrate(y, scale=1.0, offset=0.0, work_dir=None, chunk=chunk_samples):
+    '''
+    x[0] = 0, x[k] = scale * sum(y[0:k] - offset), chunk by chunk.
+    Returns:
+        n+1 array, in memory or memory-mapped in work_dir
+    '''
+    n = y.shape[0]
+    x = _new_array(n + 1, work_dir)
+    x[0] = 0.0
+    carry = 0.0
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        c = np.cumsum((np.asarray(y[start:end], dtype=np.float64) - offset) * scale)
+        x[start+1:end+1] = c + carry
+        carry = x[end]
+    return x
+
+
+def chunked_mean(y, chunk=chunk_samples):
+    total = 0.0
+    for start in range(0, y.shape[0], chunk):
+        total += np.sum(y[start:start+chunk], dtype=np.float64)
+    return total / y.shape[0] if y.shape[0] else 0.0
+
+
+def diff_power(x, m, coeffs, count, chunk=chunk_samples):
+    '''
+    sum over k in [0, count) of (sum_i coeffs[i] * x[k + i*m])^2, chunk by chunk.
+    '''
+    total = 0.0
+    for start in range(0, count, chunk):
+        end = min(start + chunk, count)
+        d = coeffs[0] * x[start:end]
+        for i in range(1, len(coeffs)):
+            d = d + coeffs[i] * x[start+i*m:end+i*m]
+        total += float(np.dot(d, d))
+    return total
+
+
+def deviations(y, fs, kinds=all_kinds, m=None, work_dir=None, chunk=chunk_samples):
+    '''
+    Overlapping Allan, modified Allan and Hadamard deviations of a rate signal.
+    Args:
+        y: n samples, numpy array or memmap. Any 1-D slice of a memmap works.
+        fs: sample rate, Hz
+        kinds: any of 'adev', 'mdev', 'hdev'
+        m: cluster sizes in samples, log-spaced up to n/3 if None
+        work_dir: directory of temporary integrals of long signals, the system
+            temp directory if None
+    Returns:
+        dict of 'tau' (s) and one array per kind, NaN where the cluster is too long.
+    '''
+    n = y.shape[0]
+    tau0 = 1.0 / fs
+    if m is None:
+        m = cluster_sizes(n, 3 if ('mdev' in kinds or 'hdev' in kinds) else 2)
+    m = np.asarray(m, dtype=np.int64)
+    res = {'tau': m * tau0}
+    for kind in kinds:
+        res[kind] = np.full(m.shape, np.nan)
+    if n < 3:
+        return res
+    tmp = None
+    if n > in_memory_samples:
+        tmp = tempfile.mkdtemp(dir=work_dir)
+    try:
+        # removing the mean keeps the integrals small, no deviation depends on it
+        x = integrate(y, tau0, chunked_mean(y, chunk), tmp, chunk)
+        n_x = x.shape[0]
+        for j in range(m.shape[0]):
+            mj = int(m[j])
+            tau = mj * tau0
+            if 'adev' in kinds and n_x - 2 * mj > 0:
+                count = n_x - 2 * mj
+                s = diff_power(x, mj, diff_coeffs['adev'], count, chunk)
+                res['adev'][j] = math.sqrt(s / (2.0 * tau * tau * count))
+            if 'hdev' in kinds and n_x - 3 * mj > 0:
+                count = n_x - 3 * mj
+                s = diff_power(x, mj, diff_coeffs['hdev'], count, chunk)
+                res['hdev'][j] = math.sqrt(s / (6.0 * tau * tau * count))
+        if 'mdev' in kinds:
+            # sums of m phase differences are differences of the integral of phase
+            xx = integrate(x, 1.0, 0.0, tmp, chunk)
+            del x
+            for j in range(m.shape[0]):
+                mj = int(m[j])
+                tau = mj * tau0
+                count = n_x - 3 * mj + 1
+                if count <= 0:
+                    continue
+                s = diff_power(xx, mj, diff_coeffs['mdev'], count, chunk)
+                res['mdev'][j] = math.sqrt(s / (2.0 * mj * mj * tau * tau * count))
+            del xx
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return res
+
+
+def fit_noise(tau, adev):
+    '''
+    Noise coefficients from the slopes of an Allan deviation curve.
+    Args:
+        tau: cluster times, s
+        adev: Allan deviation, in the unit of the signal
+    Returns:
+        dict of
+            'arw': angle/velocity random walk, unit*sqrt(s), from the -1/2 slope at tau=1s
+            'bias_instability': unit, from the minimum of the curve
+            'tau_bi': cluster time of the minimum, s
+            'rrw': rate random walk, unit/sqrt(s), from the +1/2 slope at tau=3s
+        None for terms that are not seen in the curve.
+    '''
+    tau = np.asarray(tau, dtype=np.float64)
+    adev = np.asarray(adev, dtype=np.float64)
+    ok = np.isfinite(adev) & (adev > 0)
+    tau = tau[ok]
+    adev = adev[ok]
+    res = {'arw': None, 'bias_instability': None, 'tau_bi': None, 'rrw': None}
+    if tau.shape[0] < 3:
+        return res
+    lt = np.log10(tau)
+    la = np.log10(adev)
+    slope = np.gradient(la, lt)
+    white = np.abs(slope + 0.5) < 0.1
+    if white.any():
+        res['arw'] = float(np.median(adev[white] * np.sqrt(tau[white])))
+    i = int(np.argmin(adev))
+    if 0 < i < tau.shape[0] - 1:
+        res['bias_instability'] = float(adev[i] / bi_scale)
+        res['tau_bi'] = float(tau[i])
+    walk = np.abs(slope - 0.5) < 0.1
+    if walk.any():
+        res['rrw'] = float(np.median(adev[walk] * np.sqrt(3.0 / tau[walk])))
+    return res
+
+
+def _load(source):
+    if isinstance(source, str):
+        return np.load(source, mmap_mode='r')
+    return source
+
+
+def _job(args):
+    source, col, fs, kinds, work_dir, chunk = args
+    data = _load(source)
+    y = data[:, col] if data.ndim > 1 else data
+    res = deviations(y, fs, kinds, None, work_dir, chunk)
+    if 'adev' in res:
+        res['fit'] = fit_noise(res['tau'], res['adev'])
+    return res
+
+
+def characterize(units, fs, kinds=all_kinds, names=None, processes=None,\
+                 work_dir=None, chunk=chunk_samples):
+    '''
+    Deviations and noise fits of all axes of all units, one process per axis.
+    Args:
+        units: dict of unit name and an nxk array, or the path of a .npy file
+            (memory-mapped by each worker, so nothing large is pickled).
+        fs: sample rate, Hz
+        names: names of the k columns, axis_names if k is 6
+        processes: number of worker processes, CPU count if None. 1 runs in place.
+    Returns:
+        dict of unit name, dict of axis name and the result of deviations() with
+        the fit of fit_noise() under 'fit'.
+    '''
+    jobs = []
+    keys = []
+    for unit in units:
+        data = _load(units[unit])
+        k = data.shape[1] if data.ndim > 1 else 1
+        if names is not None and len(names) == k:
+            cols = names
+        elif k == len(axis_names):
+            cols = axis_names
+        else:
+            cols = ['c%u'% i for i in range(k)]
+        for col in range(k):
+            jobs.append((units[unit], col, fs, kinds, work_dir, chunk))
+            keys.append((unit, cols[col]))
+    if processes == 1 or len(jobs) <= 1:
+        results = [_job(j) for j in jobs]
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    out = {}
+    for key, res in zip(keys, results):
+        out.setdefault(key[0], {})[key[1]] = res
+    return out
+
+
+def save_capture(file_name, packet_type, out_file):
+    '''
+    Decode the gyro and accel of a S0/S1/SH capture into an nx6 .npy file for characterize().
+    '''
+    import bulk_decode
+    data = bulk_decode.decode_file(file_name, packet_type)
+    np.save(out_file, np.hstack((data['gyro'], data['acc'])))
+    return out_file
+
+
+def format_fit(fit):
+    '''
+    Noise terms in the usual gyro units, if the signal is in deg/s: ARW deg/sqrt(h),
+    bias instability deg/h, RRW deg/h/sqrt(h).
+    '''
+    def f(x, scale):
+        return 'n/a' if x is None else '%.4g'% (x * scale)
+    return 'ARW %s, BI %s (tau %s s), RRW %s'%\
+           (f(fit['arw'], 60.0), f(fit['bias_instability'], 3600.0),\
+            f(fit['tau_bi'], 1.0), f(fit['rrw'], 3600.0 * 60.0))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print('Usage: python allan.py capture_file packet_type sample_rate')
+        exit()
+    npy = os.path.splitext(sys.argv[1])[0] + '_imu.npy'
+    save_capture(sys.argv[1], sys.argv[2], npy)
+    res = characterize({'unit': npy}, float(sys.argv[3]))
+    for axis in res['unit']:
+        print('%s: %s'% (axis, format_fit(res['unit'][axis]['fit'])))
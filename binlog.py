@@ -0,0 +1,158 @@
+"""
+Binary logs for post processing of logs larger than RAM.
+
+A binary log is the rows of a csv log as raw float64, plus a .json sidecar with
+the column names. It is memory-mapped, so slicing rows and columns gives views
+instead of copies, and post processing goes through it in bounded chunks of rows.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+
+# extension of binary logs
+ext = '.bin'
+# rows processed at a time
+chunk_rows = 1 << 16
+
+
+def header_file(bin_file):
+    return bin_file + '.json'
+
+
+def is_binlog(file_name):
+    return os.path.splitext(file_name)[1].lower() == ext
+
+
+class binlog_writer:
+    '''
+    Append rows to a binary log.
+    '''
+    def __init__(self, bin_file, names):
+        self.bin_file = bin_file
+        self.names = list(names)
+        self.f = open(bin_file, 'wb')
+        with open(header_file(bin_file), 'w') as h:
+            json.dump({'columns': self.names}, h)
+
+    def write(self, rows):
+        '''
+        Args:
+            rows: k or nxk numbers
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.shape[-1] != len(self.names):
+            raise ValueError('Expect %u columns, got %u.'% (len(self.names), rows.shape[-1]))
+        self.f.write(rows.tobytes())
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+
+def csv_to_binlog(csv_file, bin_file=None, delimiter=',', skip_header=1, rows=chunk_rows):
+    '''
+    Convert a csv log to a binary log, a chunk of lines at a time.
+    Returns:
+        name of the binary log
+    '''
+    if bin_file is None:
+        bin_file = os.path.splitext(csv_file)[0] + ext
+    with open(csv_file, 'r') as f:
+        header = [f.readline() for i in range(skip_header)]
+        names = header[-1].strip().split(delimiter) if header else []
+        names = [x.strip() for x in names if x.strip()]
+        writer = None
+        while True:
+            lines = [line for line in (f.readline() for i in range(rows)) if line]
+            if not lines:
+                break
+            block = np.genfromtxt(lines, delimiter=delimiter, ndmin=2)
+            if writer is None:
+                if len(names) != block.shape[1]:
+                    names = ['c%u'% i for i in range(block.shape[1])]
+                writer = binlog_writer(bin_file, names)
+            writer.write(block)
+            if len(lines) < rows:
+                break
+    if writer is None:
+        writer = binlog_writer(bin_file, names)
+    writer.close()
+    return bin_file
+
+
+def open_binlog(bin_file):
+    '''
+    Memory-map a binary log, read only.
+    Returns:
+        nxk array (memmap), column names
+    '''
+    with open(header_file(bin_file), 'r') as h:
+        names = json.load(h)['columns']
+    k = len(names)
+    n = os.path.getsize(bin_file) // (8 * k) if k else 0
+    if n == 0:
+        return np.zeros((0, k)), names
+    return np.memmap(bin_file, dtype=np.float64, mode='r', shape=(n, k)), names
+
+
+def load(data_file, delimiter=',', skip_header=1):
+    '''
+    Rows of a log, memory-mapped. A csv log is converted by csv_to_binlog() into a
+    binary log next to it first, unless that one is newer than the csv log.
+    '''
+    if not is_binlog(data_file):
+        bin_file = os.path.splitext(data_file)[0] + ext
+        if not os.path.exists(header_file(bin_file)) or\
+           os.path.getmtime(header_file(bin_file)) < os.path.getmtime(data_file):
+            csv_to_binlog(data_file, bin_file, delimiter, skip_header)
+        data_file = bin_file
+    return open_binlog(data_file)[0]
+
+
+def chunks(start, stop, rows=chunk_rows):
+    '''
+    (start, stop) of consecutive chunks covering [start, stop).
+    '''
+    for a in range(start, stop, rows):
+        yield a, min(a + rows, stop)
+
+
+def save_rows(file_name, header, blocks, delimiter=',', append=False):
+    '''
+    np.savetxt of blocks of rows into one file, the same output as np.savetxt of
+    the rows stacked together.
+    Args:
+        blocks: iterable of nxk or n arrays
+        append: append the rows to an existing file, the header is not written
+    '''
+    with open(file_name, 'ab' if append else 'wb') as f:
+        if not append:
+            f.write((header + '\n').encode('latin1'))
+        for block in blocks:
+            np.savetxt(f, block, delimiter=delimiter)
+
+
+class hstack_view:
+    '''
+    Columns of several arrays side by side from row start, stacked only when a slice
+    of rows is read.
+    '''
+    def __init__(self, *arrays, **kwargs):
+        self.arrays = arrays
+        self.start = kwargs.get('start', 0)
+        self.shape = (arrays[0].shape[0] - self.start, sum(a.shape[1] for a in arrays))
+        self.ndim = 2
+
+    def __getitem__(self, idx):
+        a, b, step = idx.indices(self.shape[0])
+        rows = slice(a + self.start, b + self.start, step)
+        return np.hstack([x[rows] for x in self.arrays])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Usage: python binlog.py log.csv [log.bin]')
+        exit()
+    print('Saved to %s'% csv_to_binlog(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,213 @@
+"""
+Vectorized decoding of 5555 packets from a whole capture.
+
+imu38x decodes byte by byte, which is fine for live data. For long captures, the
+frames of one packet type are located, CRC-checked and sliced with numpy, so
+millions of packets are decoded without Python-level loops over packets.
+"""
+
+import os
+import numpy as np
+import imu38x
+
+# default size of the chunks read from a capture file, bytes
+chunk_bytes = 64 * 1024 * 1024
+
+
+def _crc_table():
+    imu38x.crc16(b'')
+    return np.array(imu38x.crc_table, dtype=np.uint16)
+
+
+def crc16(block):
+    '''
+    CRC of each row of a block, the same as imu38x.calc_crc.
+    Args:
+        block: nxm uint8 array
+    Returns:
+        n uint16 array
+    '''
+    table = _crc_table()
+    crc = np.full((block.shape[0],), 0x1D0F, dtype=np.uint16)
+    for j in range(block.shape[1]):
+        crc = (crc << 8) ^ table[((crc >> 8) ^ block[:, j]) & 0xff]
+    return crc
+
+
+def find_frames(data, packet_type):
+    '''
+    Find all CRC-valid frames of a packet type.
+    Args:
+        data: bytes, bytearray or uint8 numpy array (a memmap is fine)
+        packet_type: key of imu38x.packet_def
+    Returns:
+        offsets: start of each frame in data
+        frames: nxsize uint8 array, whole frames including header and crc
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    size, header = imu38x.packet_def[packet_type]
+    n = buf.shape[0] - size + 1
+    if n <= 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0, size), dtype=np.uint8)
+    # preamble, packet type and payload length
+    cand = (buf[0:n] == imu38x.preamble[0]) & (buf[1:n+1] == imu38x.preamble[1]) &\
+           (buf[2:n+2] == header[0]) & (buf[3:n+3] == header[1]) &\
+           (buf[4:n+4] == size - 7)
+    offsets = np.flatnonzero(cand)
+    frames = buf[offsets[:, None] + np.arange(size)]
+    # crc over packet type, length and payload
+    crc = frames[:, size-2].astype(np.uint16) * 256 + frames[:, size-1]
+    valid = crc16(frames[:, 2:size-2]) == crc
+    offsets = offsets[valid]
+    frames = frames[valid]
+    # a valid frame inside another one is a coincidence, keep the first
+    if offsets.shape[0] > 1:
+        keep = np.ones(offsets.shape, dtype=bool)
+        keep[1:] = np.diff(offsets) >= size
+        offsets = offsets[keep]
+        frames = frames[keep]
+    return offsets, frames
+
+
+def iter_frames(file_name, packet_type, chunk=chunk_bytes):
+    '''
+    Find frames in a capture file chunk by chunk, memory is bounded by chunk.
+    Yields:
+        offsets (in the file) and frames of each chunk
+    '''
+    size = imu38x.packet_def[packet_type][0]
+    file_size = os.path.getsize(file_name)
+    if file_size == 0:
+        return
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    start = 0
+    while start < file_size:
+        # chunks overlap by one frame so frames across boundaries are not lost
+        end = min(start + chunk + size - 1, file_size)
+        offsets, frames = find_frames(data[start:end], packet_type)
+        # frames starting in the overlap belong to the next chunk
+        if end < file_size:
+            keep = offsets < chunk
+            offsets = offsets[keep]
+            frames = frames[keep]
+        yield offsets + start, frames
+        start += chunk
+
+
+def payloads(frames):
+    '''
+    Payload of each frame.
+    '''
+    return frames[:, 5:-2]
+
+
+def decode_FM(frames):
+    '''
+    Decode FM frames.
+    Returns:
+        counts: nx4x7 int32, [ax ay az wx wy wz temp] counts of the 4 chips in each packet
+        subset: n sensorSubset, the first chip in a packet is subset*4
+        sample_idx: n sampleIdx, 16-bit
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    counts = p[:, 0:112].copy().view('>i4').astype(np.int32).reshape(-1, 4, 7)
+    subset = p[:, 112:114].copy().view('>u2').astype(np.int64).ravel()
+    sample_idx = p[:, 114:116].copy().view('>u2').astype(np.int64).ravel()
+    return counts, subset, sample_idx
+
+
+def _be(p, start, fmt, n=1):
+    '''
+    n big-endian values of format fmt starting at byte start of each payload.
+    '''
+    size = np.dtype(fmt).itemsize
+    return p[:, start:start+size*n].copy().view(fmt).astype(np.float64 if fmt[1] != 'u' else np.int64)
+
+
+def decode_S0(frames):
+    '''
+    Decode S0 frames into a dict of arrays, the same units as imu38x.parse_S0.
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    return {'acc': _be(p, 0, '>i2', 3) * (9.80665 * 20 / 65536.0),\
+            'gyro': _be(p, 6, '>i2', 3) * (1260 / 65536.0),\
+            'mag': _be(p, 12, '>i2', 3) * (2 / 65536.0),\
+            'temp': _be(p, 18, '>i2', 4) * (200 / 65536.0),\
+            'counter': _be(p, 26, '>u2').ravel(),\
+            'bit': _be(p, 28, '>u2').ravel()}
+
+
+def decode_S1(frames):
+    '''
+    Decode S1 frames into a dict of arrays, the same units as imu38x.parse_S1.
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    return {'acc': _be(p, 0, '>i2', 3) * (9.80665 * 20 / 65536.0),\
+            'gyro': _be(p, 6, '>i2', 3) * (1260 / 65536.0),\
+            'temp': _be(p, 12, '>i2', 4) * (200 / 65536.0),\
+            'counter': _be(p, 20, '>u2').ravel(),\
+            'bit': _be(p, 22, '>u2').ravel()}
+
+
+def decode_SH(frames):
+    '''
+    Decode SH frames into a dict of arrays, the same units as imu38x.parse_SH.
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    return {'acc': _be(p, 0, '>i4', 3) * (9.80665 / 4e6),\
+            'gyro': _be(p, 12, '>i4', 3) / 2.56e5,\
+            'temp': _be(p, 24, '>i2', 1) * (400 / 65536.0),\
+            'counter': _be(p, 26, '>u2').ravel(),\
+            'bit': _be(p, 28, '>u2').ravel()}
+
+
+def decode_A1(frames):
+    '''
+    Decode A1 frames into a dict of arrays, the same units as imu38x.parse_A1.
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    return {'euler': _be(p, 0, '>i2', 3) * (360.0 / 65536.0),\
+            'gyro': _be(p, 6, '>i2', 3) * (1260 / 65536.0),\
+            'acc': _be(p, 12, '>i2', 3) * (9.80665 * 20 / 65536.0),\
+            'mag': _be(p, 18, '>i2', 3) * (2 / 65536.0),\
+            'temp': _be(p, 24, '>i2', 1) * (200 / 65536.0),\
+            'itow': _be(p, 26, '>u4').ravel(),\
+            'bit': _be(p, 30, '>u2').ravel()}
+
+
+def decode_A2(frames):
+    '''
+    Decode A2 frames into a dict of arrays, the same units as imu38x.parse_A2.
+    '''
+    p = np.ascontiguousarray(payloads(frames))
+    return {'euler': _be(p, 0, '>i2', 3) * (360.0 / 65536.0),\
+            'gyro': _be(p, 6, '>i2', 3) * (1260 / 65536.0),\
+            'acc': _be(p, 12, '>i2', 3) * (9.80665 * 20 / 65536.0),\
+            'temp': _be(p, 18, '>i2', 3) * (200 / 65536.0),\
+            'itow': _be(p, 24, '>u4').ravel(),\
+            'bit': _be(p, 28, '>u2').ravel()}
+
+
+def decode(frames, packet_type):
+    '''
+    Decode frames of a packet type with its decode_xx function.
+    '''
+    decoder = globals().get('decode_' + packet_type)
+    if decoder is None:
+        raise ValueError('Bulk decoding is not supported for packet type: %s'% packet_type)
+    return decoder(frames)
+
+
+def decode_file(file_name, packet_type, chunk=chunk_bytes):
+    '''
+    Decode all frames of a packet type in a capture file.
+    Returns:
+        dict of arrays, concatenated over the whole file, plus 'offset' of each frame.
+    '''
+    out = {}
+    for offsets, frames in iter_frames(file_name, packet_type, chunk):
+        res = decode(frames, packet_type)
+        res['offset'] = offsets
+        for k in res:
+            out.setdefault(k, []).append(res[k])
+    return {k: np.concatenate(out[k]) for k in out}
@@ -0,0 +1,132 @@
+import json
+import numpy as np
+
+# sensors of a unit calibration, in the order of imu38x.sensor_fields
+sensors = ['acc', 'gyro']
+
+
+class sensor_calibration:
+    '''
+    Bias, scale and misalignment of a triad, corrected = M * (raw - b).
+    M holds the scale factors on the diagonal and the misalignment off the diagonal.
+    Applied to a single sample or to an nx3 block as one matrix multiply.
+    '''
+    def __init__(self, matrix=None, bias=None):
+        '''
+        Args:
+            matrix: 3x3 matrix, identity if None
+            bias: 3 bias vector, zero if None
+        '''
+        self.matrix = np.eye(3) if matrix is None else np.array(matrix, dtype=np.float64)
+        self.bias = np.zeros((3,)) if bias is None else np.array(bias, dtype=np.float64)
+        if self.matrix.shape != (3, 3) or self.bias.shape != (3,):
+            raise ValueError('Calibration needs a 3x3 matrix and a 3-element bias.')
+        # row vectors are multiplied from the left by M^T
+        self.mt = self.matrix.T.copy()
+        self.identity = not self.bias.any() and np.array_equal(self.matrix, np.eye(3))
+
+    def apply(self, data):
+        '''
+        Args:
+            data: 3x1 or nx3 array like
+        Return:
+            corrected data, numpy array of the same shape. The input is not modified.
+        '''
+        data = np.asarray(data, dtype=np.float64)
+        if self.identity:
+            return data.copy()
+        return np.dot(data - self.bias, self.mt)
+
+    def __call__(self, data):
+        return self.apply(data)
+
+    def to_dict(self):
+        return {'matrix': self.matrix.tolist(), 'bias': self.bias.tolist()}
+
+
+class unit_calibration:
+    '''
+    Accel and gyro calibration of one unit.
+    '''
+    def __init__(self, cal=None):
+        '''
+        Args:
+            cal: dict like {'acc': {'matrix': ..., 'bias': ...}, 'gyro': {...}}, or
+                another unit_calibration. Missing sensors are not corrected.
+        '''
+        if isinstance(cal, unit_calibration):
+            cal = cal.to_dict()
+        if cal is None:
+            cal = {}
+        self.acc = sensor_calibration(**cal.get('acc', {}))
+        self.gyro = sensor_calibration(**cal.get('gyro', {}))
+        self.identity = self.acc.identity and self.gyro.identity
+
+    def apply(self, acc, gyro):
+        '''
+        Correct accel and gyro, single samples or nx3 blocks.
+        '''
+        return self.acc.apply(acc), self.gyro.apply(gyro)
+
+    def to_dict(self):
+        return {'acc': self.acc.to_dict(), 'gyro': self.gyro.to_dict()}
+
+    def __repr__(self):
+        return 'unit_calibration(%s)'% self.to_dict()
+
+
+def load_calibration(file_name):
+    '''
+    Load a calibration file keyed by unit name, like
+        {
+            "nxp": {"acc": {"matrix": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+                            "bias": [0.01, -0.02, 0.0]},
+                    "gyro": {"bias": [0.1, 0.0, -0.05]}},
+            "bosch": {...}
+        }
+    Returns:
+        dict of unit name and unit_calibration
+    '''
+    with open(file_name, 'r') as f:
+        cals = json.load(f)
+    return {name: unit_calibration(cals[name]) for name in cals}
+
+
+def save_calibration(file_name, cals):
+    with open(file_name, 'w') as f:
+        json.dump({name: unit_calibration(cals[name]).to_dict() for name in cals}, f, indent=4)
+
+
+def get_calibration(cals, name):
+    '''
+    Calibration of a unit, None if cals is None or the unit is not calibrated.
+    Args:
+        cals: dict returned by load_calibration, or a calibration file name
+    '''
+    if cals is None:
+        return None
+    if isinstance(cals, str):
+        cals = load_calibration(cals)
+    return cals.get(name)
+
+
+class calibrated_view:
+    '''
+    An nx3 array, e.g. a memory-mapped log, corrected only when rows are sliced, so
+    calibrating a log larger than RAM does not copy it.
+    '''
+    def __init__(self, data, cal):
+        '''
+        Args:
+            data: nx3 array
+            cal: sensor_calibration
+        '''
+        self.data = data
+        self.cal = cal
+        self.shape = data.shape
+        self.ndim = data.ndim
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            return self.cal.apply(self.data[idx[0]])[(slice(None),) + idx[1:]]
+        return self.cal.apply(self.data[idx])
@@ -0,0 +1,248 @@
+import time
+import socket
+import struct
+from multiprocessing import Process, RawArray, Value
+import numpy as np
+
+#### default UDP settings, the same as the loggers used before
+udp_port = 10600
+udp_network = '<broadcast>'
+
+
+class ring_buffer:
+    '''
+    Shared-memory ring of fixed-width float64 samples.
+    There is only one writer (the acquisition loop), and any number of readers in
+    other processes. Each reader keeps its own read index, so a slow reader only
+    loses the oldest samples and never blocks the writer.
+    '''
+    def __init__(self, width, capacity=4096):
+        '''
+        Args:
+            width: number of float64 values in each sample
+            capacity: number of samples kept in the ring
+        '''
+        self.width = width
+        self.capacity = capacity
+        self.raw = RawArray('d', width * capacity)
+        # total number of samples ever written
+        self.head = Value('Q', 0)
+        self.buf = None
+
+    def _view(self):
+        # the numpy view is created lazily since it cannot be pickled to child processes
+        if self.buf is None:
+            self.buf = np.frombuffer(self.raw, dtype=np.float64).reshape(self.capacity, self.width)
+        return self.buf
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['buf'] = None
+        return state
+
+    def write(self, sample):
+        '''
+        Write one sample. The slot is filled before the head is advanced, so readers
+        never see a partial sample.
+        '''
+        buf = self._view()
+        head = self.head.value
+        buf[head % self.capacity, :] = sample
+        self.head.value = head + 1
+
+    def latest_index(self):
+        return self.head.value
+
+    def read(self, idx):
+        '''
+        Read all samples written since idx.
+        Args:
+            idx: read index of the reader, number of samples already read.
+        Returns:
+            new_idx: new read index
+            samples: nxwidth numpy array, n may be 0.
+            lost: number of samples overwritten before they were read.
+        '''
+        buf = self._view()
+        head = self.head.value
+        lost = 0
+        if head - idx > self.capacity:
+            lost = head - idx - self.capacity
+            idx = head - self.capacity
+        n = head - idx
+        if n == 0:
+            return head, np.zeros((0, self.width)), lost
+        i0 = idx % self.capacity
+        i1 = head % self.capacity
+        if i0 < i1:
+            samples = buf[i0:i1].copy()
+        else:
+            samples = np.vstack((buf[i0:], buf[:i1]))
+        # the writer may have wrapped around while copying, drop samples that changed,
+        #   including the one being written
+        overrun = self.head.value + 1 - idx - self.capacity
+        if overrun > 0:
+            samples = samples[overrun:]
+            lost += overrun
+        return head, samples, lost
+
+
+def run_publisher(ring, handler, rate, decimation):
+    '''
+    Publisher worker. Wake up at rate Hz, read new samples from the ring, keep every
+    decimation-th one and pass them to the handler.
+    A handler with a true attribute indexed is called as handler(samples, seq), seq
+    the number of decimated samples before samples[0] since the publisher started.
+    seq comes from the absolute index in the ring, so samples lost by the ring leave
+    a gap in it.
+    '''
+    idx = ring.latest_index()
+    # the decimation grid is anchored to the absolute index in the ring
+    first = idx
+    period = 1.0 / rate
+    indexed = getattr(handler, 'indexed', False)
+    total_lost = 0
+    if hasattr(handler, 'open'):
+        handler.open()
+    try:
+        while True:
+            tstart = time.time()
+            idx, samples, lost = ring.read(idx)
+            total_lost += lost
+            n = samples.shape[0]
+            if n > 0:
+                # absolute index of samples[0], the samples end at idx
+                i0 = idx - n
+                skip = (first - i0) % decimation
+                selected = samples[skip::decimation]
+                if selected.shape[0] > 0:
+                    if indexed:
+                        handler(selected, (i0 + skip - first) // decimation)
+                    else:
+                        handler(selected)
+            dt = period - (time.time() - tstart)
+            if dt > 0:
+                time.sleep(dt)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if total_lost > 0:
+            print('%s lost %u samples.'% (type(handler).__name__, total_lost))
+        if hasattr(handler, 'close'):
+            handler.close()
+
+
+class udp_sender:
+    '''
+    Broadcast samples over UDP, one datagram per sample.
+    Args:
+        cols: columns of the sample to send, all columns if None.
+        fmt: struct format of the datagram, 'd' for each column if None.
+    '''
+    def __init__(self, cols=None, fmt=None, port=udp_port, network=udp_network):
+        self.cols = cols
+        self.fmt = fmt
+        self.port = port
+        self.network = network
+        self.s = None
+
+    def open(self):
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def __call__(self, samples):
+        if self.cols is not None:
+            samples = samples[:, self.cols]
+        fmt = self.fmt
+        if fmt is None:
+            fmt = 'd' * samples.shape[1]
+        for row in samples:
+            self.s.sendto(struct.pack(fmt, *row), (self.network, self.port))
+
+    def close(self):
+        if self.s is not None:
+            self.s.close()
+
+
+class kml_updater:
+    '''
+    Update a dynamic kml file with the latest position and heading.
+    Args:
+        lla_cols: columns of [lat lon alt] in the sample
+        heading_col: column of the heading, deg
+    '''
+    def __init__(self, kml_file, lla_cols, heading_col=None, color='ffff0000'):
+        self.kml_file = kml_file
+        self.lla_cols = lla_cols
+        self.heading_col = heading_col
+        self.color = color
+
+    def __call__(self, samples):
+        import kml.dynamic_kml as kml
+        latest = samples[-1]
+        heading = None
+        if self.heading_col is not None:
+            heading = latest[self.heading_col]
+        kml.gen_kml(self.kml_file, latest[self.lla_cols], heading, self.color)
+
+
+class pipe_feeder:
+    '''
+    Forward decimated samples to a consumer process (a plot, for example) through
+    a pipe. If the consumer does not keep up, only this publisher blocks, and the
+    samples it misses are dropped by the ring.
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __call__(self, samples):
+        if self.conn is None:
+            return
+        try:
+            self.conn.send(samples)
+        except (EOFError, OSError):
+            # the consumer is gone, e.g. its plot window was closed
+            self.conn = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class data_bus:
+    '''
+    Publish/subscribe bus decoupling acquisition from data consumers.
+    The acquisition loop calls publish() for each sample, which only copies the
+    sample into shared memory. Each consumer runs in its own process at its own
+    rate and decimation.
+    '''
+    def __init__(self, width, capacity=4096):
+        self.ring = ring_buffer(width, capacity)
+        self.publishers = []
+        self.processes = []
+
+    def add_publisher(self, handler, rate=10.0, decimation=1):
+        '''
+        Args:
+            handler: callable taking a nxwidth numpy array, optionally with open() and
+                close(), which are called in the publisher process.
+            rate: how many times per second the publisher reads the ring, Hz.
+            decimation: only every decimation-th sample is passed to the handler.
+        '''
+        self.publishers.append((handler, rate, int(max(decimation, 1))))
+
+    def start(self):
+        for handler, rate, decimation in self.publishers:
+            p = Process(target=run_publisher, args=(self.ring, handler, rate, decimation))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+
+    def publish(self, sample):
+        self.ring.write(sample)
+
+    def stop(self):
+        for p in self.processes:
+            p.terminate()
+            p.join()
+        self.processes = []
@@ -0,0 +1,353 @@
+"""
+Simulated devices over Linux pseudo-terminals.
+
+A simulator opens a pty pair and writes valid packets to the master side at a
+configurable rate. The slave side path (for example /dev/pts/5) can be used as the
+port of imu38x.imu38x, ins1000.ins1000, openimu.openimu, the log scripts or a rig,
+so the acquisition pipeline can be tested and measured without hardware.
+Byte errors, gaps and bursts can be injected to exercise the resync logic.
+"""
+
+import os
+import sys
+import time
+import math
+import tty
+import random
+import struct
+import threading
+from multiprocessing import Process, Pipe
+import imu38x
+import ins1000
+
+G = 9.80665
+pow_2_16 = math.pow(2, 16)
+
+
+def encode_packet(packet_type, payload):
+    '''
+    Frame a payload as a 5555 packet.
+    Args:
+        packet_type: key of imu38x.packet_def
+        payload: bytes
+    Returns:
+        bytes of the whole packet, including header and crc.
+    '''
+    body = bytes(imu38x.packet_def[packet_type][1]) + bytes([len(payload)]) + bytes(payload)
+    crc = imu38x.crc16(body)
+    return bytes(imu38x.preamble) + body + struct.pack('>H', crc)
+
+
+def encode_nav(time_s, lla, vel, quat):
+    '''
+    Frame an INS1000 nav packet.
+    Args:
+        time_s: time, s
+        lla: [lat lon alt], deg deg m
+        vel: NED velocity, m/s
+        quat: quaternion, scalar first
+    '''
+    payload = bytearray(ins1000.payload_len)
+    struct.pack_into('ddd', payload, 0, time_s, lla[0], lla[1])
+    struct.pack_into('f', payload, 24, lla[2])
+    struct.pack_into('fff', payload, 28, vel[0], vel[1], vel[2])
+    struct.pack_into('ffff', payload, 40, quat[0], quat[1], quat[2], quat[3])
+    crc = ins1000.calc_crc(payload)
+    return bytes(ins1000.nav_header) + struct.pack('<H', ins1000.payload_len) +\
+           bytes(payload) + struct.pack('>H', crc)
+
+
+def _i16(x, scale):
+    return int(max(-32768, min(32767, round(x * scale))))
+
+
+def _i32(x, scale):
+    return int(max(-2147483648, min(2147483647, round(x * scale))))
+
+
+class motion:
+    '''
+    A static unit with white noise, the source of the simulated packets.
+    acc in m/s2, gyro in deg/s, euler [roll pitch yaw] in deg.
+    '''
+    def __init__(self, acc_noise=0.02, gyro_noise=0.1, seed=None):
+        self.rng = random.Random(seed)
+        self.acc_noise = acc_noise
+        self.gyro_noise = gyro_noise
+        self.lla = [31.0, 121.0, 10.0]
+        self.temp = 25.0
+
+    def sample(self):
+        acc = [self.rng.gauss(0, self.acc_noise), self.rng.gauss(0, self.acc_noise),\
+               -G + self.rng.gauss(0, self.acc_noise)]
+        gyro = [self.rng.gauss(0, self.gyro_noise) for i in range(3)]
+        euler = [self.rng.gauss(0, 0.05), self.rng.gauss(0, 0.05), 90.0 + self.rng.gauss(0, 0.05)]
+        return acc, gyro, euler
+
+
+def make_payload(packet_type, k, t, m):
+    '''
+    Payload of the k-th packet at time t (s) from the motion m.
+    '''
+    acc, gyro, euler = m.sample()
+    acc_g = [x / G for x in acc]
+    ms = int(t * 1000) & 0xffffffff
+    temp = m.temp
+    if packet_type == 'S0':
+        return struct.pack('>13hHH', *([_i16(x, pow_2_16 / (G * 20)) for x in acc] +\
+                                       [_i16(x, pow_2_16 / 1260) for x in gyro] +\
+                                       [_i16(x, pow_2_16 / 2) for x in (0.2, 0.0, 0.4)] +\
+                                       [_i16(temp, pow_2_16 / 200)] * 4), k & 0xffff, 0)
+    elif packet_type == 'S1':
+        return struct.pack('>10hHH', *([_i16(x, pow_2_16 / (G * 20)) for x in acc] +\
+                                       [_i16(x, pow_2_16 / 1260) for x in gyro] +\
+                                       [_i16(temp, pow_2_16 / 200)] * 4), k & 0xffff, 0)
+    elif packet_type == 'SH':
+        return struct.pack('>6ihHH', *([_i32(x, 4e6) for x in acc_g] +\
+                                       [_i32(x, 2.56e5) for x in gyro]),\
+                           _i16(temp, pow_2_16 / 400), k & 0xffff, 0)
+    elif packet_type == 'A1':
+        return struct.pack('>13hIH', *([_i16(x, pow_2_16 / 360) for x in euler] +\
+                                       [_i16(x, pow_2_16 / 1260) for x in gyro] +\
+                                       [_i16(x, pow_2_16 / 20) for x in acc_g] +\
+                                       [_i16(x, pow_2_16 / 2) for x in (0.2, 0.0, 0.4)] +\
+                                       [_i16(temp, pow_2_16 / 200)]), ms, 0)
+    elif packet_type == 'A2':
+        return struct.pack('>12hIH', *([_i16(x, pow_2_16 / 360) for x in euler] +\
+                                       [_i16(x, pow_2_16 / 1260) for x in gyro] +\
+                                       [_i16(x, pow_2_16 / 20) for x in acc_g] +\
+                                       [_i16(temp, pow_2_16 / 200)] * 3), ms, 0)
+    elif packet_type == 'z1':
+        return struct.pack('=Ifffffffff', ms, *(acc + gyro + [0.2, 0.0, 0.4]))
+    elif packet_type == 's1':
+        return struct.pack('=IQffffffffff', ms, k, *(acc + gyro + [0.2, 0.0, 0.4, temp]))
+    elif packet_type == 'a2':
+        return struct.pack('=Idfffffffff', ms, t, *(euler[::-1] + gyro + acc))
+    elif packet_type == 'e1':
+        return struct.pack('=Id15fBBB', ms, t, *(euler + acc_g + gyro + [0.0] * 3 +\
+                                                 [0.2, 0.0, 0.4]), 1, 0, 0)
+    elif packet_type == 'e2':
+        return struct.pack('=Id21fdddBBB', ms, t, *(euler + acc + [0.0] * 3 + gyro +\
+                                                    [0.0] * 3 + [0.0] * 3 + [0.2, 0.0, 0.4] +\
+                                                    m.lla), 1, 0, 0)
+    elif packet_type == 'id':
+        return struct.pack('=IfI21f6dBBB', ms, euler[2], ms, *(euler + acc_g + [1.0, 1.0, 2.0] +\
+                                                           gyro + [0.0] * 3 + [0.0] * 3 +\
+                                                           [0.0] * 3 + m.lla + m.lla),\
+                           1, 12, 0x03)
+    elif packet_type == 'sd':
+        return struct.pack('=I10fbbI', ms, *(gyro + acc + [0.0] * 3 + [0.0]), 1, 4, ms)
+    elif packet_type == 'FM':
+        # four chips in each packet, four packets (16 chips) for each sample index
+        counts = []
+        for i in range(4):
+            counts += [_i32(x, 4e6) for x in acc_g] + [_i32(x, 2.56e5) for x in gyro] +\
+                      [_i32(temp, 256)]
+        return struct.pack('>28iHH', *counts, k % 4, (k // 4) & 0xffff)
+    else:
+        # E3, MG, SA: counter and zeros
+        n = imu38x.packet_def[packet_type][0] - 7
+        return struct.pack('>I', ms) + bytes(n - 4)
+
+
+class device_sim:
+    '''
+    Write packets of one device to the master side of a pty.
+    '''
+    def __init__(self, packet_type='S1', rate=100.0, unit_type='imu38x',\
+                 byte_error_rate=0.0, gap_prob=0.0, gap_duration=0.5,\
+                 burst_prob=0.0, burst_len=50, seed=None):
+        '''
+        Args:
+            packet_type: key of imu38x.packet_def, or 'nav' for INS1000.
+            rate: packet rate, Hz. 0 to send as fast as possible.
+            unit_type: 'imu38x', 'openimu' (z1) or 'ins1000' (nav)
+            byte_error_rate: probability of corrupting each byte
+            gap_prob: probability per packet to stop sending for gap_duration seconds
+            burst_prob: probability per packet to send burst_len packets at once
+            seed: random seed, for reproducible error patterns
+        '''
+        self.unit_type = unit_type.lower()
+        if self.unit_type == 'ins1000':
+            packet_type = 'nav'
+        elif self.unit_type == 'openimu':
+            packet_type = 'z1'
+        elif packet_type not in imu38x.packet_def:
+            raise ValueError('Unsupported packet type: %s'% packet_type)
+        self.packet_type = packet_type
+        self.rate = rate
+        self.byte_error_rate = byte_error_rate
+        self.gap_prob = gap_prob
+        self.gap_duration = gap_duration
+        self.burst_prob = burst_prob
+        self.burst_len = burst_len
+        self.rng = random.Random(seed)
+        self.motion = motion(seed=seed)
+        # open pty in raw mode
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        # statistics
+        self.sent = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.running = False
+        self.thread = None
+
+    def packet(self, k, t):
+        if self.packet_type == 'nav':
+            return encode_nav(t, self.motion.lla, [0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0])
+        return encode_packet(self.packet_type, make_payload(self.packet_type, k, t, self.motion))
+
+    def corrupt(self, data):
+        if self.byte_error_rate <= 0:
+            return data
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self.rng.random() < self.byte_error_rate:
+                data[i] ^= 1 << self.rng.randrange(8)
+                self.corrupted += 1
+        return bytes(data)
+
+    def write(self, data):
+        try:
+            n = os.write(self.master, data)
+        except BlockingIOError:
+            # the reader does not keep up, the pty buffer is full
+            n = 0
+        if n < len(data):
+            self.dropped += 1
+        else:
+            self.sent += 1
+
+    def run(self, duration=float('inf')):
+        '''
+        Send packets until stop() or duration seconds.
+        '''
+        self.running = True
+        tstart = time.time()
+        k = 0
+        while self.running:
+            t = time.time() - tstart
+            if t > duration:
+                break
+            n = 1
+            if self.burst_prob > 0 and self.rng.random() < self.burst_prob:
+                n = self.burst_len
+            data = b''.join(self.packet(k + i, t) for i in range(n))
+            self.write(self.corrupt(data))
+            k += n
+            if self.gap_prob > 0 and self.rng.random() < self.gap_prob:
+                time.sleep(self.gap_duration)
+            if self.rate > 0:
+                # keep the average rate, bursts and gaps included
+                dt = k / self.rate - (time.time() - tstart)
+                if dt > 0:
+                    time.sleep(dt)
+        self.running = False
+
+    def start(self, duration=float('inf')):
+        '''
+        Send packets in a background thread.
+        '''
+        self.thread = threading.Thread(target=self.run, args=(duration,))
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class _counter:
+    '''
+    Pipe stand-in counting decoded packets.
+    '''
+    def __init__(self):
+        self.n = 0
+
+    def send(self, latest):
+        self.n += 1
+
+
+def _read_unit(port, baud, packet_type, unit_type, duration, latency, conn):
+    counter = _counter()
+    if unit_type == 'ins1000':
+        reader = ins1000.ins1000(port, baud, pipe=counter)
+    else:
+        reader = imu38x.imu38x(port, baud, packet_type, pipe=counter)
+    if unit_type == 'ins1000':
+        t = threading.Thread(target=reader.start)
+    else:
+        t = threading.Thread(target=reader.start, kwargs={'latency': latency})
+    t.daemon = True
+    # port is open, the simulator can start
+    conn.send('ready')
+    cpu0 = time.process_time()
+    t.start()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu0
+    wakeups = getattr(reader, 'wakeups', 0)
+    conn.send((counter.n, cpu, wakeups))
+
+
+def measure(packet_type='S1', rate=100.0, duration=5.0, unit_type='imu38x', baud=115200,\
+            latency=0.02, **kwargs):
+    '''
+    Feed a reader process from a simulator and measure it.
+    Args:
+        latency: read latency of imu38x.start
+        kwargs: error injection settings of device_sim
+    Returns:
+        dict of sent/dropped/decoded packets, decoded rate (Hz), CPU of the reader (%)
+        and reader wakeups per second.
+    '''
+    sim = device_sim(packet_type, rate, unit_type, **kwargs)
+    parent_conn, child_conn = Pipe()
+    p = Process(target=_read_unit, args=(sim.port, baud, sim.packet_type, sim.unit_type,\
+                                         duration, latency, child_conn))
+    p.daemon = True
+    p.start()
+    parent_conn.recv()
+    sim.start(duration)
+    decoded, cpu, wakeups = parent_conn.recv()
+    p.terminate()
+    p.join()
+    sim.close()
+    return {'sent': sim.sent,\
+            'dropped': sim.dropped,\
+            'corrupted_bytes': sim.corrupted,\
+            'decoded': decoded,\
+            'decoded_rate': decoded / duration,\
+            'cpu': 100.0 * cpu / duration,\
+            'wakeup_rate': wakeups / duration}
+
+
+if __name__ == "__main__":
+    # python device_sim.py [packet_type] [rate] [unit_type]
+    packet_type = 'S1'
+    rate = 100.0
+    unit_type = 'imu38x'
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        packet_type = sys.argv[1]
+        if num_of_args > 2:
+            rate = float(sys.argv[2])
+            if num_of_args > 3:
+                unit_type = sys.argv[3]
+    sim = device_sim(packet_type, rate, unit_type)
+    print('Simulated %s %s at %.1f Hz on %s'% (unit_type, sim.packet_type, rate, sim.port))
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        print('Sent %u packets, dropped %u.'% (sim.sent, sim.dropped))
+        sim.close()
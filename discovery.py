@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import threading
+import serial
+import serial.tools.list_ports
+import imu38x
+import ins1000
+
+#### default probing settings
+# baud rates to try, most common first
+baud_rates = [115200, 230400, 460800, 57600, 38400]
+# time to listen at each baud rate, s
+listen_time = 0.15
+# number of valid frames to accept a packet type
+min_frames = 2
+
+# packet type of each 2-byte code after the 5555 preamble
+packet_codes = {bytes(v[1]): k for k, v in imu38x.packet_def.items()}
+
+
+def scan_frames(data):
+    '''
+    Count CRC-valid frames of each packet type in a chunk of raw data.
+    Args:
+        data: bytes
+    Returns:
+        dict of packet type and number of valid frames. INS1000 nav frames are
+        counted as 'nav'.
+    '''
+    counts = {}
+    n = len(data)
+    # 5555 packets
+    idx = data.find(imu38x.preamble)
+    while 0 <= idx <= n - 5:
+        code = bytes(data[idx+2:idx+4])
+        packet_type = packet_codes.get(code)
+        if packet_type is not None:
+            size = imu38x.packet_def[packet_type][0]
+            if data[idx+4] == size - 7 and idx + size <= n:
+                crc = 256 * data[idx+size-2] + data[idx+size-1]
+                if crc == imu38x.crc16(data[idx+2:idx+size-2]):
+                    counts[packet_type] = counts.get(packet_type, 0) + 1
+                    idx = data.find(imu38x.preamble, idx + size)
+                    continue
+        idx = data.find(imu38x.preamble, idx + 1)
+    # INS1000 nav packets
+    idx = data.find(ins1000.nav_header)
+    while 0 <= idx <= n - ins1000.nav_size:
+        payload = data[idx+6:idx+6+ins1000.payload_len]
+        crc = 256 * data[idx+ins1000.nav_size-2] + data[idx+ins1000.nav_size-1]
+        if crc == ins1000.calc_crc(payload):
+            counts['nav'] = counts.get('nav', 0) + 1
+            idx = data.find(ins1000.nav_header, idx + ins1000.nav_size)
+        else:
+            idx = data.find(ins1000.nav_header, idx + 1)
+    return counts
+
+
+def probe_port(port, bauds=None, listen=listen_time):
+    '''
+    Find the baud rate and the dominant packet type of a port.
+    The baud rates of one port can only be tried one after another. Once the port
+    is open, the baud rate is changed in place, which is much faster than reopening.
+    Args:
+        port: serial port name
+        bauds: baud rates to try, baud_rates if None
+        listen: time to listen at each baud rate, s
+    Returns:
+        dict of 'port', 'baud', 'packet_type', 'unit_type', 'frames', or None if
+        no valid frames are found.
+    '''
+    if bauds is None:
+        bauds = baud_rates
+    try:
+        ser = serial.Serial(port, bauds[0], timeout=listen)
+    except (serial.SerialException, OSError):
+        return None
+    result = None
+    try:
+        for baud in bauds:
+            if ser.baudrate != baud:
+                ser.baudrate = baud
+            ser.reset_input_buffer()
+            data = bytearray()
+            tstart = time.time()
+            while time.time() - tstart < listen:
+                data += ser.read(max(ser.in_waiting, 1))
+            counts = scan_frames(data)
+            if counts:
+                packet_type = max(counts, key=counts.get)
+                if counts[packet_type] >= min_frames:
+                    result = {'port': port,\
+                              'baud': baud,\
+                              'packet_type': packet_type,\
+                              'unit_type': 'ins1000' if packet_type == 'nav' else 'imu38x',\
+                              'frames': counts}
+                    break
+    except (serial.SerialException, OSError):
+        result = None
+    finally:
+        ser.close()
+    return result
+
+
+def list_ports():
+    return [p.device for p in serial.tools.list_ports.comports()]
+
+
+def discover(ports=None, bauds=None, listen=listen_time, packet_types=None):
+    '''
+    Probe all candidate ports at the same time.
+    Args:
+        ports: list of ports, all serial ports of the system if None
+        bauds: baud rates to try
+        listen: time to listen at each baud rate, s
+        packet_types: only keep units sending one of these packet types
+    Returns:
+        rig description usable by rig.run, units sorted by port name.
+    '''
+    if ports is None:
+        ports = list_ports()
+    results = [None] * len(ports)
+
+    def worker(i):
+        results[i] = probe_port(ports[i], bauds, listen)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(ports))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    units = []
+    for res in results:
+        if res is None:
+            continue
+        if packet_types is not None and res['packet_type'] not in packet_types:
+            continue
+        res['name'] = os.path.basename(res['port'])
+        res['enable'] = True
+        units.append(res)
+    units.sort(key=lambda x: x['port'])
+    return {'units': units}
+
+
+if __name__ == "__main__":
+    # python discovery.py [port1 port2 ...]
+    ports = None
+    if len(sys.argv) > 1:
+        ports = sys.argv[1:]
+    tstart = time.time()
+    rig = discover(ports)
+    print('Discovery took %.2f s.'% (time.time() - tstart))
+    for unit in rig['units']:
+        print('%s: %s at %u baud, %s'% (unit['port'], unit['packet_type'], unit['baud'], unit['frames']))
@@ -0,0 +1,91 @@
+import sys
+import numpy as np
+import bulk_decode
+import timebase
+
+# chips in each FM packet
+chips_per_packet = 4
+# accel xyz, rate xyz and temperature
+fields_per_chip = 7
+
+
+def unwrap_idx(idx, bits=16):
+    '''
+    Unwrap a rolling index into a monotonic one, see timebase.unwrap.
+    Args:
+        idx: n integer array
+    Returns:
+        n int64 array, idx[0] is kept as the start.
+    '''
+    return timebase.unwrap(idx, 1 << bits)
+
+
+def assemble(counts, subset, sample_idx, n_chips=None):
+    '''
+    Group FM packets of the same sampleIdx into dense arrays.
+    Args:
+        counts: nx4x7 counts of each packet
+        subset: n sensorSubset of each packet
+        sample_idx: n sampleIdx of each packet
+        n_chips: number of chips, from the largest subset if None
+    Returns:
+        idx: m unwrapped sample indexes
+        data: mxn_chipsx7 int32 counts, zero where missing
+        mask: mxn_chips bool, True where the chip is present in the sample
+    '''
+    subset = np.asarray(subset, dtype=np.int64)
+    if n_chips is None:
+        n_chips = chips_per_packet * (int(subset.max()) + 1) if subset.shape[0] else 0
+    idx_all = unwrap_idx(sample_idx)
+    idx, row = np.unique(idx_all, return_inverse=True)
+    data = np.zeros((idx.shape[0], n_chips, fields_per_chip), dtype=np.int32)
+    mask = np.zeros((idx.shape[0], n_chips), dtype=bool)
+    rows = np.repeat(row, chips_per_packet)
+    cols = (subset[:, None] * chips_per_packet + np.arange(chips_per_packet)).ravel()
+    # subsets beyond n_chips are ignored
+    ok = cols < n_chips
+    data[rows[ok], cols[ok]] = counts.reshape(-1, fields_per_chip)[ok]
+    mask[rows[ok], cols[ok]] = True
+    return idx, data, mask
+
+
+def assemble_file(file_name, n_chips=None, chunk=bulk_decode.chunk_bytes):
+    '''
+    Assemble all FM packets of a capture file.
+    Returns:
+        the same as assemble(), and a dict of statistics
+    '''
+    all_counts = []
+    all_subset = []
+    all_idx = []
+    for offsets, frames in bulk_decode.iter_frames(file_name, 'FM', chunk):
+        counts, subset, sample_idx = bulk_decode.decode_FM(frames)
+        all_counts.append(counts)
+        all_subset.append(subset)
+        all_idx.append(sample_idx)
+    if len(all_counts) == 0:
+        counts = np.zeros((0, chips_per_packet, fields_per_chip), dtype=np.int32)
+        subset = np.zeros((0,), dtype=np.int64)
+        sample_idx = np.zeros((0,), dtype=np.int64)
+    else:
+        counts = np.concatenate(all_counts)
+        subset = np.concatenate(all_subset)
+        sample_idx = np.concatenate(all_idx)
+    idx, data, mask = assemble(counts, subset, sample_idx, n_chips)
+    complete = mask.all(axis=1)
+    stats = {'packets': counts.shape[0],\
+             'samples': idx.shape[0],\
+             'complete_samples': int(complete.sum()),\
+             'missing_samples': int(idx[-1] - idx[0] + 1 - idx.shape[0]) if idx.shape[0] else 0,\
+             'chips': data.shape[1]}
+    return idx, data, mask, stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Usage: python fm_assembler.py capture_file [output.npz]')
+        exit()
+    idx, data, mask, stats = assemble_file(sys.argv[1])
+    print(stats)
+    if len(sys.argv) > 2:
+        np.savez(sys.argv[2], idx=idx, data=data, mask=mask)
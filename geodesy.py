@@ -0,0 +1,181 @@
+"""
+WGS-84 position conversions, vectorized.
+
+Positions are [lat lon alt] in [deg deg m], the same as the logs and kml, as a
+single 3-vector or an nx3 array. ECEF to LLA uses Heikkinen's closed form, exact
+to well below a millimetre at any altitude of interest, without iterations.
+"""
+
+import numpy as np
+import attitude
+
+# WGS-84
+a = 6378137.0
+f = 1.0 / 298.257223563
+b = a * (1.0 - f)
+e2 = f * (2.0 - f)
+ep2 = e2 / (1.0 - e2)
+# mean radius for great-circle distances
+r_mean = (2.0 * a + b) / 3.0
+
+
+def _cols(x):
+    x = np.asarray(x, dtype=np.float64)
+    return x, x.ndim == 1
+
+
+def lla2ecef(lla):
+    '''
+    Args:
+        lla: 3 or nx3 [lat lon alt], [deg deg m]
+    Returns:
+        ECEF position of the same shape, m
+    '''
+    lla, single = _cols(lla)
+    lla = np.atleast_2d(lla)
+    lat = lla[:, 0] * attitude.D2R
+    lon = lla[:, 1] * attitude.D2R
+    alt = lla[:, 2]
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    rn = a / np.sqrt(1.0 - e2 * sin_lat * sin_lat)
+    xyz = np.empty(lla.shape)
+    xyz[:, 0] = (rn + alt) * cos_lat * np.cos(lon)
+    xyz[:, 1] = (rn + alt) * cos_lat * np.sin(lon)
+    xyz[:, 2] = (rn * (1.0 - e2) + alt) * sin_lat
+    return xyz[0] if single else xyz
+
+
+def ecef2lla(xyz):
+    '''
+    Args:
+        xyz: 3 or nx3 ECEF position, m
+    Returns:
+        [lat lon alt] of the same shape, [deg deg m]
+    '''
+    xyz, single = _cols(xyz)
+    xyz = np.atleast_2d(xyz)
+    x = xyz[:, 0]
+    y = xyz[:, 1]
+    z = xyz[:, 2]
+    # Heikkinen
+    r2 = x * x + y * y
+    r = np.sqrt(r2)
+    ff = 54.0 * b * b * z * z
+    g = r2 + (1.0 - e2) * z * z - e2 * (a * a - b * b)
+    c = e2 * e2 * ff * r2 / (g * g * g)
+    s = np.cbrt(1.0 + c + np.sqrt(c * c + 2.0 * c))
+    p = ff / (3.0 * (s + 1.0 / s + 1.0)**2 * g * g)
+    q = np.sqrt(1.0 + 2.0 * e2 * e2 * p)
+    r0 = -(p * e2 * r) / (1.0 + q) +\
+         np.sqrt(np.maximum(0.5 * a * a * (1.0 + 1.0 / q) - p * (1.0 - e2) * z * z / (q * (1.0 + q))\
+                            - 0.5 * p * r2, 0.0))
+    u = np.sqrt((r - e2 * r0)**2 + z * z)
+    v = np.sqrt((r - e2 * r0)**2 + (1.0 - e2) * z * z)
+    z0 = b * b * z / (a * v)
+    lla = np.empty(xyz.shape)
+    lla[:, 0] = np.arctan2(z + ep2 * z0, r) * attitude.R2D
+    lla[:, 1] = np.arctan2(y, x) * attitude.R2D
+    lla[:, 2] = u * (1.0 - b * b / (a * v))
+    return lla[0] if single else lla
+
+
+def ned_matrix(ref_lla):
+    '''
+    Rotation from ECEF to the local NED frame at each reference point.
+    Args:
+        ref_lla: 3 or nx3 [lat lon alt]
+    Returns:
+        3x3 or nx3x3 matrices
+    '''
+    ref_lla, single = _cols(ref_lla)
+    ref_lla = np.atleast_2d(ref_lla)
+    lat = ref_lla[:, 0] * attitude.D2R
+    lon = ref_lla[:, 1] * attitude.D2R
+    sl = np.sin(lat)
+    cl = np.cos(lat)
+    so = np.sin(lon)
+    co = np.cos(lon)
+    c = np.empty((ref_lla.shape[0], 3, 3))
+    c[:, 0, 0] = -sl * co
+    c[:, 0, 1] = -sl * so
+    c[:, 0, 2] = cl
+    c[:, 1, 0] = -so
+    c[:, 1, 1] = co
+    c[:, 1, 2] = 0.0
+    c[:, 2, 0] = -cl * co
+    c[:, 2, 1] = -cl * so
+    c[:, 2, 2] = -sl
+    return c[0] if single else c
+
+
+def ecef2ned(xyz, ref_lla):
+    '''
+    ECEF positions in the NED frame about a reference.
+    Args:
+        xyz: 3 or nx3 ECEF position, m
+        ref_lla: a single reference [lat lon alt], or one per position (nx3)
+    Returns:
+        NED position of the same shape as xyz, m
+    '''
+    xyz, single = _cols(xyz)
+    ref_lla = np.asarray(ref_lla, dtype=np.float64)
+    d = np.atleast_2d(xyz) - np.atleast_2d(lla2ecef(ref_lla))
+    c = ned_matrix(ref_lla)
+    if c.ndim == 2:
+        ned = np.dot(d, c.T)
+    else:
+        ned = np.einsum('nij,nj->ni', c, d)
+    return ned[0] if single else ned
+
+
+def lla2ned(lla, ref_lla):
+    '''
+    Positions in the NED frame about a reference, see ecef2ned.
+    '''
+    return ecef2ned(lla2ecef(lla), ref_lla)
+
+
+def ned_error(lla, ref_lla):
+    '''
+    Position error in the local NED frame of each reference point.
+    Args:
+        lla, ref_lla: nx3 [lat lon alt] of the estimate and of the reference
+    Returns:
+        nx3 NED error, estimate - reference, m
+    '''
+    return ecef2ned(lla2ecef(lla), ref_lla)
+
+
+def local_distance(lla1, lla2):
+    '''
+    Horizontal and vertical distances in the local tangent plane of lla2.
+    Returns:
+        horizontal distance, vertical distance (up positive), m
+    '''
+    ned = ecef2ned(lla2ecef(lla1), lla2)
+    ned = np.atleast_2d(ned)
+    h = np.hypot(ned[:, 0], ned[:, 1])
+    v = -ned[:, 2]
+    if np.asarray(lla1).ndim == 1:
+        return h[0], v[0]
+    return h, v
+
+
+def great_circle(lla1, lla2, radius=r_mean):
+    '''
+    Great-circle distance on a sphere (haversine), ignoring altitude. An
+    approximation of the distance on the ellipsoid to about 0.5%; use
+    local_distance for errors of a few km or less.
+    Returns:
+        distance, m
+    '''
+    p1 = np.atleast_2d(np.asarray(lla1, dtype=np.float64)) * attitude.D2R
+    p2 = np.atleast_2d(np.asarray(lla2, dtype=np.float64)) * attitude.D2R
+    dlat = p2[:, 0] - p1[:, 0]
+    dlon = p2[:, 1] - p1[:, 1]
+    h = np.sin(0.5 * dlat)**2 + np.cos(p1[:, 0]) * np.cos(p2[:, 0]) * np.sin(0.5 * dlon)**2
+    d = 2.0 * radius * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+    if np.asarray(lla1).ndim == 1 and np.asarray(lla2).ndim == 1:
+        return float(d[0])
+    return d
@@ -0,0 +1,159 @@
+"""
+GPS time conversions on whole arrays.
+
+GPS time is [week, seconds of week] since 1980-01-06 and has no leap seconds.
+Conversions go through int64 nanoseconds and numpy datetime64, so arrays of any
+length are converted without Python loops. UTC conversions use the table of
+GPS-UTC offsets below, to be extended when a new leap second is announced.
+"""
+
+import time
+import numpy as np
+
+# start of GPS time
+gps_epoch = np.datetime64('1980-01-06T00:00:00', 'ns')
+unix_epoch = np.datetime64('1970-01-01T00:00:00', 'ns')
+week_seconds = 7 * 24 * 3600
+ns = 1000000000
+# UTC instants when GPS-UTC changed, and GPS-UTC from then on, s
+leap_seconds = [('1981-07-01', 1), ('1982-07-01', 2), ('1983-07-01', 3),\
+                ('1985-07-01', 4), ('1988-01-01', 5), ('1990-01-01', 6),\
+                ('1991-01-01', 7), ('1992-07-01', 8), ('1993-07-01', 9),\
+                ('1994-07-01', 10), ('1996-01-01', 11), ('1997-07-01', 12),\
+                ('1999-01-01', 13), ('2006-01-01', 14), ('2009-01-01', 15),\
+                ('2012-07-01', 16), ('2015-07-01', 17), ('2017-01-01', 18)]
+_leap_utc = np.array([np.datetime64(d, 'ns') for d, s in leap_seconds])
+_leap_offset = np.array([s for d, s in leap_seconds], dtype=np.int64)
+# the same instants on the GPS time scale
+_leap_gps = _leap_utc + (_leap_offset * ns).astype('timedelta64[ns]')
+
+
+def _gps_ns(week, sow):
+    week = np.asarray(week, dtype=np.int64)
+    sow = np.asarray(sow, dtype=np.float64)
+    return week * (week_seconds * ns) + np.round(sow * ns).astype(np.int64)
+
+
+def gps_to_datetime64(week, sow):
+    '''
+    GPS week and seconds of week to datetime64[ns] on the GPS time scale.
+    '''
+    return gps_epoch + _gps_ns(week, sow).astype('timedelta64[ns]')
+
+
+def datetime64_to_gps(t):
+    '''
+    datetime64 on the GPS time scale to GPS week and seconds of week.
+    '''
+    d = (np.asarray(t, dtype='datetime64[ns]') - gps_epoch).astype(np.int64)
+    week = d // (week_seconds * ns)
+    return week, (d - week * (week_seconds * ns)) / float(ns)
+
+
+def leap_at_gps(t_gps):
+    '''
+    GPS-UTC of instants on the GPS time scale, s.
+    '''
+    i = np.searchsorted(_leap_gps, np.asarray(t_gps, dtype='datetime64[ns]'), side='right')
+    return np.concatenate(([0], _leap_offset))[i]
+
+
+def leap_at_utc(t_utc):
+    '''
+    GPS-UTC of UTC instants, s.
+    '''
+    i = np.searchsorted(_leap_utc, np.asarray(t_utc, dtype='datetime64[ns]'), side='right')
+    return np.concatenate(([0], _leap_offset))[i]
+
+
+def gps_to_utc(week, sow):
+    '''
+    GPS week and seconds of week to UTC datetime64[ns].
+    '''
+    t = gps_to_datetime64(week, sow)
+    return t - (leap_at_gps(t) * ns).astype('timedelta64[ns]')
+
+
+def utc_to_gps(t_utc):
+    '''
+    UTC datetime64 to GPS week and seconds of week.
+    '''
+    t_utc = np.asarray(t_utc, dtype='datetime64[ns]')
+    return datetime64_to_gps(t_utc + (leap_at_utc(t_utc) * ns).astype('timedelta64[ns]'))
+
+
+def unix_to_utc(t):
+    '''
+    Unix time (time.time()), s, to UTC datetime64[ns].
+    '''
+    return unix_epoch + np.round(np.asarray(t, dtype=np.float64) * ns).astype(np.int64).astype('timedelta64[ns]')
+
+
+def unix_to_gps(t):
+    '''
+    Unix time (time.time()), s, to GPS week and seconds of week.
+    '''
+    return utc_to_gps(unix_to_utc(t))
+
+
+def current_week():
+    return int(unix_to_gps(time.time())[0])
+
+
+def itow_to_gps(itow, week=None):
+    '''
+    ITOW of A1/A2 packets to GPS week and seconds of week.
+    Args:
+        itow: n ITOW, ms, in the order received. Week roll overs are unwrapped.
+        week: GPS week of the first sample, the current week if None
+    '''
+    import timebase
+    if week is None:
+        week = current_week()
+    ticks = timebase.unwrap(itow, timebase.itow_span)
+    w = ticks // timebase.itow_span
+    return week + w, (ticks - w * timebase.itow_span) / 1000.0
+
+
+def calendar(week, sow):
+    '''
+    Calendar fields of GPS times, on the GPS time scale.
+    Returns:
+        nx7 [year, month, day, hour, minute, second, day of year], or 7 for
+        scalar input. Seconds include the fraction.
+    '''
+    t = gps_to_datetime64(week, sow)
+    single = t.ndim == 0
+    t = np.atleast_1d(t)
+    year = t.astype('datetime64[Y]')
+    month = t.astype('datetime64[M]')
+    day = t.astype('datetime64[D]')
+    frac = (t - day).astype(np.int64)
+    out = np.empty((t.shape[0], 7))
+    out[:, 0] = year.astype(np.int64) + 1970
+    out[:, 1] = (month - year).astype(np.int64) + 1
+    out[:, 2] = (day - month).astype(np.int64) + 1
+    out[:, 3] = frac // (3600 * ns)
+    out[:, 4] = (frac // (60 * ns)) % 60
+    out[:, 5] = (frac % (60 * ns)) / float(ns)
+    out[:, 6] = (day - year).astype(np.int64) + 1
+    return out[0] if single else out
+
+
+class host_clock:
+    '''
+    GPS time of the host clock for tagging samples in loggers. The leap seconds are
+    looked up once, so each tag is one addition and one division.
+    '''
+    def __init__(self):
+        # GPS seconds = unix seconds + offset
+        leap = int(leap_at_utc(unix_to_utc(time.time())))
+        self.offset = leap - (gps_epoch - unix_epoch).astype(np.int64) / float(ns)
+
+    def now(self, t=None):
+        '''
+        GPS week and seconds of week of unix time t, the current time if None.
+        '''
+        s = (time.time() if t is None else t) + self.offset
+        week = int(s // week_seconds)
+        return week, s - week * week_seconds
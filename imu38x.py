@@ -1,9 +1,12 @@
 import os
 import sys
 import math
+import time
 import serial
 import serial.tools.list_ports
 import struct
+import orientation
+import calibration
 
 preamble = bytearray.fromhex('5555')
 # payload + 2-byte header + 2-byte type + 1-byte len + 2-byte crc
@@ -23,12 +26,58 @@ packet_def = {'A1': [39, bytearray.fromhex('4131')],\
               'id': [154, bytearray.fromhex('6964')],\
               'sd': [57, bytearray.fromhex('7364')],\
               'FM': [123, bytearray.fromhex('464D')]}
+# index of accel and gyro in the output of the parser of each packet
+sensor_fields = {'S0': [1, 2],\
+                 'S1': [1, 2],\
+                 'SH': [1, 2],\
+                 'A1': [2, 1],\
+                 'A2': [2, 1],\
+                 'E3': [4, 5],\
+                 'MG': [1, 2],\
+                 'z1': [1, 2],\
+                 's1': [1, 2],\
+                 'a2': [2, 1],\
+                 'e1': [3, 2],\
+                 'e2': [2, 3],\
+                 'id': [2, 3],\
+                 'sd': [3, 2]}
+# index of the Euler angles in the output of the parser of packets that have them
+euler_fields = {'A1': 0,\
+                'A2': 0,\
+                'a2': 0,\
+                'e1': 1,\
+                'e2': 6,\
+                'E3': 1,\
+                'id': 6}
+
+# lookup table of the CRC in calc_crc, built on first use
+crc_table = None
+
+def crc16(payload):
+    '''
+    Table driven version of imu38x.calc_crc, for callers scanning a lot of data.
+    '''
+    global crc_table
+    if crc_table is None:
+        crc_table = []
+        for i in range(256):
+            crc = i << 8
+            for j in range(8):
+                crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc_table.append(crc & 0xffff)
+    crc = 0x1D0F
+    for b in payload:
+        crc = ((crc << 8) & 0xffff) ^ crc_table[((crc >> 8) ^ b) & 0xff]
+    return crc
 
 class imu38x:
-    def __init__(self, port, baud=115200, packet_type='A2', pipe=None):
+    def __init__(self, port, baud=115200, packet_type='A2', pipe=None, ori=None, cal=None):
         '''
         Initialize and then start ports search and autobaud process
         If baud <= 0, then port is actually a data file.
+        If ori is given, for example '-y+x+z', accel and gyro are remapped when decoded.
+        If cal is given (see calibration.unit_calibration), accel and gyro are corrected
+        in the sensor frame before the orientation is applied.
         '''
         self.port = port
         self.baud = baud
@@ -48,8 +97,12 @@ class imu38x:
         self.pipe = pipe
         # self.header = A2_header     # packet type hex, default A2
         self.size = 0
+        # number of reads and start time, to measure wakeups per second
+        self.wakeups = 0
+        self.tstart = time.time()
         self.header = None
         self.parser = None
+        self.packet_type = packet_type
         if packet_type in packet_def.keys():
             self.size = packet_def[packet_type][0]
             self.header = packet_def[packet_type][1]
@@ -57,23 +110,63 @@ class imu38x:
         else:
             self.open = False
             print('Unsupported packet type: %s'% packet_type)
+        # coordinate change of accel and gyro
+        self.ori = None
+        self.ori_fields = []
+        if ori is not None:
+            self.ori = orientation.orientation(ori)
+            if self.ori.identity:
+                self.ori = None
+            elif packet_type in sensor_fields:
+                self.ori_fields = sensor_fields[packet_type]
+            else:
+                print('Orientation is not supported for packet type: %s'% packet_type)
+                self.ori = None
+        # bias, scale and misalignment of accel and gyro
+        self.cal = None
+        if cal is not None:
+            self.cal = calibration.unit_calibration(cal)
+            if self.cal.identity:
+                self.cal = None
+            elif packet_type not in sensor_fields:
+                print('Calibration is not supported for packet type: %s'% packet_type)
+                self.cal = None
         # serial data buffer
         self.bf = bytearray(self.size*2)
         self.nbf = 0    # how bytes in self.bf
 
-    def start(self, reset=False, reset_cmd='5555725300FC88'):
+    def start(self, reset=False, reset_cmd='5555725300FC88', latency=0.02, min_frames=1):
+        '''
+        Read and parse data until the end of the data file, or forever for a serial port.
+        Args:
+            reset: send reset_cmd before reading.
+            latency: max time to wait for data in each read, s. A read returns as soon as
+                min_frames packets worth of bytes have arrived or latency has passed, so
+                the process sleeps in the driver instead of polling. A larger latency or
+                min_frames means fewer wakeups and less CPU. 0 means busy polling.
+            min_frames: number of packets to wait for in each read.
+        '''
         if self.open:
             # send optional reset command if port is a pysical serial port
             if self.physical_port:
                 if reset is True:
                     self.ser.write(bytearray.fromhex(reset_cmd))
                 self.ser.reset_input_buffer()
+                if latency > 0:
+                    self.ser.timeout = latency
+                    min_size = max(self.size * min_frames, 1)
+                else:
+                    self.ser.timeout = None
+                    min_size = 0
+            self.wakeups = 0
+            self.tstart = time.time()
             while True:
                 if self.physical_port:
-                    read_size = self.ser.in_waiting
+                    read_size = max(self.ser.in_waiting, min_size)
                 else:
                     read_size = self.file_size
                 data = self.ser.read(read_size)
+                self.wakeups += 1
                 if not data:
                     # end processing if reaching the end of the data file
                     if not self.physical_port:
@@ -87,6 +180,15 @@ class imu38x:
             if self.pipe is not None:
                 self.pipe.send('exit')
 
+    def get_wakeup_rate(self):
+        '''
+        Measured reads per second since start().
+        '''
+        dt = time.time() - self.tstart
+        if dt <= 0:
+            return 0.0
+        return self.wakeups / dt
+
     def parse_new_data(self, data):
         '''
         add new data in the buffer
@@ -130,6 +232,16 @@ class imu38x:
         parse packet
         '''
         data = self.parser(payload[3::])
+        if self.cal is not None:
+            data = list(data)
+            acc_idx, gyro_idx = sensor_fields[self.packet_type]
+            data[acc_idx], data[gyro_idx] = self.cal.apply(data[acc_idx], data[gyro_idx])
+            data = tuple(data)
+        if self.ori is not None:
+            data = list(data)
+            for i in self.ori_fields:
+                data[i] = self.ori.apply(data[i])
+            data = tuple(data)
         return data
 
     def parse_S0(self, payload):
@@ -711,8 +823,8 @@ class imu38x:
         112 sensorSubset 	U2 	- 	number	Multiply by 4 to get first sensor chip number in the packet 
         114	sampleIdx 	    U2 	- 	number	Sample idx. Packets with the same sample idx present sensors data taken at the same moment of time. 
         '''
-        fmt = '>i'*28   # four chips, 7 (3 accel, 3 gyo and 1 temp) for each
-        fmt += '>H'*2
+        fmt = '>' + 'i'*28  # four chips, 7 (3 accel, 3 gyo and 1 temp) for each
+        fmt += 'H'*2
         data = struct.unpack(fmt, payload)
         print(data[-1])
         # reserved
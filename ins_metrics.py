@@ -0,0 +1,323 @@
+"""
+Accuracy of INS381 against the INS1000 reference in logs of log_for_ins_test.py.
+
+Per-sample position (NED), velocity and attitude errors are computed for a whole
+run at once, then summarized over the whole run and over segments such as GNSS
+outages and static periods. Results are cached next to each log, keyed by its size
+and modification time, so a report over many runs only recomputes changed runs.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import geodesy
+
+#### columns of the logs of log_for_ins_test.py
+col_itow = 0
+col_lla = slice(8, 11)
+col_vel = slice(11, 14)
+col_euler = slice(14, 17)
+col_ref_lla = slice(17, 20)
+col_ref_vel = slice(20, 23)
+col_ref_euler = slice(23, 26)
+col_gps_update = 29
+col_fix_type = 30
+# rows at the beginning without INS1000 data
+skip_rows = 100
+# sample rate of the logs, Hz
+sample_rate = 100.0
+
+#### segment settings
+# no GNSS update for longer than this is an outage, s
+outage_time = 2.0
+# reference speed under this is static, m/s
+static_speed = 0.05
+# segments shorter than this are ignored, s
+min_segment_time = 1.0
+# percentiles reported for each error
+percentiles = [50, 68, 95, 99]
+# bump when the computation changes, cached results of other versions are discarded
+cache_version = 1
+# edges of the histograms of running_summary, percentiles are resolved to about 1%
+hist_edges = np.concatenate(([0.0], np.logspace(-4, 4, 1601)))
+
+
+def load_run(data_file):
+    data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+    return data[skip_rows:, :]
+
+
+def wrap180(x):
+    '''
+    Wrap angles into [-180, 180), deg.
+    '''
+    return (np.asarray(x) + 180.0) % 360.0 - 180.0
+
+
+def errors(data):
+    '''
+    Per-sample errors of a run.
+    Returns:
+        dict of nxk arrays: 'pos' NED position error (m), 'horizontal', 'vertical' (m),
+        'vel' NED velocity error and 'speed' its norm (m/s), 'att' roll/pitch/yaw
+        error (deg, wrapped)
+    '''
+    pos = geodesy.ned_error(data[:, col_lla], data[:, col_ref_lla])
+    vel = data[:, col_vel] - data[:, col_ref_vel]
+    att = wrap180(data[:, col_euler] - data[:, col_ref_euler])
+    return {'pos': pos,\
+            'horizontal': np.hypot(pos[:, 0], pos[:, 1]),\
+            'vertical': np.abs(pos[:, 2]),\
+            'vel': vel,\
+            'speed': np.sqrt(np.sum(vel * vel, axis=1)),\
+            'att': att}
+
+
+def summarize(err, idx=None):
+    '''
+    Statistics of errors over some samples.
+    Args:
+        err: output of errors()
+        idx: slice or index of the samples, all if None
+    Returns:
+        dict of error name and dict of 'rms', 'mean', 'max', 'p50'..., per axis for
+        vector errors. 'horizontal' also has 'cep50' and 'cep95'.
+    '''
+    res = {'samples': 0}
+    for name in err:
+        e = err[name] if idx is None else err[name][idx]
+        n = e.shape[0]
+        res['samples'] = n
+        if n == 0:
+            continue
+        a = np.abs(e)
+        s = {'rms': np.sqrt(np.mean(e * e, axis=0)).tolist(),\
+             'mean': np.mean(e, axis=0).tolist(),\
+             'max': np.max(a, axis=0).tolist()}
+        p = np.percentile(a, percentiles, axis=0)
+        for i in range(len(percentiles)):
+            s['p%u'% percentiles[i]] = p[i].tolist()
+        if name == 'horizontal':
+            s['cep50'] = s['p50']
+            s['cep95'] = s['p95']
+        res[name] = s
+    return res
+
+
+class running_summary:
+    '''
+    summarize() of errors that arrive chunk by chunk. Sums, sums of squares and
+    maxima are exact, percentiles come from fixed histograms of the absolute errors.
+    The state is a small dict, see to_dict(), so it can be saved between runs.
+    '''
+    def __init__(self, state=None):
+        self.stats = {}
+        self.samples = 0
+        if state is not None:
+            self.samples = state['samples']
+            for name in state['stats']:
+                s = state['stats'][name]
+                self.stats[name] = {'sum': np.array(s['sum']), 'sum2': np.array(s['sum2']),\
+                                    'max': np.array(s['max']), 'hist': np.array(s['hist'])}
+
+    def update(self, err):
+        '''
+        Args:
+            err: output of errors() of the next chunk of samples
+        '''
+        n = next(iter(err.values())).shape[0] if err else 0
+        if n == 0:
+            return
+        for name in err:
+            e = err[name]
+            a = np.abs(e).reshape(n, -1)
+            s = self.stats.get(name)
+            if s is None:
+                k = a.shape[1]
+                s = {'sum': np.zeros(e.shape[1:]), 'sum2': np.zeros(e.shape[1:]),\
+                     'max': np.zeros(e.shape[1:]), 'hist': np.zeros((k, hist_edges.shape[0]), dtype=np.int64)}
+                self.stats[name] = s
+            s['sum'] = s['sum'] + np.sum(e, axis=0)
+            s['sum2'] = s['sum2'] + np.sum(e * e, axis=0)
+            s['max'] = np.maximum(s['max'], np.max(np.abs(e), axis=0))
+            # the last bin also counts errors beyond the last edge
+            bins = np.minimum(np.searchsorted(hist_edges, a, side='right') - 1, hist_edges.shape[0] - 1)
+            for j in range(a.shape[1]):
+                s['hist'][j] += np.bincount(bins[:, j], minlength=hist_edges.shape[0])
+        self.samples += n
+
+    def percentile(self, hist, q):
+        '''
+        q-th percentile of the samples of a histogram, linear inside a bin.
+        '''
+        c = np.cumsum(hist)
+        target = q / 100.0 * c[-1]
+        i = min(int(np.searchsorted(c, target, side='left')), hist.shape[0] - 1)
+        lo = hist_edges[i]
+        hi = hist_edges[i + 1] if i + 1 < hist_edges.shape[0] else lo
+        below = c[i] - hist[i]
+        u = (target - below) / hist[i] if hist[i] > 0 else 0.0
+        return float(lo + (hi - lo) * u)
+
+    def result(self):
+        '''
+        Returns:
+            dict like summarize(), percentiles approximate
+        '''
+        res = {'samples': self.samples}
+        if self.samples == 0:
+            return res
+        n = float(self.samples)
+        for name in self.stats:
+            s = self.stats[name]
+            r = {'rms': np.sqrt(s['sum2'] / n).tolist(),\
+                 'mean': (s['sum'] / n).tolist(),\
+                 'max': s['max'].tolist()}
+            for q in percentiles:
+                p = [self.percentile(h, q) for h in s['hist']]
+                r['p%u'% q] = p if s['sum'].ndim else p[0]
+            if name == 'horizontal':
+                r['cep50'] = r['p50']
+                r['cep95'] = r['p95']
+            res[name] = r
+        return res
+
+    def to_dict(self):
+        return {'samples': self.samples,\
+                'stats': {name: {'sum': s['sum'].tolist(), 'sum2': s['sum2'].tolist(),\
+                                 'max': s['max'].tolist(), 'hist': s['hist'].tolist()}\
+                          for name, s in self.stats.items()}}
+
+
+def runs(mask):
+    '''
+    Start and stop (exclusive) of each run of True in a bool array.
+    '''
+    m = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+    d = np.diff(m.astype(np.int8))
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+
+def outage_mask(data, fs=sample_rate, min_time=outage_time):
+    '''
+    Samples more than min_time after the last GNSS update.
+    '''
+    update = data[:, col_gps_update] > 0
+    idx = np.where(update, np.arange(update.shape[0]), -1)
+    last = np.maximum.accumulate(idx)
+    # before the first update the time is counted from the start
+    last[last < 0] = 0
+    return (np.arange(update.shape[0]) - last) > min_time * fs
+
+
+def static_mask(data, speed=static_speed):
+    ref_vel = data[:, col_ref_vel]
+    return np.sqrt(np.sum(ref_vel * ref_vel, axis=1)) < speed
+
+
+# segment types, name and function of the data returning a bool mask
+segment_types = {'gnss_outage': outage_mask,\
+                 'static': static_mask}
+
+
+def segments(data, types=None, fs=sample_rate, min_time=min_segment_time):
+    '''
+    Segments of each type.
+    Returns:
+        list of (type, start, stop)
+    '''
+    if types is None:
+        types = segment_types
+    out = []
+    for name in types:
+        start, stop = runs(types[name](data))
+        keep = (stop - start) >= min_time * fs
+        out.extend((name, int(a), int(b)) for a, b in zip(start[keep], stop[keep]))
+    return out
+
+
+def analyze(data, types=None):
+    '''
+    Statistics of a whole run, of each segment, and of all segments of each type.
+    Returns:
+        dict of 'all', 'segments' (list of dict with 'type', 'start', 'stop', 'stats')
+        and 'types' (stats of all samples in segments of a type)
+    '''
+    err = errors(data)
+    res = {'all': summarize(err), 'segments': [], 'types': {}}
+    masks = {}
+    for name, start, stop in segments(data, types):
+        res['segments'].append({'type': name, 'start': start, 'stop': stop,\
+                                'stats': summarize(err, slice(start, stop))})
+        m = masks.setdefault(name, np.zeros((data.shape[0],), dtype=bool))
+        m[start:stop] = True
+    for name in masks:
+        res['types'][name] = summarize(err, masks[name])
+    return res
+
+
+def _stamp(data_file, types):
+    st = os.stat(data_file)
+    names = sorted(types if types is not None else segment_types)
+    return {'size': st.st_size, 'mtime': st.st_mtime, 'version': cache_version,\
+            'settings': [skip_rows, sample_rate, outage_time, static_speed,\
+                         min_segment_time, percentiles, names]}
+
+
+def analyze_file(data_file, types=None, use_cache=True):
+    '''
+    analyze() of a log file, cached in data_file + '.metrics.json'.
+    '''
+    cache_file = data_file + '.metrics.json'
+    stamp = _stamp(data_file, types)
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+            if cached.get('stamp') == json.loads(json.dumps(stamp)):
+                return cached['result']
+        except (ValueError, KeyError):
+            pass
+    res = analyze(load_run(data_file), types)
+    if use_cache:
+        with open(cache_file, 'w') as f:
+            json.dump({'stamp': stamp, 'result': res}, f)
+    return res
+
+
+def report(data_files, types=None, csv_file=None):
+    '''
+    One row per run: horizontal CEP50/CEP95, vertical and velocity RMS, yaw error
+    RMS, over the whole run and over GNSS outages.
+    Returns:
+        list of rows, the first is the header
+    '''
+    header = ['run', 'samples', 'cep50 (m)', 'cep95 (m)', 'vert rms (m)',\
+              'vel rms (m/s)', 'yaw rms (deg)', 'outage samples', 'outage cep95 (m)']
+    rows = [header]
+    for data_file in data_files:
+        res = analyze_file(data_file, types)
+        a = res['all']
+        o = res['types'].get('gnss_outage', {})
+        if a['samples'] == 0:
+            rows.append([data_file, 0] + [float('nan')] * 7)
+            continue
+        rows.append([data_file, a['samples'],\
+                     a['horizontal']['cep50'], a['horizontal']['cep95'],\
+                     a['vertical']['rms'], a['speed']['rms'], a['att']['rms'][2],\
+                     o.get('samples', 0),\
+                     o['horizontal']['cep95'] if 'horizontal' in o else float('nan')])
+    if csv_file is not None:
+        with open(csv_file, 'w') as f:
+            for row in rows:
+                f.write(', '.join(str(x) for x in row) + '\n')
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Usage: python ins_metrics.py log1.csv [log2.csv ...]')
+        exit()
+    for row in report(sys.argv[1:]):
+        print(', '.join(x if isinstance(x, str) else '%.4g'% x for x in row))
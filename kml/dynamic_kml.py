@@ -1,6 +1,11 @@
 import math
 import numpy as np
 
+# trajectories are simplified to within this distance (m) when written, see kml_writer
+tolerance = 1.0
+# points simplified at a time
+simplify_rows = 1 << 16
+
 kmlstr_header = '''<?xml version = "1.0" encoding = "UTF-8"?>
 <kml xmlns="http://www.opengis.net/kml/2.2"
      xmlns:gx = "http://www.google.com/kml/ext/2.2" > 
@@ -37,7 +42,7 @@ kmlstr_end = '''
 </kml>
 '''
 
-def gen_kml(kml_file, lla, heading=None, color='ffff0000'):
+def gen_kml(kml_file, lla, heading=None, color='ffff0000', tolerance=tolerance):
     '''
     generate kml file.
     Args:
@@ -51,6 +56,7 @@ def gen_kml(kml_file, lla, heading=None, color='ffff0000'):
             rr=red (00 to ff). For example, if you want to apply a blue color with 50 percent
             opacity to an overlay, you would specify the following: <color>7fff0000</color>,
             where alpha=0x7f, blue=0xff, green=0x00, and red=0x00.
+        tolerance: see kml_writer
     Returns: None
     '''
     f = open(kml_file, 'w+')
@@ -67,20 +73,105 @@ def gen_kml(kml_file, lla, heading=None, color='ffff0000'):
             lines = (kmlstr_body)% (heading, lla[1], lla[0], lla[2], 0)
         f.write(lines)
     else:
-        max_points = 8000.0
-        step = int(math.ceil(lla.shape[0]/max_points))
-        for i in range(0, lla.shape[0], step):
-            if lla[i][2] < 0:
-                lla[i][2] = 0
-            if heading is None:
-                lines = (kmlstr_body)% (0, lla[i][1], lla[i][0], lla[i][2], i)
-            else:
-                lines = (kmlstr_body)% (heading[i], lla[i][1], lla[i][0], lla[i][2], i)
-            f.write(lines)
+        writer = kml_writer(f, lla.shape[0], tolerance=tolerance)
+        writer.write(lla, heading)
     # write end
     f.write(kmlstr_end)
     f.close()
 
+class kml_writer:
+    '''
+    Write the placemarks of a trajectory chunk by chunk. The trajectory is either
+    simplified (Douglas-Peucker, see simplify.py) or decimated to every step-th point.
+    '''
+    def __init__(self, f, n, max_points=8000.0, step=None, idx=0, tolerance=tolerance):
+        '''
+        Args:
+            f: kml file opened by the caller, header written
+            n: total number of points of the trajectory
+            step: write every step-th point. Set it when the length of the trajectory
+                is not known yet, the points written then do not depend on how the
+                trajectory is split into chunks.
+            idx: index of the first point to be written, to continue a trajectory
+            tolerance: if step is None, largest distance (m) of the trajectory from
+                the simplified one. If None or 0, every step-th point with step from n
+                and max_points.
+        '''
+        self.f = f
+        self.tolerance = tolerance if step is None else None
+        if step is None:
+            step = int(math.ceil(n/max_points))
+        self.step = max(step, 1)
+        # index of the next point of the trajectory
+        self.idx = idx
+        # last point of the previous chunk, the start of the next simplified segment
+        self.last = None
+
+    def write_points(self, lla, heading, points):
+        for i in points:
+            alt = lla[i][2] if lla[i][2] >= 0 else 0
+            h = 0 if heading is None else heading[i]
+            self.f.write((kmlstr_body)% (h, lla[i][1], lla[i][0], alt, self.idx + i))
+
+    def write(self, lla, heading=None):
+        '''
+        Write the kept points of the next chunk of the trajectory.
+        '''
+        n = lla.shape[0]
+        if not self.tolerance:
+            # first point of this chunk on the decimation grid
+            first = (-self.idx) % self.step
+            self.write_points(lla, heading, range(first, n, self.step))
+            self.idx += n
+            return
+        import simplify
+        for a in range(0, n, simplify_rows):
+            b = min(a + simplify_rows, n)
+            pts = np.asarray(lla[a:b], dtype=np.float64)
+            if self.last is None:
+                points = simplify.simplify(pts, self.tolerance)
+            else:
+                # the chunk continues from the last point of the previous one,
+                # which is already written
+                pts = np.vstack((self.last, pts))
+                points = simplify.simplify(pts, self.tolerance)[1:] - 1
+            self.last = pts[-1]
+            self.write_points(lla[a:b], None if heading is None else heading[a:b], points)
+            self.idx += b - a
+
+
+def open_kml(kml_file, color='ffff0000'):
+    '''
+    Create a kml file and write its header, see gen_kml for color.
+    '''
+    f = open(kml_file, 'w+')
+    f.truncate()
+    f.write((kmlstr_header)% (color, color))
+    return f
+
+
+def reopen_kml(kml_file, pos):
+    '''
+    Open a kml file to append placemarks, pos is returned by close_kml.
+    '''
+    f = open(kml_file, 'r+')
+    f.seek(pos)
+    f.truncate()
+    return f
+
+
+def close_kml(f):
+    '''
+    Write the end of a kml file and close it.
+    Returns:
+        position of the end, to append more placemarks by reopen_kml
+    '''
+    pos = f.tell()
+    f.write(kmlstr_end)
+    f.close()
+    return pos
+
+
 if __name__ == "__main__":
     # data_file = "E:\\work_Aceinna\\INS algortihm improvement\\OpenIMU300RI\\drive test\\20200121\\1\\span-ins-sol.csv"
     data_file = 'D:/MyDocuments/desktop/llah.csv'
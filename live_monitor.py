@@ -0,0 +1,261 @@
+"""
+Live plot of attitude, angular rate and accel of several units.
+
+The monitor runs in its own process and is fed decimated samples by data_bus
+publishers (pipe_feeder), so drawing never slows acquisition down: the logger only
+writes into the ring of the bus. Each unit has a fixed-size circular buffer, and
+frames are drawn by blitting, the axes are rendered once and only the lines are
+redrawn each frame.
+"""
+
+import time
+from multiprocessing import Process, Pipe
+import numpy as np
+import data_bus
+import imu38x
+
+# values of a unit in a sample: roll pitch yaw (deg), wx wy wz (deg/s), ax ay az
+unit_width = 9
+# rows of plots: title, columns of a unit sample and initial y limit
+rows = [['attitude (deg)', [0, 1, 2], 180.0],\
+        ['rate (deg/s)', [3, 4, 5], 50.0],\
+        ['accel', [6, 7, 8], 20.0]]
+# samples shown per unit
+history = 500
+# target frames per second
+fps = 30.0
+# the frame time is printed every report_period seconds
+report_period = 5.0
+# how often the data_bus publisher sends to the monitor (Hz) and its decimation
+feed_rate = 30.0
+feed_decimation = 2
+
+
+def unit_sample(latest, packet_type):
+    '''
+    Attitude, rate and accel of a decoded imu38x packet as one monitor sample. What
+    the packet does not have is zero.
+    '''
+    sample = np.zeros((unit_width,))
+    i = imu38x.euler_fields.get(packet_type)
+    if i is not None:
+        sample[0:3] = latest[i]
+    fields = imu38x.sensor_fields.get(packet_type)
+    if fields is not None:
+        sample[6:9] = latest[fields[0]]
+        sample[3:6] = latest[fields[1]]
+    return sample
+
+
+class monitor_tap:
+    '''
+    Pipe of a reader that passes packets on to another pipe (a csv_writer for
+    example) and writes the monitor sample of each packet into a data_bus ring.
+    It runs in the reader process: if a sample cannot be made, the monitor is
+    left without data of this unit but logging goes on.
+    '''
+    def __init__(self, pipe, ring, packet_type):
+        self.pipe = pipe
+        self.ring = ring
+        self.packet_type = packet_type
+
+    def send(self, latest):
+        self.pipe.send(latest)
+        if self.ring is None or isinstance(latest, str):
+            return
+        try:
+            self.ring.write(unit_sample(latest, self.packet_type))
+        except Exception as e:
+            print('Live monitor disabled for packet type %s: %s'% (self.packet_type, e))
+            self.ring = None
+
+    def close(self):
+        self.pipe.close()
+
+
+class live_monitor:
+    '''
+    Rolling traces of N units, one column of plots per unit.
+    '''
+    def __init__(self, names, history=history, fps=fps):
+        self.names = list(names)
+        self.history = history
+        self.fps = fps
+        n = len(self.names)
+        # circular buffers, and the number of samples ever added to each
+        self.buf = np.full((n, history, unit_width), np.nan)
+        self.count = np.zeros((n,), dtype=np.int64)
+        self.limits = [[r[2]] * n for r in rows]
+        self.fig = None
+        self.background = None
+        # frame time statistics, s
+        self.frame_time = 0.0
+        self.frames = 0
+
+    def add(self, unit, samples):
+        '''
+        Args:
+            samples: nx9 samples of a unit, the oldest first
+        '''
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, unit_width)
+        n = samples.shape[0]
+        if n > self.history:
+            self.count[unit] += n - self.history
+            samples = samples[-self.history:]
+            n = self.history
+        idx = (self.count[unit] + np.arange(n)) % self.history
+        self.buf[unit, idx] = samples
+        self.count[unit] += n
+
+    def add_rows(self, first_unit, samples):
+        '''
+        Add samples of consecutive units, 9 columns per unit from first_unit on.
+        '''
+        for j in range(samples.shape[1] // unit_width):
+            self.add(first_unit + j, samples[:, j*unit_width:(j+1)*unit_width])
+
+    def window(self, unit):
+        '''
+        The buffer of a unit, oldest sample first.
+        '''
+        i = self.count[unit] % self.history
+        return np.concatenate((self.buf[unit, i:], self.buf[unit, :i]))
+
+    def open(self):
+        import matplotlib.pyplot as plt
+        self.plt = plt
+        n = len(self.names)
+        self.fig, self.axes = plt.subplots(len(rows), n, squeeze=False, sharex=True)
+        x = np.arange(self.history)
+        y = np.full((self.history, 3), np.nan)
+        self.lines = []
+        for r in range(len(rows)):
+            self.lines.append([])
+            for u in range(n):
+                ax = self.axes[r][u]
+                self.lines[r].append(ax.plot(x, y, animated=True))
+                ax.set_xlim(0, self.history - 1)
+                ax.set_ylim(-self.limits[r][u], self.limits[r][u])
+                ax.grid(True)
+                if u == 0:
+                    ax.set_ylabel(rows[r][0])
+        for u in range(n):
+            self.axes[0][u].set_title(self.names[u])
+        self.text = self.fig.text(0.01, 0.01, '', animated=True)
+        # the background is captured after every full draw, e.g. a resize
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        plt.show(block=False)
+        plt.pause(0.1)
+
+    def on_draw(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        windows = [self.window(u) for u in range(len(self.names))]
+        for r in range(len(rows)):
+            for u in range(len(self.names)):
+                for j, line in enumerate(self.lines[r][u]):
+                    line.set_ydata(windows[u][:, rows[r][1][j]])
+                    self.axes[r][u].draw_artist(line)
+        self.fig.draw_artist(self.text)
+
+    def rescale(self):
+        '''
+        Double the y limit of axes whose data go beyond it.
+        Returns:
+            True if any limit changed, the figure then needs a full draw
+        '''
+        changed = False
+        for r in range(len(rows)):
+            for u in range(len(self.names)):
+                peak = np.nanmax(np.abs(self.buf[u][:, rows[r][1]])) if self.count[u] else 0.0
+                if peak > self.limits[r][u]:
+                    while peak > self.limits[r][u]:
+                        self.limits[r][u] *= 2.0
+                    self.axes[r][u].set_ylim(-self.limits[r][u], self.limits[r][u])
+                    changed = True
+        return changed
+
+    def draw_frame(self):
+        canvas = self.fig.canvas
+        if self.rescale() or self.background is None:
+            # full draw, on_draw captures the new background
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.draw_artists()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def run(self, conns, units_per_conn=None):
+        '''
+        Draw until the window is closed.
+        Args:
+            conns: connections receiving nx(9*k) samples of k units
+            units_per_conn: k of each connection, 1 if None
+        '''
+        if units_per_conn is None:
+            units_per_conn = [1] * len(conns)
+        first = np.concatenate(([0], np.cumsum(units_per_conn)[:-1])).astype(int)
+        period = 1.0 / self.fps
+        t_report = time.time()
+        while self.plt.fignum_exists(self.fig.number):
+            tstart = time.time()
+            for i, conn in enumerate(conns):
+                try:
+                    while conn.poll():
+                        self.add_rows(first[i], conn.recv())
+                except (EOFError, OSError):
+                    pass
+            self.draw_frame()
+            dt = time.time() - tstart
+            # exponential average over about 10 frames
+            self.frame_time = dt if self.frames == 0 else self.frame_time + 0.1 * (dt - self.frame_time)
+            self.frames += 1
+            self.text.set_text('frame %.1f ms'% (self.frame_time * 1000.0))
+            if tstart - t_report > report_period:
+                print('Live monitor frame time: %.1f ms (%.0f fps max)'%\
+                      (self.frame_time * 1000.0, 1.0 / max(self.frame_time, 1e-6)))
+                t_report = tstart
+            sleep = period - (time.time() - tstart)
+            if sleep > 0:
+                time.sleep(sleep)
+        for conn in conns:
+            conn.close()
+
+
+def run_monitor(conns, names, units_per_conn=None, history=history, fps=fps):
+    '''
+    Process target of start_monitor().
+    '''
+    try:
+        m = live_monitor(names, history, fps)
+        m.open()
+        m.run(conns, units_per_conn)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_monitor(names, buses, units_per_bus=None, rate=feed_rate, decimation=feed_decimation,\
+                  history=history, fps=fps):
+    '''
+    Start a monitor process fed by data_bus publishers. Call it before the buses
+    are started.
+    Args:
+        names: names of the units, in the order of the buses and their columns
+        buses: data_bus objects, each sample holds 9 values (see unit_sample) of
+            each of its units
+        units_per_bus: number of units of each bus, 1 if None
+    Returns:
+        the monitor process
+    '''
+    conns = []
+    for bus in buses:
+        recv_conn, send_conn = Pipe(duplex=False)
+        bus.add_publisher(data_bus.pipe_feeder(send_conn), rate=rate, decimation=decimation)
+        conns.append(recv_conn)
+    p = Process(target=run_monitor, args=(conns, names, units_per_bus, history, fps))
+    p.daemon = True
+    p.start()
+    return p
@@ -1,12 +1,7 @@
-import math
-import serial
-import serial.tools.list_ports
-from multiprocessing import Process, Pipe, Array
-import time
-import struct
 import numpy as np
-import attitude
-import imu38x
+import rig
+import online_static
+import timebase
 import post_proccess_for_free_integration
 
 units = [
@@ -32,125 +27,119 @@ units = [
 
 log_dir = './log_data/'
 log_file = 'log.csv'
+# estimate initial states online from the static period before motion
+enable_online_static = True
+# rows dropped at the beginning by post processing
+skip_rows = 100
 
+headerline = "recv_interval (s), openimu timer,"
+headerline += "ax (m/s2), ay (m/s2), az (m/s2),"
+headerline += "wx (deg/s), wy (deg/s), wz (deg/s),"
+headerline += "roll (deg), pitch (deg), yaw (deg),"
+headerline += "ref_roll (deg), ref_pitch (deg), ref_yaw (deg)\n"
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start()
+fmt = "%f, %u, "                    # itow, packet timer
+fmt += "%f, %f, %f, %f, %f, %f, "   # 1st unit's acc and gyro
+fmt += "%f, %f, %f, %f, %f, %f, "   # 2nd unit's acc and gyro
+fmt += "%f, %f, %f, %f, %f, %f, "   # lla/vel
+fmt += "%f, %f, %f\n"               # Euler angles.
 
-def orientation(data, ori):
+
+class free_integration_row:
     '''
-    change coordiante according to ori.
-    Args:
-        data: nx3 numpy array
-        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
-    Return:
-        data after coordinate change
+    Row of the log from the latest packets of the units, called by rig.merge_units
+    for each packet of the first unit. It also feeds the online static estimators
+    and tracks packet loss of each unit.
     '''
-    map = {'+x': [0, 1],\
-           '-x': [0, -1],\
-           '+y': [1, 1],\
-           '-y': [1, -1],\
-           '+z': [2, 1],\
-           '-z': [2, -1]}
-    ori = ori.lower()
-    idx_x = int(0)
-    sgn_x = 1
-    idx_y = int(1)
-    sgn_y = 1
-    idx_z = int(2)
-    sgn_z = 1
-    if len(ori) == 6:
-        if ori[0:2] in map:
-            idx_x = int(map[ori[0:2]][0])
-            sgn_x = map[ori[0:2]][1]
-        if ori[2:4] in map:
-            idx_y = int(map[ori[2:4]][0])
-            sgn_y = map[ori[2:4]][1]
-        if ori[4:6] in map:
-            idx_z = int(map[ori[4:6]][0])
-            sgn_z = map[ori[4:6]][1]
-        data[0], data[1], data[2] =\
-            sgn_x * data[idx_x], sgn_y * data[idx_y], sgn_z * data[idx_z]
-    return data
+    def __init__(self, names):
+        self.names = names
+        num_units = len(names)
+        self.tstart = None
+        self.cntr = np.zeros((3,))
+        self.acc = np.zeros((3*num_units,))
+        self.gyro = np.zeros((3*num_units,))
+        # online static estimators, fed only the new samples of each unit from row
+        # skip_rows on. A unit may not have a new sample every row, so the start of
+        # the motion is kept as the row it was detected at.
+        self.estimators = []
+        self.motion_rows = [None] * num_units
+        if enable_online_static:
+            for i in range(num_units):
+                self.estimators.append(online_static.static_estimator())
+        self.row = 0
+        # packet loss of each unit from its counter
+        self.trackers = [timebase.tracker() for i in range(num_units)]
+
+    def __call__(self, latest, fresh, tnow):
+        # 1. timer interval
+        if self.tstart is None:
+            self.tstart = tnow
+        time_interval = tnow - self.tstart
+        self.tstart = tnow
+        # 2. latest data
+        acc = self.acc
+        gyro = self.gyro
+        for i in range(len(self.names)):
+            x = latest[self.names[i]]
+            if fresh[self.names[i]]:
+                self.cntr[i] = x[0]
+                acc[i*3:(i+1)*3] = x[1]
+                gyro[i*3:(i+1)*3] = x[2]
+        for i in range(len(self.estimators)):
+            if fresh[self.names[i]] and self.row >= skip_rows:
+                self.estimators[i].update(gyro[i*3:(i+1)*3], acc[i*3:(i+1)*3])
+                if self.motion_rows[i] is None and not self.estimators[i].is_static():
+                    self.motion_rows[i] = self.row - skip_rows
+        self.row += 1
+        return (time_interval, self.cntr[0],\
+                acc[0], acc[1], acc[2],\
+                gyro[0], gyro[1], gyro[2],\
+                acc[3], acc[4], acc[5],\
+                gyro[3], gyro[4], gyro[5],\
+                0, 0, 0, 0, 0, 0,\
+                0, 0, 0
+                )
+
+    def packet(self, name, latest):
+        '''
+        Track packet loss from the counter of every packet, not only of those logged.
+        '''
+        self.trackers[self.names.index(name)].update(latest[0])
+
+    def static(self):
+        '''
+        Initial states of both units for post processing, None if there are no
+        estimators or either of them has no static data.
+        '''
+        if len(self.estimators) != 2:
+            return None
+        static = [x.result() for x in self.estimators]
+        if None in static:
+            return None
+        # start of the motion as a row of the log after skip_rows
+        for i in range(len(static)):
+            static[i]['idx0'] = self.motion_rows[i] if self.motion_rows[i] is not None\
+                                else max(self.row - skip_rows, 0)
+        return static
+
+
+def end_log(row, data_file):
+    print("Preparing data for simulation...")
+    for i in range(len(row.names)):
+        print(timebase.format_report(row.trackers[i].report(), row.names[i]))
+    post_proccess_for_free_integration.post_processing(data_file, static=row.static())
+
 
 if __name__ == "__main__":
-    #### create log file
-    data_file = log_dir + log_file
-    f = open(data_file, 'w+')
-    f.truncate()
-    headerline = "recv_interval (s), openimu timer,"
-    headerline += "ax (m/s2), ay (m/s2), az (m/s2),"
-    headerline += "wx (deg/s), wy (deg/s), wz (deg/s),"
-    headerline += "roll (deg), pitch (deg), yaw (deg),"
-    headerline += "ref_roll (deg), ref_pitch (deg), ref_yaw (deg)\n"
-    f.write(headerline)
-    f.flush()
-    #### connect to units
-    enabled_units = []
-    num_units = 0
-    for i in units:
-        if i['enable']:
-            enabled_units.append(i)
-            num_units += 1
-            ### create pipes
-            process_target = None
-            if i['unit_type'].lower() == 'imu38x':
-                process_target = log_imu38x
-            i['pipe'] = Pipe()
-            i['process'] = Process( target=process_target,\
-                                    args=(i['port'], i['baud'],\
-                                    i['packet_type'], i['pipe'][1])
-                                  )
-            i['process'].daemon = True
-            i['process'].start()
-            print('Connected to ' + i['name'] + ' on ' + i['port'])
-    #### start log
-    # start time, to calculate recv interval
-    tstart = time.time()
-    cntr = np.zeros((3,))
-    acc = np.zeros((3*num_units,))
-    gyro = np.zeros((3*num_units,))
-    try:
-        while num_units:
-            # 1. timer interval
-            tnow = time.time()
-            time_interval = tnow-tstart
-            tstart = tnow
-            # 2. get latest data
-            for i in range(num_units):
-                latest = None
-                if i == 0:
-                    latest = enabled_units[i]['pipe'][0].recv()
-                else:
-                    while enabled_units[i]['pipe'][0].poll():
-                        latest = enabled_units[i]['pipe'][0].recv()
-                if latest is not None:
-                    cntr[i] = latest[0]
-                    acc[i*3:(i+1)*3] = latest[1]
-                    gyro[i*3:(i+1)*3] = latest[2]
-            # 3. log data to file
-            fmt = "%f, %u, "                    # itow, packet timer
-            fmt += "%f, %f, %f, %f, %f, %f, "   # 1st unit's acc and gyro
-            fmt += "%f, %f, %f, %f, %f, %f, "   # 2nd unit's acc and gyro
-            fmt += "%f, %f, %f, %f, %f, %f, "   # lla/vel
-            fmt += "%f, %f, %f\n"               # Euler angles.
-            lines = fmt% (\
-                            time_interval, cntr[0],\
-                            acc[0], acc[1], acc[2],\
-                            gyro[0], gyro[1], gyro[2],\
-                            acc[3], acc[4], acc[5],\
-                            gyro[3], gyro[4], gyro[5],\
-                            0, 0, 0, 0, 0, 0,\
-                            0, 0, 0
-                            )
-            f.write(lines)
-            f.flush()
-    except KeyboardInterrupt:
-        print("Stop logging, preparing data for simulation...")
-        f.close()
-        for i in enabled_units:
-            i['process'].terminate()
-            i['process'].join()
-        post_proccess_for_free_integration.post_processing(data_file)
-    
\ No newline at end of file
+    # one row per packet of the first unit
+    names = [i['name'] for i in units if i['enable']]
+    row = free_integration_row(names)
+    rig.run({'log_dir': log_dir,\
+             'units': units,\
+             'merge': {'units': names,\
+                       'output': log_file,\
+                       'header': headerline,\
+                       'fmt': fmt,\
+                       'row': row,\
+                       'packet': row.packet},\
+             'post_process': [end_log, row, log_dir + log_file]})
@@ -1,23 +1,19 @@
-import math
-import serial
-import serial.tools.list_ports
-from multiprocessing import Process, Pipe, Array
-import time
-import struct
 import numpy as np
-import attitude
-import imu38x
-import socket
+import rig
+import data_bus
+import telemetry
 
 #### openimu
-openimu_unit = {'port':'COM7',\
+openimu_unit = {'name':'openimu',\
+            'port':'COM7',\
             'baud':230400,\
             'packet_type':'e1',\
             'unit_type':'imu38x',\
             # 'orientation':'-y+x+z',\
             'enable':True}
 
-imu381_unit = {'port':'COM30',\
+imu381_unit = {'name':'imu381',\
+            'port':'COM30',\
             'baud':115200,\
             'packet_type':'A2',\
             'unit_type':'imu38x',\
@@ -26,161 +22,85 @@ imu381_unit = {'port':'COM30',\
 
 log_dir = './log_data/'
 log_file = 'log.csv'
+# UDP broadcast rate and decimation, UDP is sent by a separate process
+udp_rate = 50.0
+udp_decimation = 1
+# True to send the batched telemetry protocol (telemetry.py) instead of 10 doubles per datagram
+udp_telemetry = False
+# True to show attitude, rate and accel of both units in a live plot (live_monitor.py)
+live_plot = False
 
+headerline = "recv_interval (s), openimu timer,"
+headerline += "ax (m/s2), ay (m/s2), az (m/s2),"
+headerline += "wx (deg/s), wy (deg/s), wz (deg/s),"
+headerline += "roll (deg), pitch (deg), yaw (deg),"
+headerline += "ref_roll (deg), ref_pitch (deg), ref_yaw (deg)\n"
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start()
+fmt = "%f, %u, "                    # itow, packet timer
+fmt += "%.9f, %.9f, %.9f, %.9f, %.9f, %.9f, "   # openimu acc and gyro
+fmt += "%f, %f, %f, %f, %f, %f\n" # openimu and imu381 Euler angles
 
-def orientation(data, ori):
+
+class vg_ahrs_row:
     '''
-    change coordiante according to ori.
-    Args:
-        data: nx3 numpy array
-        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
-    Return:
-        data after coordinate change
+    Row of the log from the latest OpenIMU and imu381 packets, called by
+    rig.merge_units for each OpenIMU packet. Roll and pitch of both units are also
+    published to bus for UDP broadcast.
     '''
-    map = {'+x': [0, 1],\
-           '-x': [0, -1],\
-           '+y': [1, 1],\
-           '-y': [1, -1],\
-           '+z': [2, 1],\
-           '-z': [2, -1]}
-    ori = ori.lower()
-    idx_x = int(0)
-    sgn_x = 1
-    idx_y = int(1)
-    sgn_y = 1
-    idx_z = int(2)
-    sgn_z = 1
-    if len(ori) == 6:
-        if ori[0:2] in map:
-            idx_x = int(map[ori[0:2]][0])
-            sgn_x = map[ori[0:2]][1]
-        if ori[2:4] in map:
-            idx_y = int(map[ori[2:4]][0])
-            sgn_y = map[ori[2:4]][1]
-        if ori[4:6] in map:
-            idx_z = int(map[ori[4:6]][0])
-            sgn_z = map[ori[4:6]][1]
-        data[0], data[1], data[2] =\
-            sgn_x * data[idx_x], sgn_y * data[idx_y], sgn_z * data[idx_z]
-    return data
-
-if __name__ == "__main__":
-    # udp
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    PORT = 10600
-    network = '<broadcast>'
-    #### find ports
-    if not openimu_unit['enable']:
-        openimu_unit['port'] = None
-    if not imu381_unit['enable']:
-        imu381_unit['port'] = None
-    print('%s is an OpenIMU.' % openimu_unit['port'])
-    print('%s is an imu381.' % imu381_unit['port'])
+    def __init__(self, bus):
+        self.bus = bus
+        self.tstart = None
+        self.imu381_euler = np.zeros((3,))
 
-    #### create pipes
-    # openimu
-    if openimu_unit['enable']:
-        print('connecting to OpenIMIU...')
-        parent_conn_openimu, child_conn_openimu = Pipe()
-        process_target = log_imu38x
-        p_openimu = Process(target=process_target,\
-                            args=(openimu_unit['port'], openimu_unit['baud'],\
-                                  openimu_unit['packet_type'], child_conn_openimu)
-                           )
-        p_openimu.daemon = True
-        p_openimu.start()
-    # imu381
-    if imu381_unit['enable']:
-        print('connecting to imu381...')
-        parent_conn_imu381, child_conn_imu381 = Pipe()
-        process_target = log_imu38x
-        p_imu381 = Process(target=process_target,\
-                           args=(imu381_unit['port'], imu381_unit['baud'],\
-                           imu381_unit['packet_type'], child_conn_imu381)
-                       )
-        p_imu381.daemon = True
-        p_imu381.start()
+    def __call__(self, latest, fresh, tnow):
+        # 1. timer interval
+        if self.tstart is None:
+            self.tstart = tnow
+        time_interval = tnow - self.tstart
+        self.tstart = tnow
+        # 2. openimu, timer, acc and gyro, Euler angles
+        latest_openimu = latest['openimu']
+        openimu_timer = latest_openimu[0]
+        openimu_euler = np.array(latest_openimu[1])
+        openimu_gyro = np.array(latest_openimu[2])
+        openimu_acc = np.array(latest_openimu[3])
+        if latest.get('imu381') is not None and fresh['imu381']:
+            self.imu381_euler = np.array(latest['imu381'][0])
+        imu381_euler = self.imu381_euler
+        # 3. publish for UDP broadcast
+        self.bus.publish((openimu_euler[0], openimu_euler[1],\
+                          imu381_euler[0], imu381_euler[1],\
+                          0, 0,\
+                          0, 0, 0, 0,\
+                          tnow))
+        return (time_interval, openimu_timer,\
+                openimu_acc[0], openimu_acc[1], openimu_acc[2],\
+                openimu_gyro[0], openimu_gyro[1], openimu_gyro[2],\
+                openimu_euler[0], openimu_euler[1], openimu_euler[2],\
+                imu381_euler[0], imu381_euler[1], imu381_euler[2])
 
-    #### create log file
-    data_file = log_dir + log_file
-    f = open(data_file, 'w+')
-    f.truncate()
-    headerline = "recv_interval (s), openimu timer,"
-    headerline += "ax (m/s2), ay (m/s2), az (m/s2),"
-    headerline += "wx (deg/s), wy (deg/s), wz (deg/s),"
-    headerline += "roll (deg), pitch (deg), yaw (deg),"
-    headerline += "ref_roll (deg), ref_pitch (deg), ref_yaw (deg)\n"
-    f.write(headerline)
-    f.flush()
 
-    #### start logging
-    # start time, to calculate recv interval
-    tstart = time.time()
-    # data from OpenIMU
-    openimu_timer = 0
-    openimu_acc = np.zeros((3,))
-    openimu_gyro = np.zeros((3,))
-    openimu_euler = np.zeros((3,))
-    imu381_euler = np.zeros((3,))
-    # logging
+if __name__ == "__main__":
+    # udp, 10 doubles as before: openimu roll/pitch, imu381 roll/pitch and 6 unused,
+    # and the host time of the sample
+    bus = data_bus.data_bus(11)
+    if udp_telemetry:
+        fields = [['openimu_roll', '<f4'], ['openimu_pitch', '<f4'],\
+                  ['imu381_roll', '<f4'], ['imu381_pitch', '<f4']]
+        udp = telemetry.telemetry_publisher(fields, time_col=10, cols=[0, 1, 2, 3], name='vg_ahrs_test')
+    else:
+        udp = data_bus.udp_sender(cols=list(range(10)))
+    bus.add_publisher(udp, rate=udp_rate, decimation=udp_decimation)
+    bus.start()
+    # one row per OpenIMU packet, the live plot is fed by the readers (rig "monitor")
     try:
-        while True:
-            # 1. timer interval
-            tnow = time.time()
-            time_interval = tnow-tstart
-            tstart = tnow
-            # 2. openimu, timer, acc and gyro, Euler angles
-            if openimu_unit['enable']:
-                latest_openimu = parent_conn_openimu.recv()
-                openimu_timer = latest_openimu[0]
-                openimu_euler = np.array(latest_openimu[1])
-                openimu_gyro = np.array(latest_openimu[2])
-                openimu_acc = np.array(latest_openimu[3])
-                if 'orientation' in openimu_unit:
-                    openimu_acc = orientation(openimu_acc, openimu_unit['orientation'])
-                    openimu_gyro = orientation(openimu_gyro, openimu_unit['orientation'])
-            if imu381_unit['enable']:
-                latest_imu381 = None
-                while parent_conn_imu381.poll():
-                    latest_imu381 = parent_conn_imu381.recv()
-                # imu381_timer = latest_imu381[0]
-                # imu381_acc = np.array(latest_imu381[3])
-                # imu381_gyro = np.array(latest_imu381[2])
-                if latest_imu381 is not None:
-                    imu381_euler = np.array(latest_imu381[0])
-                # if 'orientation' in openimu_unit:
-                #     imu381_acc = orientation(imu381_acc, imu381_unit['orientation'])
-                #     imu381_gyro = orientation(imu381_gyro, imu381_unit['orientation'])
-            # 3. log data to file
-            fmt = "%f, %u, "                    # itow, packet timer
-            fmt += "%.9f, %.9f, %.9f, %.9f, %.9f, %.9f, "   # openimu acc and gyro
-            fmt += "%f, %f, %f, %f, %f, %f\n" # openimu and imu381 Euler angles
-            lines = fmt% (\
-                            time_interval, openimu_timer,\
-                            openimu_acc[0], openimu_acc[1], openimu_acc[2],\
-                            openimu_gyro[0], openimu_gyro[1], openimu_gyro[2],\
-                            openimu_euler[0], openimu_euler[1], openimu_euler[2],\
-                            imu381_euler[0], imu381_euler[1], imu381_euler[2])
-            f.write(lines)
-            f.flush()
-            # 4. send over UDP
-            packed_data = struct.pack('dddddddddd', openimu_euler[0], openimu_euler[1],\
-                                        imu381_euler[0], imu381_euler[1],\
-                                        0, 0,\
-                                        0, 0, 0, 0)
-            s.sendto(packed_data, (network, PORT))
-    except KeyboardInterrupt:
-        print("Stop logging, preparing data for simulation...")
-        f.close()
-        if openimu_unit['enable']:
-            p_openimu.terminate()
-            p_openimu.join()
-        if imu381_unit['enable']:
-            p_imu381.terminate()
-            p_imu381.join()
-        # post_proccess_for_ins_test.post_processing(data_file)
+        rig.run({'log_dir': log_dir,\
+                 'units': [openimu_unit, imu381_unit],\
+                 'merge': {'units': ['openimu', 'imu381'],\
+                           'output': log_file,\
+                           'header': headerline,\
+                           'fmt': fmt,\
+                           'row': vg_ahrs_row(bus)},\
+                 'monitor': live_plot})
+    finally:
+        bus.stop()
@@ -4,21 +4,24 @@ import serial.tools.list_ports
 import threading
 from multiprocessing import Process, Pipe, Array
 import time
-import socket
 import struct
 import numpy as np
 import attitude
 import imu38x
 import ins1000
+import data_bus
+import discovery
+import telemetry
 
 a2_size = 37
 nav_size = 127
 enable_ref = False
 
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-PORT = 10600
-network = '<broadcast>'
+# UDP broadcast rate and decimation, UDP is sent by a separate process
+udp_rate = 50.0
+udp_decimation = 1
+# True to send the batched telemetry protocol (telemetry.py) instead of 10 doubles per datagram
+udp_telemetry = False
 
 def log_new(port, baud, pipe):
     new_unit = imu38x.imu38x(port, baud, 'A1', pipe=pipe)
@@ -33,27 +36,18 @@ def log_ref(port, baud, pipe):
     ref_unit.start()
 
 def get_com_ports():
+    '''
+    Find the unit with the new algorithm (A1) and the one with the old algorithm (A2)
+    by probing all serial ports.
+    '''
     new_port = None
     old_port = None
-    # automatically choose com ports
-    while new_port is None or old_port is None:
-        port_list = list(serial.tools.list_ports.comports())
-        n = len(port_list)
-        if n > 4:   # 4 for openimu evb, 1 for 380 adapter board
-            port_names = []
-            port_nums = []
-            for i in range(n):
-                this_name = list(port_list[i])[0]
-                this_num = int(this_name[3::])
-                port_names.append(this_name)
-                port_nums.append(this_num)
-            port_nums.sort()
-            if (port_nums[0] + 1) in port_nums:
-                new_port = 'COM' + str(port_nums[0])
-                old_port = 'COM' + str(port_nums[-1])
-            else:
-                new_port = 'COM' + str(port_nums[1])
-                old_port = 'COM' + str(port_nums[0])
+    rig = discovery.discover(packet_types=['A1', 'A2'])
+    for unit in rig['units']:
+        if unit['packet_type'] == 'A1' and new_port is None:
+            new_port = unit['port']
+        elif unit['packet_type'] == 'A2' and old_port is None:
+            old_port = unit['port']
     return new_port, old_port
 
 if __name__ == "__main__":
@@ -85,6 +79,20 @@ if __name__ == "__main__":
         p_ref.daemon = True
         p_ref.start()
 
+    # udp
+    # 10 doubles as before, and the host time of the sample
+    bus = data_bus.data_bus(11)
+    if udp_telemetry:
+        fields = [['new_roll', '<f4'], ['new_pitch', '<f4'],\
+                  ['old_roll', '<f4'], ['old_pitch', '<f4'],\
+                  ['ref_roll', '<f4'], ['ref_pitch', '<f4'],\
+                  ['new_ax', '<f4'], ['new_ay', '<f4'], ['new_az', '<f4']]
+        udp = telemetry.telemetry_publisher(fields, time_col=10, cols=list(range(9)), name='multiprocessing')
+    else:
+        udp = data_bus.udp_sender(cols=list(range(10)))
+    bus.add_publisher(udp, rate=udp_rate, decimation=udp_decimation)
+    bus.start()
+
     # create log file
     file = "log.txt"
     f = open(file, 'w+')
@@ -127,10 +135,9 @@ if __name__ == "__main__":
         f.write(lines)
         f.flush()
         # udp
-        packed_data = struct.pack('dddddddddd', latest_new[0][0], latest_new[0][1],\
-                                    latest_old[0][0], latest_old[0][1],\
-                                    latest_ref[2], latest_ref[1],\
-                                    latest_new[2][0], latest_new[2][1], latest_new[2][2],\
-                                    latest_new[2][0]
-                                    )
-        s.sendto(packed_data, (network, PORT))
+        bus.publish((latest_new[0][0], latest_new[0][1],\
+                     latest_old[0][0], latest_old[0][1],\
+                     latest_ref[2], latest_ref[1],\
+                     latest_new[2][0], latest_new[2][1], latest_new[2][2],\
+                     latest_new[2][0],\
+                     tnow))
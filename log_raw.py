@@ -4,13 +4,16 @@ import time
 # serial config
 port = 'com7'
 baud = 230400
+# max time to wait for data in each read, s, and bytes to wait for before waking up
+read_latency = 0.02
+min_read_size = 64
 
 # log file
 log_dir = './log_data/'
 log_file = 'log.bin'
 
 # open port
-ser = serial.Serial(port, baud)
+ser = serial.Serial(port, baud, timeout=read_latency)
 if ser.isOpen():
     print("Open %s"% port)
 else:
@@ -31,12 +34,10 @@ ser.reset_input_buffer()
 try:
     print("Start logging at %s."%time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
     while True:
-        if ser.in_waiting:
-            # print(ser.in_waiting)
-            data = ser.read(ser.in_waiting)
+        # blocks until min_read_size bytes arrive or read_latency passes
+        data = ser.read(max(ser.in_waiting, min_read_size))
+        if data:
             f.write(data)
-        else:
-            time.sleep(0.001)
 except KeyboardInterrupt:
     print('End logging')
     ser.close()
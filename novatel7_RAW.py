@@ -3,6 +3,7 @@ import serial
 import math
 import time
 import datetime
+import gps_time
 
 def getweeknum(weekseconds):
     return math.floor(weekseconds/(7*24*3600))
@@ -21,54 +22,12 @@ def isleapyear(year):
     return (yearfour(year)%4==0 and yearfour(year)%100!=0) or yearfour(year)%400==0
                  
 def timefromGPS(weeknum,weeksec):
-    year = 0
-    month = 0
-    day = 0
-    hour = 0
-    minute = 0
-    second = 0
-    doy = 0
-    daypermon = [31,28,31,30,31,30,31,31,30,31,30,31]
-
-    weeknum += getweeknum(weeksec)
-    weeksec  = getweeksec(weeksec)
-    
-    weekmin  = math.floor(weeksec/60.0)
-    second   = weeksec - weekmin*60.0
-    weekhour = math.floor(weekmin/60)
-    minute   = weekmin - weekhour*60
-    weekday  = math.floor(weekhour/24)
-    hour     = weekhour - weekday*24
-
-    totalday = weekday+weeknum*7
-    if totalday<360:
-        year = 1980
-    else:
-        year = 1981
-        totalday -= 360
-        while True:
-            if totalday<365:
-                break
-            if isleapyear(year): totalday -= 1
-            totalday -= 365
-            year += 1
-    doy = totalday
-
-    if totalday <= daypermon[0]:
-        month = 1
-    else:
-        totalday -= daypermon[0];
-        if isleapyear(year): totalday -= 1
-        month = 2
-        while True:
-            if totalday<=daypermon[month-1]:
-                break
-            else:
-                totalday -= daypermon[month-1]
-                month += 1
-    if month==2 and isleapyear(year): totalday += 1
-    day = totalday
-    return [year,month,day,hour,minute,second,doy]
+    '''
+    [year,month,day,hour,minute,second,doy] of a GPS time, see gps_time.calendar
+    for whole arrays.
+    '''
+    c = gps_time.calendar(weeknum, weeksec)
+    return [int(c[0]),int(c[1]),int(c[2]),int(c[3]),int(c[4]),float(c[5]),int(c[6])]
 
 
 def configNovatel(ser):
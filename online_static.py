@@ -0,0 +1,196 @@
+import os
+import math
+import numpy as np
+import attitude
+
+#### default stationarity thresholds
+# std of gyro (deg/s) and accel (m/s2) under which the unit is considered static
+gyro_std_thresh = 0.5
+acc_std_thresh = 0.1
+# a single gyro sample deviating more than this (deg/s) from the static mean is motion
+gyro_motion_thresh = 2.0
+
+
+class running_stats:
+    '''
+    Welford running mean and variance of a vector, O(1) memory.
+    '''
+    def __init__(self, n_dim):
+        self.n = 0
+        self.mean = np.zeros((n_dim,))
+        self.m2 = np.zeros((n_dim,))
+
+    def update(self, x):
+        '''
+        Add one sample.
+        Args:
+            x: n_dim numpy array
+        '''
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def var(self):
+        if self.n < 2:
+            return np.zeros(self.mean.shape)
+        return self.m2 / (self.n - 1)
+
+    def std(self):
+        return np.sqrt(self.var())
+
+
+class static_estimator:
+    '''
+    Online estimation of the initial states from the static period before motion.
+    Samples are fed one by one. Statistics of the samples before the first detected
+    motion are accumulated with Welford's algorithm, so gyro bias, averaged accel and
+    initial position/velocity/attitude are ready as soon as logging stops, without
+    reloading the log file.
+    '''
+    def __init__(self, window=100, skip=0, zero_ini_vel=True, acc_ini_att=True,\
+                 gyro_std=gyro_std_thresh, acc_std=acc_std_thresh,\
+                 gyro_motion=gyro_motion_thresh):
+        '''
+        Args:
+            window: number of samples of the exponential window used to detect
+                stationarity. Before the first window is filled, motion is only
+                declared by a gyro sample deviating from the mean by gyro_motion,
+                and a static period no longer than a window gives no result.
+            skip: number of samples at the beginning to discard, the same as the
+                rows dropped by post processing.
+            zero_ini_vel: force initial velocity to be zero.
+            acc_ini_att: get initial pitch and roll from averaged accel.
+            gyro_std, acc_std: stationarity thresholds, deg/s and m/s2.
+            gyro_motion: instantaneous gyro deviation to declare motion, deg/s.
+        '''
+        self.window = window
+        self.alpha = 1.0 / window
+        self.skip = skip
+        self.zero_ini_vel = zero_ini_vel
+        self.acc_ini_att = acc_ini_att
+        self.gyro_std = gyro_std
+        self.acc_std = acc_std
+        self.gyro_motion = gyro_motion
+        # number of samples fed, including skipped ones
+        self.n = 0
+        # index (after skip) of the first sample in motion, None if still static
+        self.idx0 = None
+        # exponentially weighted mean/var of gyro and accel for stationarity detection
+        self.ew_mean = np.zeros((6,))
+        self.ew_var = np.zeros((6,))
+        # gyro, acc, lla, vel, euler
+        self.stats = running_stats(15)
+
+    def update(self, gyro, acc, lla=None, vel=None, euler=None):
+        '''
+        Feed one sample.
+        Args:
+            gyro: gyro, deg/s
+            acc: accel, m/s2
+            lla: [lat lon alt], deg deg m, optional
+            vel: NED velocity, m/s, optional
+            euler: [yaw pitch roll], deg, optional
+        Returns:
+            True if the unit is static and the sample is used for initialization.
+        '''
+        self.n += 1
+        if self.n <= self.skip:
+            return False
+        if self.idx0 is not None:
+            return False
+        x = np.zeros((15,))
+        x[0:3] = gyro
+        x[3:6] = acc
+        if lla is not None:
+            x[6:9] = lla
+        if vel is not None:
+            x[9:12] = vel
+        if euler is not None:
+            x[12:15] = euler
+        # stationarity detection
+        k = self.n - self.skip
+        if k == 1:
+            self.ew_mean = x[0:6].copy()
+        delta = x[0:6] - self.ew_mean
+        # a gyro jump is checked from the second sample on, the std once a window is filled
+        motion = k > 1 and np.max(np.abs(delta[0:3])) > self.gyro_motion
+        self.ew_mean += self.alpha * delta
+        self.ew_var = (1.0 - self.alpha) * (self.ew_var + self.alpha * delta * delta)
+        if k > self.window:
+            ew_std = np.sqrt(self.ew_var)
+            motion = motion or np.max(ew_std[0:3]) > self.gyro_std or\
+                     np.max(ew_std[3:6]) > self.acc_std
+        if motion:
+            self.idx0 = k - 1
+            print('Motion detected at index %u.'% self.idx0)
+            return False
+        self.stats.update(x)
+        return True
+
+    def is_static(self):
+        return self.idx0 is None
+
+    def get_idx0(self):
+        '''
+        Start index of the motion. If no motion is detected, all samples are static.
+        '''
+        if self.idx0 is None:
+            return self.stats.n
+        return self.idx0
+
+    def result(self):
+        '''
+        Get the initial states in the same form as post processing.
+        Returns:
+            a dict of
+                'idx0': start index of the motion, after skip
+                'wb': gyro bias, deg/s
+                'ab': averaged accel, m/s2
+                'std': std of gyro and accel during the static period
+                'ini_states': [lat lon alt vN vE vD yaw pitch roll |g|]
+            None if there are no static samples, or motion started within the first
+            window, then the static period is too short to be detected and the
+            initial states should be estimated from the log instead.
+        '''
+        if self.stats.n == 0:
+            return None
+        if self.idx0 is not None and self.idx0 <= self.window:
+            print('Motion detected at index %u, within the first %u samples, no online'\
+                  ' initial states.'% (self.idx0, self.window))
+            return None
+        mean = self.stats.mean
+        wb = mean[0:3].copy()
+        ab = mean[3:6].copy()
+        ab_norm = math.sqrt(np.dot(ab, ab))
+        ini_pos = mean[6:9].copy()
+        ini_euler = mean[12:15].copy()
+        if self.acc_ini_att and ab_norm > 0:
+            unit_gravity = -1.0 * ab / ab_norm
+            ini_euler[1] = -math.asin(unit_gravity[0]) * attitude.R2D
+            ini_euler[2] = math.atan2(unit_gravity[1], unit_gravity[2]) * attitude.R2D
+        if self.zero_ini_vel:
+            ini_vel = np.zeros((3,))
+        else:
+            ini_vel = mean[9:12].copy()
+        ini_states = np.hstack((ini_pos, ini_vel, ini_euler, ab_norm))
+        return {'idx0': self.get_idx0(),\
+                'wb': wb,\
+                'ab': ab,\
+                'std': self.stats.std()[0:6],\
+                'ini_states': ini_states}
+
+    def save(self, dir):
+        '''
+        Write ini.txt into dir.
+        '''
+        res = self.result()
+        if res is None:
+            print('No static data to generate initial states.')
+            return None
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        file_name = os.path.join(dir, 'ini.txt')
+        np.savetxt(file_name, res['ini_states'], delimiter=',', comments='')
+        print('Initial states saved to %s, motion starts at %u.'% (file_name, res['idx0']))
+        return res
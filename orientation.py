@@ -0,0 +1,76 @@
+import numpy as np
+
+axis_map = {'x': 0, 'y': 1, 'z': 2}
+
+
+class orientation:
+    '''
+    Coordinate change given by a string including +x, -x, +y, -y, +z, -z, for
+    example '-y+x+z', which means new x = -old y, new y = old x and new z = old z.
+    The string is parsed and validated once, and then applied as index and sign
+    arrays to a single sample or to an nx3 block in one call.
+    '''
+    def __init__(self, ori):
+        '''
+        Args:
+            ori: orientation string, or another orientation object.
+        '''
+        if isinstance(ori, orientation):
+            ori = ori.ori
+        self.ori = ori.lower()
+        self.idx, self.sgn = compile_orientation(self.ori)
+        self.identity = self.ori == '+x+y+z'
+
+    def matrix(self):
+        '''
+        Signed permutation matrix C so that new = C * old.
+        '''
+        c = np.zeros((3, 3))
+        c[range(3), self.idx] = self.sgn
+        return c
+
+    def apply(self, data):
+        '''
+        change coordiante according to the orientation.
+        Args:
+            data: 3x1 or nx3 array like
+        Return:
+            data after coordinate change, numpy array of the same shape. The input
+            is not modified.
+        '''
+        data = np.asarray(data)
+        if self.identity:
+            return data.copy()
+        return data[..., self.idx] * self.sgn
+
+    def __call__(self, data):
+        return self.apply(data)
+
+    def __repr__(self):
+        return "orientation('%s')"% self.ori
+
+
+def compile_orientation(ori):
+    '''
+    Parse an orientation string.
+    Args:
+        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
+    Returns:
+        idx: index of the old axis for each new axis
+        sgn: sign for each new axis
+    '''
+    ori = ori.lower()
+    if len(ori) != 6:
+        raise ValueError('Invalid orientation %s, should be like -y+x+z.'% ori)
+    idx = np.zeros((3,), dtype=np.intp)
+    sgn = np.zeros((3,))
+    for i in range(3):
+        s = ori[2*i]
+        a = ori[2*i+1]
+        if s not in '+-' or a not in axis_map:
+            raise ValueError('Invalid orientation %s, should be like -y+x+z.'% ori)
+        idx[i] = axis_map[a]
+        sgn[i] = 1.0 if s == '+' else -1.0
+    if len(set(idx)) != 3:
+        raise ValueError('Invalid orientation %s, each axis should appear once.'% ori)
+    return idx, sgn
@@ -5,6 +5,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
 import attitude
+import spectrum
+import calibration
+import binlog
+import pyramid
+import product_cache
 
 
 #### prepare data for free integration simulation
@@ -18,8 +23,26 @@ zero_ini_vel = True
 # using averaged accelerometer output to get initial pitch and roll,
 #   otherwiese averaged INS1000 output will be used.
 acc_ini_att = True
+# calibration file keyed by unit name ('nxp' and 'bosch'), see calibration.py.
+# Bias, scale and misalignment are corrected before anything else. None to skip.
+calibration_file = None
+# save vibration spectra (Welch PSD) of accel and gyro after the start of motion
+save_spectrum = True
 
-def post_processing(data_file, nav_view=False):
+def post_processing(data_file, nav_view=False, static=None):
+    '''
+    Args:
+        data_file: logged csv file, or a binary log (see binlog.py) for logs larger than RAM
+        nav_view: True if data_file is exported from NavView
+        static: optional list of static_estimator results of the two units, see
+            online_static.py, with 'idx0' the row of the log where the motion of
+            the unit was detected. If provided, the start index of the motion (the
+            first one of the two units) and the initial states are taken from it
+            instead of asking for the index. The initial states of units corrected
+            by calibration_file are computed from the calibrated rows instead.
+    The parsed log and the generated files are cached (see product_cache.py) and
+    reused while the log, the settings, the start index and the code are unchanged.
+    '''
     #### create data dir
     if not os.path.exists(data_dir):
         try:
@@ -28,14 +51,14 @@ def post_processing(data_file, nav_view=False):
             raise IOError('Cannot create dir: %s.'% data_dir)
     #### read logged file
     if nav_view:
-        data = np.genfromtxt(data_file, delimiter='\t', skip_header=15)
+        data = product_cache.load_log(data_file, delimiter='\t', skip_header=15)
         acc0 = data[:, 1:4] * 9.80665
         gyro0 = data[:, 4:7]
         lla = np.zeros((acc0.shape[0], 3))
         vel = np.zeros((acc0.shape[0], 3))
         euler = np.zeros((acc0.shape[0], 3))
     else:
-        data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+        data = product_cache.load_log(data_file)
         # remove zero LLA/Vel/att from ins1000
         data = data[100:, :]
         acc0 = data[:, 2:5]
@@ -45,55 +68,117 @@ def post_processing(data_file, nav_view=False):
         lla = data[:, 14:17]
         vel = data[:, 17:20]
         euler = data[:, 22:19:-1]
+    if calibration_file is not None:
+        cals = calibration.load_calibration(calibration_file)
+        # corrected when rows are read, the log is not copied
+        if 'nxp' in cals:
+            acc0 = calibration.calibrated_view(acc0, cals['nxp'].acc)
+            gyro0 = calibration.calibrated_view(gyro0, cals['nxp'].gyro)
+        if not nav_view and 'bosch' in cals:
+            acc1 = calibration.calibrated_view(acc1, cals['bosch'].acc)
+            gyro1 = calibration.calibrated_view(gyro1, cals['bosch'].gyro)
     '''
     Generate logged files.
     You can specify multiple start points to generate multiple sets of data for simulaiton. 
     '''
-    # get data before motion to calculate initial states
-    plt.ion()
-    plt.plot(acc0)
-    plt.grid(True)
-    plt.pause(0.01)
-    # plt.show(block=False)
-    idx_str = input('Please input start index of the motion: ')
-    # idx = parse_index(idx_str)
-    
-    idx0 = int(idx_str)
+    if static is None:
+        static = [None, None]
+        # get data before motion to calculate initial states
+        plt.ion()
+        # min/max pyramid stored next to the log, zooming stays fast on long logs
+        name = 'acc0'
+        if calibration_file is not None:
+            name += '-' + product_cache.file_hash(calibration_file)[:8]
+        acc_plot = pyramid.plot(acc0, data_file, name, labels=['ax', 'ay', 'az'])
+        plt.grid(True)
+        plt.pause(0.01)
+        # plt.show(block=False)
+        idx_str = input('Please input start index of the motion: ')
+        # idx = parse_index(idx_str)
+        idx0 = int(idx_str)
+    else:
+        # one start index for both units, the simulation files stay aligned
+        idx0 = min(x['idx0'] for x in static if x is not None)
+        print('Start index of the motion from online estimation: %u'% idx0)
     if idx0 < 1:
         idx0 = 1
+    if calibration_file is not None:
+        # the online estimates are from raw samples, the gyro bias and initial states
+        # of calibrated units are averaged again from the calibrated rows before idx0
+        static = [None if name in cals else x for name, x in zip(['nxp', 'bosch'], static)]
+    # everything the generated files depend on
+    key = []
+    if product_cache.enabled:
+        key = [product_cache.file_hash(data_file), nav_view, idx0, dt,\
+               limit_data_to_10s, zero_ini_vel, acc_ini_att,\
+               None if calibration_file is None else product_cache.file_hash(calibration_file),\
+               product_cache.source_version(__file__, calibration.__file__, binlog.__file__)]
     # generate initial states and sensor files
     nxp_dir = data_dir + 'nxp/'
-    gen_sim_files(gyro0, acc0, lla, vel, euler, idx0, nxp_dir)
+    gen_sim_files(gyro0, acc0, lla, vel, euler, idx0, nxp_dir, static[0],\
+                  product_cache.make_key('free_integration', 'nxp', static[0], *key))
     if not nav_view:
         bosch_dir = data_dir + 'bosch/'
-        gen_sim_files(gyro1, acc1, lla, vel, euler, idx0, bosch_dir)
+        gen_sim_files(gyro1, acc1, lla, vel, euler, idx0, bosch_dir, static[1],\
+                      product_cache.make_key('free_integration', 'bosch', static[1], *key))
+    if save_spectrum:
+        # chunked Welch PSD of the rows after idx0, nothing is stacked in memory
+        units = {'nxp': binlog.hstack_view(acc0, gyro0, start=idx0)}
+        if not nav_view:
+            units['bosch'] = binlog.hstack_view(acc1, gyro1, start=idx0)
+        for name in units:
+            psd_key = product_cache.make_key('free_integration.psd', name, spectrum.segment_samples,\
+                spectrum.segment_overlap, product_cache.source_version(spectrum.__file__), *key)
+            if product_cache.restore_files(psd_key, data_dir + name + '/', ['psd.csv']):
+                continue
+            f, p = spectrum.psd(units[name], 1.0/dt)
+            if p is not None:
+                spectrum.save_psd(data_dir + name + '/psd.csv', f, p)
+                product_cache.put(psd_key, files=[data_dir + name + '/psd.csv'])
 
-def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir):
+def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir, static=None, key=None):
+    '''
+    Generate initial states and sensor files for simulation.
+    If static (result of online_static.static_estimator) is provided, gyro bias and
+    initial states are taken from it instead of averaging data before idx0.
+    The inputs are not modified and are written a chunk of rows at a time, so they
+    can be memory-mapped.
+    If key (see product_cache.make_key) is given, the files cached under it are
+    copied instead of generated, or the generated files are cached under it.
+    '''
+    files = ['ini.txt', 'time.csv', 'accel-0.csv', 'gyro-0.csv',\
+             'ref_pos.csv', 'ref_vel.csv', 'ref_att_euler.csv']
+    if key is not None and product_cache.restore_files(key, dir, files):
+        print("Simulation data restored from cache to %s"% dir)
+        return
     # create dir if it does not exist
     if not os.path.exists(dir):
         os.mkdir(dir)
-    # gyro bias
-    wb = np.average(gyro[0:idx0,:], axis=0)
-    # accel bias, not used
-    ab = np.average(acc[0:idx0,:], axis=0)
-    ab_norm = math.sqrt(np.dot(ab, ab))
-    # initial pos
-    ini_pos = np.average(lla[0:idx0,:], axis=0)
-    # initial attitude
-    ini_euler = np.average(euler[0:idx0,:], axis=0)
-    unit_gravity = -1.0 * ab / ab_norm
-    if acc_ini_att:
-        ini_euler[1] = -math.asin(unit_gravity[0]) * attitude.R2D
-        ini_euler[2] = math.atan2(unit_gravity[1], unit_gravity[2]) * attitude.R2D
-        euler[:, 1] = ini_euler[1]
-        euler[:, 2] = ini_euler[2]
-    # initial vel
-    if zero_ini_vel:
-        ini_vel = np.zeros((3,))
-    else: 
-        ini_vel = np.average(vel[0:idx0,:], axis=0)
-    # all initial states
-    ini_states = np.hstack((ini_pos, ini_vel, ini_euler, ab_norm))
+    if static is not None:
+        wb = static['wb']
+        ini_states = static['ini_states']
+        ini_euler = ini_states[6:9]
+    else:
+        # gyro bias
+        wb = np.average(gyro[0:idx0,:], axis=0)
+        # accel bias, not used
+        ab = np.average(acc[0:idx0,:], axis=0)
+        ab_norm = math.sqrt(np.dot(ab, ab))
+        # initial pos
+        ini_pos = np.average(lla[0:idx0,:], axis=0)
+        # initial attitude
+        ini_euler = np.average(euler[0:idx0,:], axis=0)
+        unit_gravity = -1.0 * ab / ab_norm
+        if acc_ini_att:
+            ini_euler[1] = -math.asin(unit_gravity[0]) * attitude.R2D
+            ini_euler[2] = math.atan2(unit_gravity[1], unit_gravity[2]) * attitude.R2D
+        # initial vel
+        if zero_ini_vel:
+            ini_vel = np.zeros((3,))
+        else: 
+            ini_vel = np.average(vel[0:idx0,:], axis=0)
+        # all initial states
+        ini_states = np.hstack((ini_pos, ini_vel, ini_euler, ab_norm))
     #### create log file
     if limit_data_to_10s:
         n = idx0 + int(10.0/dt)
@@ -112,25 +197,38 @@ def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir):
     # acc
     file_name = dir + "accel-0.csv"
     headerline = "accel_x (m/s^2),accel_y (m/s^2),accel_z (m/s^2)"
-    np.savetxt(file_name, acc[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (acc[a:b, :] for a, b in binlog.chunks(idx0, n)))
     # gyro
     file_name = dir + "gyro-0.csv"
     headerline = "gyro_x (deg/s),gyro_y (deg/s),gyro_z (deg/s)"
-    np.savetxt(file_name, gyro[idx0:n, :]-wb, header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (gyro[a:b, :]-wb for a, b in binlog.chunks(idx0, n)))
     # ref_pos
     file_name = dir + "ref_pos.csv"
     headerline = "ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)"
-    np.savetxt(file_name, lla[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (lla[a:b, :] for a, b in binlog.chunks(idx0, n)))
     # ref_vel
     file_name = dir + "ref_vel.csv"
     headerline = "ref_vel_x (m/s),ref_vel_y (m/s),ref_vel_z (m/s)"
-    np.savetxt(file_name, vel[idx0:n, :], header=headerline, delimiter=',', comments='')
-    # ref_att_euler
+    binlog.save_rows(file_name, headerline, (vel[a:b, :] for a, b in binlog.chunks(idx0, n)))
+    # ref_att_euler, pitch and roll from accel if acc_ini_att
     file_name = dir + "ref_att_euler.csv"
     headerline = "ref_Yaw (deg),ref_Pitch (deg),ref_Roll (deg)"
-    np.savetxt(file_name, euler[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (ref_euler(euler[a:b, :], ini_euler) for a, b in binlog.chunks(idx0, n)))
+    if key is not None:
+        product_cache.put(key, files=[dir + x for x in files])
     print("Simulation data saved to %s"% dir)
 
+def ref_euler(euler, ini_euler):
+    '''
+    Reference Euler angles of a chunk of rows, a copy with pitch and roll replaced
+    by the initial ones if acc_ini_att.
+    '''
+    euler = np.array(euler)
+    if acc_ini_att:
+        euler[:, 1] = ini_euler[1]
+        euler[:, 2] = ini_euler[2]
+    return euler
+
 def parse_index(idx):
     ii = idx.find(':')
     if ii >= 0:
@@ -5,6 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
 import attitude
+import binlog
+import pyramid
 
 
 #### prepare data for free integration simulation
@@ -35,7 +37,8 @@ def post_processing(data_file, nav_view=False):
         vel = np.zeros((acc0.shape[0], 3))
         euler = np.zeros((acc0.shape[0], 3))
     else:
-        data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+        # a binary log (see binlog.py) is memory-mapped for logs larger than RAM
+        data = binlog.load(data_file)
         # remove zero LLA/Vel/att from ins1000
         data = data[100:, :]
         acc0 = data[:, 2:5]
@@ -51,7 +54,8 @@ def post_processing(data_file, nav_view=False):
     '''
     # get data before motion to calculate initial states
     plt.ion()
-    plt.plot(acc0)
+    # min/max pyramid stored next to the log, zooming stays fast on long logs
+    acc_plot = pyramid.plot(acc0, data_file, 'acc0', labels=['ax', 'ay', 'az'])
     plt.grid(True)
     plt.pause(0.01)
     # plt.show(block=False)
@@ -97,15 +101,15 @@ def gen_ref_data_files(lla, vel, euler, idx0, n, dir):
     # ref_pos
     file_name = dir + "ref_pos.csv"
     headerline = "ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)"
-    np.savetxt(file_name, lla[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (lla[a:b, :] for a, b in binlog.chunks(idx0, n)))
     # ref_vel
     file_name = dir + "ref_vel.csv"
     headerline = "ref_vel_x (m/s),ref_vel_y (m/s),ref_vel_z (m/s)"
-    np.savetxt(file_name, vel[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (vel[a:b, :] for a, b in binlog.chunks(idx0, n)))
     # ref_att_euler
     file_name = dir + "ref_att_euler.csv"
     headerline = "ref_Yaw (deg),ref_Pitch (deg),ref_Roll (deg)"
-    np.savetxt(file_name, euler[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (euler[a:b, :] for a, b in binlog.chunks(idx0, n)))
 
 def gen_sensor_files(gyro, acc, lla, vel, euler, idx0, n, dir, key=0):
     # create dir if it does not exist
@@ -139,11 +143,11 @@ def gen_sensor_files(gyro, acc, lla, vel, euler, idx0, n, dir, key=0):
     # acc
     file_name = dir + "accel-" + key_str + ".csv"
     headerline = "accel_x (m/s^2),accel_y (m/s^2),accel_z (m/s^2)"
-    np.savetxt(file_name, acc[idx0:n, :], header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (acc[a:b, :] for a, b in binlog.chunks(idx0, n)))
     # gyro
     file_name = dir + "gyro-" + key_str + ".csv"
     headerline = "gyro_x (deg/s),gyro_y (deg/s),gyro_z (deg/s)"
-    np.savetxt(file_name, gyro[idx0:n, :]-wb, header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (gyro[a:b, :]-wb for a, b in binlog.chunks(idx0, n)))
 
 def parse_index(idx):
     ii = idx.find(':')
@@ -1,51 +1,424 @@
 import os
 import math
+import time
+import io
+import json
+import shutil
+import tempfile
 import threading
 import numpy as np
 import attitude
+import geodesy
+import ins_metrics
+import alignment
+import resample
+import binlog
+import product_cache
+import simplify
 import kml.dynamic_kml as kml
 
 
 #### prepare data for free integration simulation
 data_dir = "./ins_data/"
+# estimate the lag of the INS1000 reference from yaw rate and resample it onto the
+# INS381 samples, instead of pairing each sample with the last received reference
+align_reference = True
+# checkpoint of incremental post processing, in data_dir
+checkpoint_file = 'checkpoint.json'
+# in incremental mode a KML point every this many rows, the final length of a
+# growing log is not known
+incremental_kml_step = 100
+# bump when the output of incremental post processing changes, older checkpoints
+# are discarded and the log is processed again from the start
+checkpoint_version = 2
 
 
 def post_processing(data_file):
+    '''
+    Args:
+        data_file: logged csv file, or its binary log (see binlog.py). A binary log is
+            memory-mapped and processed in chunks of rows, so logs larger than RAM
+            can be processed. The output files are the same either way.
+    The parsed log, the resampled reference and the output files are cached (see
+    product_cache.py) and reused while the log, the settings and the code are
+    unchanged.
+    '''
     #### create data dir
     if not os.path.exists(data_dir):
         try:
             os.makedirs(data_dir)
         except:
             raise IOError('Cannot create dir: %s.'% data_dir)
+    outputs = ['pos-0.csv', 'ref_pos.csv', 'att_euler-0.csv', 'pos_err-0.csv',\
+               'summary.json', 'ref_pos.kml', 'pos-1.kml']
+    version = product_cache.source_version(__file__, alignment.__file__, resample.__file__,\
+                                           geodesy.__file__, ins_metrics.__file__, binlog.__file__,\
+                                           kml.__file__, simplify.__file__)
+    input_hash = product_cache.file_hash(data_file) if product_cache.enabled else None
+    key = product_cache.make_key('ins_test', input_hash, align_reference, version, kml.tolerance)
+    if product_cache.restore_files(key, data_dir, outputs):
+        print('Outputs of %s restored from cache.'% data_file)
+        with open(data_dir + 'summary.json', 'r') as f:
+            print_analysis(json.load(f))
+        return
     #### read logged file
-    data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+    data = product_cache.load_log(data_file)
     # remove zero LLA/Vel/att from ins1000
     data = data[100:, :]
-    lla = data[:, 8:11]
-    vel = data[:, 11:14]
-    euler = data[:, 14:17]
-    ref_lla = data[:, 17:20]
-    ref_vel = data[:, 20:23]
-    ref_euler = data[:, 23:26]
+    model, start, stop, ref = aligned_reference(data, product_cache.make_key('ins_test.ref', input_hash,\
+        align_reference, alignment.grid_rate, alignment.window_time, alignment.step_time,\
+        alignment.max_offset, alignment.min_quality, version))
     # Generate logged files
     file_name = data_dir + "pos-0.csv"
     headerline = "pos_lat (deg),pos_lon (deg),pos_alt (m)"
-    np.savetxt(file_name, lla, header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (x[:, 8:11] for x in blocks(data, model, start, stop, ref=ref)))
     file_name = data_dir + "ref_pos.csv"
     headerline = "ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)"
-    np.savetxt(file_name, ref_lla, header=headerline, delimiter=',', comments='')
+    binlog.save_rows(file_name, headerline, (x[:, 17:20] for x in blocks(data, model, start, stop, ref=ref)))
     file_name = data_dir + "att_euler-0.csv"
     headerline = "Yaw (deg),Pitch (deg),Roll (deg)"
-    np.savetxt(file_name, euler[:,-1:-4:-1], header=headerline, delimiter=',', comments='')
-    # generate .kml file
-    file_name = data_dir + 'ref_pos.kml'
-    kml.gen_kml(file_name, ref_lla, ref_euler[:,2], 'ff0000ff')
-    file_name = data_dir + 'pos-1.kml'
-    kml.gen_kml(file_name, lla, euler[:,2], 'ffff0000')
-    
+    binlog.save_rows(file_name, headerline, (x[:, 16:13:-1] for x in blocks(data, model, start, stop, ref=ref)))
+    # position error in the local NED frame of the reference
+    file_name = data_dir + "pos_err-0.csv"
+    headerline = "pos_err_N (m),pos_err_E (m),pos_err_D (m)"
+    binlog.save_rows(file_name, headerline, (geodesy.ned_error(x[:, 8:11], x[:, 17:20])\
+                                             for x in blocks(data, model, start, stop, ref=ref)))
+    # generate .kml file and the accuracy of the run and of its segments. The aligned
+    # rows are written to a temporary memory-mapped file for ins_metrics.analyze, so
+    # only the per-sample errors are held in memory.
+    ref_kml = kml.open_kml(data_dir + 'ref_pos.kml', 'ff0000ff')
+    ref_writer = kml.kml_writer(ref_kml, stop - start)
+    ins_kml = kml.open_kml(data_dir + 'pos-1.kml', 'ffff0000')
+    ins_writer = kml.kml_writer(ins_kml, stop - start)
+    rows_dir = tempfile.mkdtemp(prefix='ins_test-')
+    try:
+        rows = np.lib.format.open_memmap(os.path.join(rows_dir, 'rows.npy'), mode='w+',\
+                                         dtype=np.float64, shape=(stop - start, data.shape[1]))
+        for a, x in zip(range(0, stop - start, binlog.chunk_rows), blocks(data, model, start, stop, ref=ref)):
+            ref_writer.write(x[:, 17:20], x[:, 25])
+            ins_writer.write(x[:, 8:11], x[:, 16])
+            rows[a:a+x.shape[0], :] = x
+        res = ins_metrics.analyze(rows)
+        del rows
+    finally:
+        shutil.rmtree(rows_dir, ignore_errors=True)
+    kml.close_kml(ref_kml)
+    kml.close_kml(ins_kml)
+    with open(data_dir + 'summary.json', 'w') as f:
+        json.dump(res, f)
+    print_analysis(res)
+    product_cache.put(key, files=[data_dir + x for x in outputs])
+
+
+def print_summary(res, name='all'):
+    '''
+    Args:
+        res: result of ins_metrics.summarize() or running_summary.result()
+    '''
+    if res['samples'] > 0:
+        print('%s: %u rows, horizontal CEP50/CEP95: %.3f/%.3f m, vertical RMS: %.3f m, yaw RMS: %.3f deg'%\
+              (name, res['samples'], res['horizontal']['cep50'], res['horizontal']['cep95'],\
+               res['vertical']['rms'], res['att']['rms'][2]))
+
+
+def print_analysis(res):
+    '''
+    Args:
+        res: result of ins_metrics.analyze()
+    '''
+    print_summary(res['all'])
+    for name in res['types']:
+        print_summary(res['types'][name], name)
+
+
+def aligned_reference(data, key):
+    '''
+    Lag of the reference and the reference columns resampled onto the rows it
+    covers, cached under key.
+    Returns:
+        model (None if not aligned), rows start and stop, (stop-start)x9 resampled
+        reference columns (None if not aligned or not cached)
+    '''
+    cached = product_cache.load_arrays(key)
+    if cached is not None:
+        m = cached['model']
+        model = {'offset': m[0], 'drift': m[1], 't_ref': m[2]} if m.shape[0] else None
+        return model, int(cached['rows'][0]), int(cached['rows'][1]), cached.get('ref')
+    model = estimate_lag(data) if align_reference else None
+    start, stop = valid_rows(data.shape[0], model)
+    if not product_cache.enabled:
+        return model, start, stop, None
+    staging = product_cache.begin(key)
+    try:
+        m = [] if model is None else [model['offset'], model['drift'], model['t_ref']]
+        np.save(os.path.join(staging, 'model.npy'), np.array(m, dtype=np.float64))
+        np.save(os.path.join(staging, 'rows.npy'), np.array([start, stop]))
+        if model is not None:
+            # written a chunk at a time, the log may be larger than RAM
+            ref = np.lib.format.open_memmap(os.path.join(staging, 'ref.npy'), mode='w+',\
+                                            dtype=np.float64, shape=(stop - start, 9))
+            for a, x in zip(range(0, stop - start, binlog.chunk_rows), blocks(data, model, start, stop)):
+                ref[a:a+x.shape[0], :] = x[:, 17:26]
+            ref.flush()
+            del ref
+    except:
+        product_cache.discard(staging)
+        raise
+    product_cache.commit(key, staging)
+    return aligned_reference(data, key)
+
+
+def estimate_lag(data):
+    '''
+    Lag of the reference, estimated by cross-correlating the yaw rates.
+    Returns:
+        model of alignment.estimate, None if it cannot be estimated
+    '''
+    t = np.arange(data.shape[0]) / ins_metrics.sample_rate
+    model = alignment.estimate(t, alignment.yaw_rate(t, data[:, 16]),\
+                               t, alignment.yaw_rate(t, data[:, 25]))
+    if model is None:
+        print('Reference lag cannot be estimated, data are not aligned.')
+    else:
+        print('Reference lag: %.3f s, drift: %.1f ppm'% (model['offset'], model['drift'] * 1e6))
+    return model
+
+
+def valid_rows(n, model):
+    '''
+    Rows [start, stop) covered by the reference after alignment.
+    '''
+    if model is None or n == 0:
+        return 0, n
+    fs = ins_metrics.sample_rate
+    t0, t1 = alignment.correct_time(np.array([0.0, (n - 1) / fs]), model)
+    start = max(int(math.ceil(t0 * fs)), 0)
+    while start > 0 and (start - 1) / fs >= t0:
+        start -= 1
+    while start < n and start / fs < t0:
+        start += 1
+    stop = min(int(math.floor(t1 * fs)) + 1, n)
+    while stop < n and stop / fs <= t1:
+        stop += 1
+    while stop > start and (stop - 1) / fs > t1:
+        stop -= 1
+    return start, max(stop, start)
+
+
+def margin_rows(model, n):
+    '''
+    Rows of reference around a row needed to resample it, from the largest lag over
+    the first n rows.
+    '''
+    if model is None:
+        return 0
+    fs = ins_metrics.sample_rate
+    lag = max(abs(model['offset'] + model['drift'] * (t - model['t_ref'])) for t in (0.0, n / fs))
+    return int(math.ceil(lag * fs)) + 2
+
+
+def blocks(data, model, start, stop, rows=binlog.chunk_rows, first=0, ref=None):
+    '''
+    Rows [start, stop) of the log in chunks, with the reference columns resampled
+    onto the INS381 samples if model is given.
+    Args:
+        first: row of the log in data[0], when data holds only the end of the log
+        ref: reference columns already resampled onto rows [start, stop), see
+            aligned_reference()
+    '''
+    fs = ins_metrics.sample_rate
+    n = first + data.shape[0]
+    margin = margin_rows(model, n)
+    for a, b in binlog.chunks(start, stop, rows):
+        block = np.array(data[a-first:b-first, :])
+        if ref is not None:
+            block[:, 17:26] = ref[a-start:b-start, :]
+        elif model is not None:
+            a0 = max(a - margin, first)
+            b0 = min(b + margin, n)
+            t_src = np.arange(a0, b0) / fs
+            t = np.arange(a, b) / fs
+            block[:, 17:26] = resample_reference(t_src, data[a0-first:b0-first, 17:26], t, model)
+        yield block
+
+
+def resample_reference(t_src, ref, t, model):
+    '''
+    Reference columns onto the times t of the INS381 samples: position linearly,
+    velocity by a cubic Hermite spline and attitude by SLERP (see resample.py).
+    Args:
+        t_src: n times of the reference rows, on the clock of the log
+        ref: nx9 reference lla, NED velocity and [roll pitch yaw] (deg)
+        model: lag of the reference, see alignment.estimate
+    Returns:
+        mx9 like ref, NaN outside the reference
+    '''
+    out = resample.resample(alignment.correct_time(t_src, model),\
+                            {'lla': ref[:, 0:3], 'vel': ref[:, 3:6], 'euler': ref[:, 8:5:-1]}, t)
+    return np.hstack((out['lla'], out['vel'], out['euler'][:, ::-1]))
+
+
+def read_new_rows(data_file, offset):
+    '''
+    Complete rows of a log after byte offset, a csv log or a binary log.
+    Returns:
+        nxk rows, byte offset after them
+    '''
+    if binlog.is_binlog(data_file):
+        data, names = binlog.open_binlog(data_file)
+        row_bytes = 8 * len(names)
+        i = offset // row_bytes
+        return np.array(data[i:]), data.shape[0] * row_bytes
+    with open(data_file, 'rb') as f:
+        f.seek(offset)
+        if offset == 0:
+            offset = len(f.readline())
+        buf = f.read()
+    # the last line may still be being written
+    end = buf.rfind(b'\n') + 1
+    if end == 0:
+        return np.zeros((0, 0)), offset
+    rows = np.genfromtxt(io.BytesIO(buf[:end]), delimiter=',', ndmin=2)
+    return rows, offset + end
+
+
+def _settings():
+    return {'version': checkpoint_version, 'align_reference': align_reference,\
+            'kml_step': incremental_kml_step, 'skip_rows': ins_metrics.skip_rows}
+
+
+def load_checkpoint(data_file):
+    '''
+    Checkpoint of data_file, None if there is none or it cannot be continued: another
+    log or other settings, the log is shorter than the checkpoint (rewritten), or
+    output files are missing.
+    '''
+    try:
+        with open(data_dir + checkpoint_file, 'r') as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if state.get('data_file') != os.path.abspath(data_file) or state.get('settings') != _settings():
+        return None
+    if not os.path.exists(data_file) or os.path.getsize(data_file) < state['offset']:
+        return None
+    for name in ['pos-0.csv', 'ref_pos.csv', 'att_euler-0.csv', 'pos_err-0.csv', 'ref_pos.kml', 'pos-1.kml']:
+        if not os.path.exists(data_dir + name):
+            return None
+    return state
+
+
+def save_checkpoint(state):
+    tmp = data_dir + checkpoint_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, data_dir + checkpoint_file)
+
+
+def post_processing_incremental(data_file, reset=False):
+    '''
+    Process only the rows added to a log since the last call, and append them to the
+    output files of post_processing(). The byte offset reached, the last rows still
+    needed to align the reference, the KML state and the running statistics are
+    kept in a checkpoint in data_dir.
+    The lag of the reference is estimated once, from the rows available at the
+    first call, and the last rows are held back until the reference after them has
+    been logged.
+    Args:
+        data_file: logged csv file, or its binary log, possibly still growing
+        reset: ignore the checkpoint and process the log from the start
+    Returns:
+        statistics so far, like ins_metrics.summarize()
+    '''
+    if not os.path.exists(data_dir):
+        try:
+            os.makedirs(data_dir)
+        except:
+            raise IOError('Cannot create dir: %s.'% data_dir)
+    state = None if reset else load_checkpoint(data_file)
+    resume = state is not None
+    if not resume:
+        state = {'data_file': os.path.abspath(data_file), 'settings': _settings(),\
+                 'offset': 0, 'rows': 0, 'tail': [], 'tail_start': 0, 'next': None,\
+                 'kml': None, 'stats': None}
+    new, state['offset'] = read_new_rows(data_file, state['offset'])
+    # remove zero LLA/Vel/att from ins1000
+    skip = max(ins_metrics.skip_rows - state['rows'], 0)
+    state['rows'] += new.shape[0]
+    new = new[skip:, :]
+    tail = np.array(state['tail'])
+    # no complete row may have been added since the last call
+    if tail.shape[0] == 0:
+        data = new
+    elif new.shape[0] == 0:
+        data = tail
+    else:
+        data = np.vstack((tail, new))
+    first = state['tail_start']
+    n = first + data.shape[0]
+    if state['next'] is None and n > 0:
+        model = estimate_lag(data) if align_reference else None
+        # only what is needed to resample, the checkpoint is JSON
+        state['model'] = None if model is None else\
+            {'offset': float(model['offset']), 'drift': float(model['drift']), 't_ref': float(model['t_ref'])}
+        state['next'] = valid_rows(n, state['model'])[0]
+    model = state.get('model')
+    start = state['next'] if state['next'] is not None else 0
+    margin = margin_rows(model, n)
+    stop = max(min(valid_rows(n, model)[1], n - margin), start)
+    chunks = list(blocks(data, model, start, stop, first=first)) if stop > start else []
+    # append the new rows to the outputs
+    outputs = [("pos-0.csv", "pos_lat (deg),pos_lon (deg),pos_alt (m)", lambda x: x[:, 8:11]),\
+               ("ref_pos.csv", "ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)", lambda x: x[:, 17:20]),\
+               ("att_euler-0.csv", "Yaw (deg),Pitch (deg),Roll (deg)", lambda x: x[:, 16:13:-1]),\
+               ("pos_err-0.csv", "pos_err_N (m),pos_err_E (m),pos_err_D (m)",\
+                lambda x: geodesy.ned_error(x[:, 8:11], x[:, 17:20]))]
+    for file_name, headerline, cols in outputs:
+        binlog.save_rows(data_dir + file_name, headerline, (cols(x) for x in chunks), append=resume)
+    # continue the KML tracks
+    k = state['kml'] if resume else {'idx': 0}
+    if resume:
+        ref_kml = kml.reopen_kml(data_dir + 'ref_pos.kml', k['ref'])
+        ins_kml = kml.reopen_kml(data_dir + 'pos-1.kml', k['ins'])
+    else:
+        ref_kml = kml.open_kml(data_dir + 'ref_pos.kml', 'ff0000ff')
+        ins_kml = kml.open_kml(data_dir + 'pos-1.kml', 'ffff0000')
+    ref_writer = kml.kml_writer(ref_kml, 0, step=incremental_kml_step, idx=k['idx'])
+    ins_writer = kml.kml_writer(ins_kml, 0, step=incremental_kml_step, idx=k['idx'])
+    stats = ins_metrics.running_summary(state['stats'])
+    for x in chunks:
+        ref_writer.write(x[:, 17:20], x[:, 25])
+        ins_writer.write(x[:, 8:11], x[:, 16])
+        stats.update(ins_metrics.errors(x))
+    state['kml'] = {'idx': ref_writer.idx, 'ref': kml.close_kml(ref_kml), 'ins': kml.close_kml(ins_kml)}
+    state['stats'] = stats.to_dict()
+    # keep the rows still to be written and the reference before them
+    keep = max(min(stop - margin, n), first)
+    state['tail'] = data[keep-first:, :].tolist()
+    state['tail_start'] = keep
+    if state['next'] is not None:
+        state['next'] = stop
+    save_checkpoint(state)
+    res = stats.result()
+    print_summary(res)
+    return res
+
+
+def watch(data_file, period=10.0):
+    '''
+    Incremental post processing of a growing log every period seconds, until Ctrl-C.
+    '''
+    try:
+        while True:
+            post_processing_incremental(data_file)
+            time.sleep(period)
+    except KeyboardInterrupt:
+        pass
+
 
 if __name__ == "__main__":
     # data_file = "E:\\Projects\\python-imu380-mult\\log_data\\log(2).csv"
     data_file = "e:\\vs_projects\\dmu380_offline_sim-ins_update\\sim_data\\results.csv"
     # data_file = "D:\\MyDocuments\\desktop\\新建文件夹\\log-2019_09_12_10_09_54.csv"
-    post_processing(data_file)
\ No newline at end of file
+    post_processing(data_file)
+    # watch(data_file)
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Content-addressed cache of derived post processing products.
+
+An entry is keyed by the hash of the input log, the parameters and the version of
+the code that made it, so it is only reused while all of them are unchanged.
+Entries are directories of files under cache_dir: .npy arrays, loaded memory-mapped,
+and output files, copied back where they were generated. The total size of the
+entries is bounded, the least recently used entries are removed first.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# root of the cache
+cache_dir = './cache/'
+# most bytes of all entries
+max_bytes = 4 << 30
+# bytes hashed at a time
+hash_chunk = 1 << 20
+# False to always recompute
+enabled = True
+# bump when the layout of entries changes
+cache_version = 1
+
+
+def _entries_dir():
+    return os.path.join(cache_dir, 'entries')
+
+
+def entry_dir(key):
+    return os.path.join(_entries_dir(), key)
+
+
+def _json_default(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError('Cannot hash parameter of type %s'% type(x))
+
+
+def make_key(*parts):
+    '''
+    Key of a product from any JSON-like parts: input hashes, parameters, versions.
+    Numpy arrays and numbers are accepted.
+    '''
+    s = json.dumps([cache_version] + list(parts), sort_keys=True, default=_json_default)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def _hash_file(file_name):
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        while True:
+            buf = f.read(hash_chunk)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def file_hash(file_name):
+    '''
+    SHA-1 of the content of a file. Hashes are remembered by path, size and
+    modification time, so an unchanged log is read only once.
+    '''
+    path = os.path.abspath(file_name)
+    st = os.stat(path)
+    memo_file = os.path.join(cache_dir, 'hashes.json')
+    try:
+        with open(memo_file, 'r') as f:
+            memo = json.load(f)
+    except (IOError, OSError, ValueError):
+        memo = {}
+    stamp = [st.st_size, st.st_mtime]
+    if path in memo and memo[path][:2] == stamp:
+        return memo[path][2]
+    h = _hash_file(path)
+    memo[path] = stamp + [h]
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(memo_file, 'w') as f:
+        json.dump(memo, f)
+    return h
+
+
+def source_version(*files):
+    '''
+    Version of code from the content of its source files, e.g. module.__file__.
+    '''
+    h = hashlib.sha1()
+    for file_name in files:
+        if file_name.endswith('.pyc'):
+            file_name = file_name[:-1]
+        with open(file_name, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def get(key):
+    '''
+    Directory of an entry, None if it is not cached. The entry is marked as used.
+    '''
+    if not enabled:
+        return None
+    d = entry_dir(key)
+    if not os.path.isdir(d):
+        return None
+    os.utime(d, None)
+    return d
+
+
+def begin(key):
+    '''
+    Create a staging directory for the files of a new entry, see commit().
+    '''
+    d = entry_dir(key) + '.tmp%u'% os.getpid()
+    if os.path.exists(d):
+        shutil.rmtree(d)
+    os.makedirs(d)
+    return d
+
+
+def commit(key, staging):
+    '''
+    Make the files written into staging the entry of key, then evict old entries.
+    '''
+    d = entry_dir(key)
+    if os.path.exists(d):
+        shutil.rmtree(d)
+    os.rename(staging, d)
+    evict(keep=key)
+
+
+def discard(staging):
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def put(key, arrays=None, files=None):
+    '''
+    Cache arrays (dict of name and array) and copies of files as the entry of key.
+    '''
+    if not enabled:
+        return
+    staging = begin(key)
+    try:
+        for name in (arrays or {}):
+            np.save(os.path.join(staging, name + '.npy'), arrays[name])
+        for file_name in (files or []):
+            shutil.copyfile(file_name, os.path.join(staging, os.path.basename(file_name)))
+    except:
+        discard(staging)
+        raise
+    commit(key, staging)
+
+
+def load_arrays(key, mmap_mode='r'):
+    '''
+    Arrays of an entry, memory-mapped. None if it is not cached.
+    '''
+    d = get(key)
+    if d is None:
+        return None
+    return {name[:-4]: np.load(os.path.join(d, name), mmap_mode=mmap_mode)\
+            for name in os.listdir(d) if name.endswith('.npy')}
+
+
+def restore_files(key, out_dir, names):
+    '''
+    Copy the cached files of an entry into out_dir.
+    Returns:
+        True if all files are cached and copied, False if they must be generated
+    '''
+    d = get(key)
+    if d is None:
+        return False
+    src = [os.path.join(d, name) for name in names]
+    if not all(os.path.exists(x) for x in src):
+        return False
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for x in src:
+        shutil.copyfile(x, os.path.join(out_dir, os.path.basename(x)))
+    return True
+
+
+def _size(d):
+    return sum(os.path.getsize(os.path.join(d, x)) for x in os.listdir(d))
+
+
+def evict(limit=None, keep=None):
+    '''
+    Remove the least recently used entries until all entries take at most limit
+    bytes (max_bytes if None). The entry of key keep is not removed.
+    '''
+    limit = max_bytes if limit is None else limit
+    root = _entries_dir()
+    if not os.path.isdir(root):
+        return
+    entries = []
+    for key in os.listdir(root):
+        d = os.path.join(root, key)
+        # skip staging directories of other processes
+        if os.path.isdir(d) and '.tmp' not in key:
+            entries.append((os.path.getmtime(d), key, _size(d)))
+    total = sum(e[2] for e in entries)
+    for t, key, size in sorted(entries):
+        if total <= limit:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+        total -= size
+
+
+def clear():
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def load_log(data_file, delimiter=',', skip_header=1):
+    '''
+    binlog.load() of a log. A csv log is converted a chunk of rows at a time into a
+    binary log in the cache, and only memory-mapped from there on later calls.
+    '''
+    import binlog
+    if binlog.is_binlog(data_file) or not enabled:
+        return binlog.load(data_file, delimiter, skip_header)
+    key = make_key('binlog', file_hash(data_file), delimiter, skip_header)
+    d = get(key)
+    if d is None:
+        staging = begin(key)
+        try:
+            binlog.csv_to_binlog(data_file, os.path.join(staging, 'log' + binlog.ext),\
+                                 delimiter, skip_header)
+        except:
+            discard(staging)
+            raise
+        commit(key, staging)
+        d = entry_dir(key)
+    return binlog.open_binlog(os.path.join(d, 'log' + binlog.ext))[0]
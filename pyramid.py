@@ -0,0 +1,258 @@
+"""
+Min/max/mean decimation pyramid for plotting logs of millions of samples.
+
+Level l (1, 2, ...) holds the min, max and mean of each column over bins of
+base_bin * factor**(l-1) samples. The levels are built once, a chunk of rows at a
+time, and stored as .npy files in a directory next to the log. A plot then reads
+only the bins of the visible range, from the level matching the zoom and the
+width of the axes in pixels, and the raw samples once zoomed in far enough.
+"""
+
+import os
+import json
+import numpy as np
+import binlog
+
+# samples in a bin of level 1
+base_bin = 16
+# ratio of the bin sizes of adjacent levels
+factor = 4
+# levels are added until the top one has at most this many bins
+top_bins = 4096
+# bins drawn per pixel of the axes
+bins_per_pixel = 1.0
+# bump when the stored levels change, older pyramids are rebuilt
+pyramid_version = 1
+
+# fields of a level, axis 1 of the stored arrays
+MIN, MAX, MEAN = 0, 1, 2
+
+
+def _bin_counts(n, size):
+    '''
+    Samples in each bin of size samples, the last bin may be partial.
+    '''
+    nb = (n + size - 1) // size
+    cnt = np.full((nb,), size, dtype=np.float64)
+    if nb:
+        cnt[-1] = n - (nb - 1) * size
+    return cnt
+
+
+def _reduce(block, size, weights=None):
+    '''
+    Min, max and mean of consecutive groups of size rows of nxk raw samples, or of
+    an nx3xk level whose bins hold weights samples.
+    '''
+    idx = np.arange(0, block.shape[0], size)
+    out = np.empty((idx.shape[0], 3, block.shape[-1]))
+    if block.ndim == 2:
+        cnt = np.diff(np.append(idx, block.shape[0]))
+        out[:, MIN] = np.minimum.reduceat(block, idx, axis=0)
+        out[:, MAX] = np.maximum.reduceat(block, idx, axis=0)
+        out[:, MEAN] = np.add.reduceat(block, idx, axis=0) / cnt[:, None]
+    else:
+        out[:, MIN] = np.minimum.reduceat(block[:, MIN], idx, axis=0)
+        out[:, MAX] = np.maximum.reduceat(block[:, MAX], idx, axis=0)
+        out[:, MEAN] = np.add.reduceat(block[:, MEAN] * weights[:, None], idx, axis=0)\
+                       / np.add.reduceat(weights, idx)[:, None]
+    return out
+
+
+def build(x, out_dir, chunk=binlog.chunk_rows, stamp=None):
+    '''
+    Build the pyramid of the columns of x and store it in out_dir.
+    Args:
+        x: n or nxk array, memmap or any array like sliced by rows
+        stamp: anything JSON-like identifying the source, see for_log()
+    Returns:
+        pyramid
+    '''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    # written last, a pyramid without it is incomplete
+    meta_file = os.path.join(out_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    n = x.shape[0]
+    k = x.shape[1] if len(x.shape) > 1 else 1
+    # level 1 from the raw samples
+    size = base_bin
+    chunk = max(chunk // size, 1) * size
+    level = np.lib.format.open_memmap(os.path.join(out_dir, 'level1.npy'), mode='w+',\
+                                      dtype=np.float64, shape=((n + size - 1) // size, 3, k))
+    for a, b in binlog.chunks(0, n, chunk):
+        block = np.asarray(x[a:b], dtype=np.float64).reshape(b - a, k)
+        level[a // size:(b + size - 1) // size] = _reduce(block, size)
+    levels = 1
+    # next levels from the previous one
+    while level.shape[0] > top_bins:
+        cnt = _bin_counts(n, size)
+        size *= factor
+        nb = (level.shape[0] + factor - 1) // factor
+        nxt = np.lib.format.open_memmap(os.path.join(out_dir, 'level%u.npy'% (levels + 1)), mode='w+',\
+                                        dtype=np.float64, shape=(nb, 3, k))
+        step = max(chunk // factor, 1) * factor
+        for a, b in binlog.chunks(0, level.shape[0], step):
+            nxt[a // factor:(b + factor - 1) // factor] = _reduce(level[a:b], factor, cnt[a:b])
+        level.flush()
+        level = nxt
+        levels += 1
+    level.flush()
+    del level
+    meta = {'version': pyramid_version, 'n': n, 'k': k, 'base_bin': base_bin,\
+            'factor': factor, 'levels': levels, 'stamp': stamp}
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+    return pyramid(out_dir, x)
+
+
+class pyramid:
+    '''
+    Levels of a stored pyramid, memory-mapped.
+    '''
+    def __init__(self, out_dir, raw=None):
+        '''
+        Args:
+            out_dir: directory written by build()
+            raw: the source samples, drawn when zoomed in below the first level
+        '''
+        with open(os.path.join(out_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.n = self.meta['n']
+        self.k = self.meta['k']
+        self.raw = raw
+        self.levels = [np.load(os.path.join(out_dir, 'level%u.npy'% (l + 1)), mmap_mode='r')\
+                       for l in range(self.meta['levels'])]
+
+    def bin_size(self, level):
+        '''
+        Samples in a bin of level, 1 for the raw samples (level 0).
+        '''
+        if level == 0:
+            return 1
+        return self.meta['base_bin'] * self.meta['factor']**(level - 1)
+
+    def level_for(self, span, pixels):
+        '''
+        The coarsest level with at least bins_per_pixel bins per pixel over span
+        samples, 0 if the raw samples are needed (and available).
+        '''
+        target = span / max(pixels * bins_per_pixel, 1.0)
+        level = 0 if self.raw is not None else 1
+        for l in range(1, len(self.levels) + 1):
+            if self.bin_size(l) <= target:
+                level = l
+        return level
+
+    def fetch(self, x0, x1, pixels, mode='minmax'):
+        '''
+        Samples to draw for the index range [x0, x1] on axes pixels wide.
+        Args:
+            mode: 'minmax' for the envelope, min and max of each bin alternately
+                at the center of the bin, or 'mean'
+        Returns:
+            t: m sample indices
+            y: mxk values
+        '''
+        x0 = int(max(np.floor(x0), 0))
+        x1 = int(min(np.ceil(x1) + 1, self.n))
+        if x1 <= x0:
+            return np.zeros((0,)), np.zeros((0, self.k))
+        level = self.level_for(x1 - x0, pixels)
+        if level == 0:
+            y = np.asarray(self.raw[x0:x1], dtype=np.float64).reshape(x1 - x0, self.k)
+            return np.arange(x0, x1, dtype=np.float64), y
+        size = self.bin_size(level)
+        a = x0 // size
+        b = (x1 + size - 1) // size
+        bins = np.asarray(self.levels[level - 1][a:b])
+        center = (np.arange(a, b) + 0.5) * size - 0.5
+        if mode == 'mean':
+            return center, bins[:, MEAN]
+        t = np.repeat(center, 2)
+        y = np.empty((2 * bins.shape[0], self.k))
+        y[0::2] = bins[:, MIN]
+        y[1::2] = bins[:, MAX]
+        return t, y
+
+
+def _stamp(data_file, name):
+    st = os.stat(data_file)
+    return [name, st.st_size, st.st_mtime, base_bin, factor, top_bins]
+
+
+def for_log(data_file, x, name):
+    '''
+    Pyramid of x, an array derived from the log data_file, stored in the directory
+    data_file + '.pyramid/' + name. It is rebuilt when the log changes.
+    Args:
+        name: what x is, e.g. 'acc0'. Include anything x depends on besides the log.
+    '''
+    out_dir = os.path.join(data_file + '.pyramid', name)
+    stamp = json.loads(json.dumps(_stamp(data_file, name)))
+    try:
+        with open(os.path.join(out_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') == pyramid_version and meta.get('stamp') == stamp:
+            return pyramid(out_dir, x)
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return build(x, out_dir, stamp=stamp)
+
+
+class zoom_plot:
+    '''
+    Lines of the columns of a pyramid on matplotlib axes, refetched at the matching
+    level whenever the x range or the size of the axes changes.
+    '''
+    def __init__(self, ax, pyr, mode='minmax', labels=None):
+        self.ax = ax
+        self.pyr = pyr
+        self.mode = mode
+        t, y = pyr.fetch(0, pyr.n - 1, self.pixels(), mode)
+        self.lines = ax.plot(t, y)
+        if labels is not None:
+            for line, label in zip(self.lines, labels):
+                line.set_label(label)
+        ax.set_xlim(0, max(pyr.n - 1, 1))
+        self.xlim = ax.get_xlim()
+        ax.callbacks.connect('xlim_changed', self.on_xlim)
+        ax.figure.canvas.mpl_connect('resize_event', self.on_resize)
+
+    def pixels(self):
+        return self.ax.bbox.width
+
+    def on_xlim(self, ax):
+        self.update()
+
+    def on_resize(self, event):
+        self.update()
+
+    def update(self):
+        x0, x1 = self.ax.get_xlim()
+        t, y = self.pyr.fetch(x0, x1, self.pixels(), self.mode)
+        for j in range(len(self.lines)):
+            self.lines[j].set_data(t, y[:, j])
+        self.ax.figure.canvas.draw_idle()
+
+
+def plot(x, data_file=None, name='data', ax=None, mode='minmax', labels=None):
+    '''
+    Plot the columns of x against the sample index through a pyramid, like plt.plot(x)
+    but interactive for logs of any length.
+    Args:
+        data_file: the pyramid is stored next to this log if given, see for_log(),
+            otherwise in a new temporary directory
+    Returns:
+        zoom_plot, keep a reference to it while the plot is shown
+    '''
+    import matplotlib.pyplot as plt
+    if ax is None:
+        ax = plt.gca()
+    if data_file is not None:
+        pyr = for_log(data_file, x, name)
+    else:
+        import tempfile
+        pyr = build(x, tempfile.mkdtemp(prefix='pyramid-'))
+    return zoom_plot(ax, pyr, mode, labels)
@@ -0,0 +1,236 @@
+"""
+Multi-rate resampling onto an arbitrary time vector.
+
+Position is interpolated linearly, velocity with a cubic Hermite spline and
+attitude quaternions with SLERP, all as array operations on chunks of the target
+times. Euler angles are interpolated by SLERP of their quaternions. Target times in
+a gap of the source (or outside it) are masked.
+"""
+
+import numpy as np
+import attitude
+
+# target samples processed at a time
+chunk_samples = 1 << 20
+# below this angle between two quaternions, SLERP falls back to normalized lerp
+slerp_eps = 1e-6
+
+
+def bracket(t_src, t):
+    '''
+    Index of the source interval of each target time and the fraction inside it.
+    Returns:
+        i: m int array, t_src[i] <= t <= t_src[i+1]
+        u: m fraction, in [0, 1] inside the source
+    '''
+    n = t_src.shape[0]
+    i = np.clip(np.searchsorted(t_src, t, side='right') - 1, 0, max(n - 2, 0))
+    dt = t_src[np.minimum(i + 1, n - 1)] - t_src[i]
+    u = np.where(dt > 0, (t - t_src[i]) / np.where(dt > 0, dt, 1.0), 0.0)
+    return i, u
+
+
+def gap_mask(t_src, t, max_gap=None):
+    '''
+    True for target times that can be interpolated: inside the source and, if max_gap
+    is given, in a source interval not longer than max_gap.
+    '''
+    t_src = np.asarray(t_src, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    ok = (t >= t_src[0]) & (t <= t_src[-1])
+    if max_gap is not None and t_src.shape[0] > 1:
+        i, u = bracket(t_src, t)
+        ok &= (t_src[i+1] - t_src[i]) <= max_gap
+    return ok
+
+
+def _linear(x, i, u):
+    j = np.minimum(i + 1, x.shape[0] - 1)
+    if x.ndim > 1:
+        u = u[:, None]
+    return x[i] + (x[j] - x[i]) * u
+
+
+def linear(t_src, x, t):
+    '''
+    Linear interpolation of all columns of x.
+    Args:
+        t_src: n increasing times
+        x: n or nxk
+        t: m target times
+    '''
+    i, u = bracket(t_src, t)
+    return _linear(np.asarray(x, dtype=np.float64), i, u)
+
+
+def slopes(t_src, x):
+    '''
+    Tangents of a cubic Hermite spline, non-uniform central differences and one-sided
+    differences at the ends.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[0]
+    m = np.zeros(x.shape)
+    if n < 2:
+        return m
+    d = np.diff(t_src)
+    d = np.where(d > 0, d, np.inf)
+    if x.ndim > 1:
+        d = d[:, None]
+    s = np.diff(x, axis=0) / d
+    m[0] = s[0]
+    m[-1] = s[-1]
+    if n > 2:
+        m[1:-1] = 0.5 * (s[:-1] + s[1:])
+    return m
+
+
+def _hermite(t_src, x, m, i, u):
+    j = np.minimum(i + 1, x.shape[0] - 1)
+    h = t_src[j] - t_src[i]
+    u2 = u * u
+    u3 = u2 * u
+    h00 = 2 * u3 - 3 * u2 + 1
+    h10 = u3 - 2 * u2 + u
+    h01 = -2 * u3 + 3 * u2
+    h11 = u3 - u2
+    if x.ndim > 1:
+        h00, h10, h01, h11, h = h00[:, None], h10[:, None], h01[:, None], h11[:, None], h[:, None]
+    return h00 * x[i] + h10 * h * m[i] + h01 * x[j] + h11 * h * m[j]
+
+
+def hermite(t_src, x, t, m=None):
+    '''
+    Cubic Hermite spline interpolation of all columns of x.
+    Args:
+        m: tangents at the source points (e.g. acceleration for velocity), from
+            slopes() if None
+    '''
+    t_src = np.asarray(t_src, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    if m is None:
+        m = slopes(t_src, x)
+    i, u = bracket(t_src, t)
+    return _hermite(t_src, x, m, i, u)
+
+
+def _slerp(q, i, u):
+    q0 = q[i]
+    q1 = q[np.minimum(i + 1, q.shape[0] - 1)]
+    dot = np.sum(q0 * q1, axis=1)
+    # the shorter arc
+    sgn = np.where(dot < 0, -1.0, 1.0)
+    dot = np.minimum(np.abs(dot), 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    small = sin_theta < slerp_eps
+    sin_theta = np.where(small, 1.0, sin_theta)
+    w0 = np.where(small, 1.0 - u, np.sin((1.0 - u) * theta) / sin_theta)
+    w1 = np.where(small, u, np.sin(u * theta) / sin_theta) * sgn
+    out = w0[:, None] * q0 + w1[:, None] * q1
+    return out / np.sqrt(np.sum(out * out, axis=1))[:, None]
+
+
+def slerp(t_src, q, t):
+    '''
+    Spherical linear interpolation of quaternions, any scalar-first or scalar-last
+    convention, the shorter arc is taken.
+    Args:
+        q: nx4 unit quaternions
+    Returns:
+        mx4 unit quaternions
+    '''
+    i, u = bracket(t_src, t)
+    return _slerp(np.asarray(q, dtype=np.float64), i, u)
+
+
+def euler2quat(euler):
+    '''
+    Quaternions of ZYX Euler angles.
+    Args:
+        euler: nx3 [yaw pitch roll], deg
+    Returns:
+        nx4 [q0 q1 q2 q3], q0 is the scalar
+    '''
+    return attitude.euler2quat(np.asarray(euler, dtype=np.float64).T * attitude.D2R).T
+
+
+def quat2euler(q):
+    '''
+    ZYX Euler angles of quaternions, see attitude.quat2euler.
+    Args:
+        q: nx4 [q0 q1 q2 q3], q0 is the scalar
+    Returns:
+        nx3 [yaw pitch roll], deg
+    '''
+    q0, q1, q2, q3 = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    euler = np.empty((q.shape[0], 3))
+    euler[:, 0] = np.arctan2(2.0*(q1*q2 + q0*q3), q0*q0 + q1*q1 - q2*q2 - q3*q3)
+    euler[:, 1] = np.arcsin(np.clip(-2.0*(q1*q3 - q0*q2), -1.0, 1.0))
+    euler[:, 2] = np.arctan2(2.0*(q2*q3 + q0*q1), q0*q0 - q1*q1 - q2*q2 + q3*q3)
+    return euler * attitude.R2D
+
+
+# default method of common field names
+default_methods = {'lla': 'linear', 'pos': 'linear',\
+                   'vel': 'hermite',\
+                   'quat': 'slerp', 'q': 'slerp',\
+                   'euler': 'euler'}
+
+
+def resample(t_src, fields, t, kinds=None, max_gap=None, chunk=chunk_samples):
+    '''
+    Resample several fields of one stream onto target times, chunk by chunk.
+    Args:
+        t_src: n increasing source times, s
+        fields: dict of field name and n or nxk array
+        t: m target times, s
+        kinds: dict of field name and 'linear', 'hermite', 'slerp' or 'euler' (nx3
+            [yaw pitch roll] in deg, SLERP of their quaternions). Defaults by name
+            (lla/pos linear, vel hermite, quat slerp, euler euler), else linear.
+        max_gap: targets in a source interval longer than this are masked, s
+    Returns:
+        dict of field name and resampled values (NaN where masked), and 'mask'
+    '''
+    t_src = np.asarray(t_src, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    kinds = {} if kinds is None else kinds
+    src = {}
+    out = {}
+    for name in fields:
+        src[name] = np.asarray(fields[name], dtype=np.float64)
+        out[name] = np.full((t.shape[0],) + src[name].shape[1:], np.nan)
+    mask = np.zeros(t.shape, dtype=bool)
+    if t_src.shape[0] < 2:
+        out['mask'] = mask
+        return out
+    # tangents are computed on the whole source so chunks join smoothly
+    kind = {}
+    tangents = {}
+    for name in fields:
+        kind[name] = kinds.get(name, default_methods.get(name, 'linear'))
+        if kind[name] not in ('linear', 'hermite', 'slerp', 'euler'):
+            raise ValueError('Unsupported interpolation: %s'% kind[name])
+        if kind[name] == 'hermite':
+            tangents[name] = slopes(t_src, src[name])
+        elif kind[name] == 'euler':
+            src[name] = euler2quat(src[name])
+    for start in range(0, t.shape[0], chunk):
+        tc = t[start:start+chunk]
+        ok = gap_mask(t_src, tc, max_gap)
+        mask[start:start+chunk] = ok
+        if not ok.any():
+            continue
+        rows = np.flatnonzero(ok) + start
+        i, u = bracket(t_src, tc[ok])
+        for name in fields:
+            if kind[name] == 'hermite':
+                out[name][rows] = _hermite(t_src, src[name], tangents[name], i, u)
+            elif kind[name] == 'slerp':
+                out[name][rows] = _slerp(src[name], i, u)
+            elif kind[name] == 'euler':
+                out[name][rows] = quat2euler(_slerp(src[name], i, u))
+            else:
+                out[name][rows] = _linear(src[name], i, u)
+    out['mask'] = mask
+    return out
@@ -0,0 +1,436 @@
+"""
+Generic multi-unit logger driven by a rig description.
+
+A rig is a dict, or a .json/.toml/.yaml file, like:
+    {
+        "log_dir": "./log_data/",
+        "units": [
+            {"name": "mtlt_01", "port": "COM30", "baud": 115200,
+             "packet_type": "A2", "unit_type": "imu38x",
+             "orientation": "-y+x+z", "reset": false, "gps_time": false,
+             "output": "1.csv", "enable": true}
+        ],
+        "calibration_file": "cal.json",
+        "monitor": {"rate": 30, "decimation": 2}
+    }
+Each enabled unit runs in its own process. The reader decodes packets and hands
+them directly to a csv writer in the same process, so adding units does not add
+load to a central logging loop. "defaults" holds settings shared by all units. A
+unit can keep a fixed row layout with "columns", "header" and "fmt", see
+csv_writer.
+With "merge", some units are instead logged together into one file, a row each
+time the first of them has a new packet, see merge_units(). "duration" (s) stops
+logging, and "post_process", [function, arg, ...], is called when logging stops.
+Functions can also be given by name, "module.function", in rig files.
+Units named in the optional calibration file (see calibration.load_calibration), or
+with their own "calibration" entry, have accel and gyro corrected when decoded.
+With "monitor" (true, or a dict of live_monitor.start_monitor options), attitude,
+rate and accel of all units are shown in a live plot. Each unit writes them into
+the ring of its own data_bus, so the plot never blocks a reader.
+"""
+
+import os
+import sys
+import json
+import time
+import numbers
+import importlib
+import collections
+from multiprocessing import Process, Pipe
+import imu38x
+import ins1000
+import openimu
+import calibration
+import gps_time
+import data_bus
+import live_monitor
+
+# column names of the decoded packets, flattened. Unknown packets get numbered columns.
+packet_columns = {
+    'S0': ['counter', 'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)',\
+           'mx (Gauss)', 'my (Gauss)', 'mz (Gauss)',\
+           'x_rate_temp (C)', 'y_rate_temp (C)', 'z_rate_temp (C)', 'board_temp (C)', 'bit'],
+    'S1': ['counter', 'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)',\
+           'x_rate_temp (C)', 'y_rate_temp (C)', 'z_rate_temp (C)', 'board_temp (C)', 'bit'],
+    'SH': ['counter', 'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)', 'temp (C)', 'bit'],
+    'A1': ['roll (deg)', 'pitch (deg)', 'yaw (deg)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)',\
+           'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'temp (C)', 'reserved', 'reserved', 'itow (ms)', 'bit'],
+    'A2': ['roll (deg)', 'pitch (deg)', 'yaw (deg)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)',\
+           'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'x_rate_temp (C)', 'y_rate_temp (C)', 'z_rate_temp (C)', 'itow (ms)', 'bit'],
+    'z1': ['timer (ms)', 'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)'],
+    's1': ['timer (ms)', 'ax (m/s2)', 'ay (m/s2)', 'az (m/s2)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)', 'temp (C)'],
+    'e1': ['timer (ms)', 'roll (deg)', 'pitch (deg)', 'yaw (deg)',\
+           'wx (deg/s)', 'wy (deg/s)', 'wz (deg/s)',\
+           'ax (g)', 'ay (g)', 'az (g)', 'turn_sw', 'lin_accel_sw'],
+    'nav': ['time (s)', 'lat (deg)', 'lon (deg)', 'alt (m)',\
+            'vN (m/s)', 'vE (m/s)', 'vD (m/s)', 'q0', 'q1', 'q2', 'q3'],
+}
+
+
+def load_rig(rig_file):
+    '''
+    Load a rig description from a .json, .toml or .yaml file.
+    TOML needs Python 3.11+ (tomllib), YAML needs PyYAML.
+    '''
+    ext = os.path.splitext(rig_file)[1].lower()
+    if ext == '.json':
+        with open(rig_file, 'r') as f:
+            return json.load(f)
+    elif ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise ImportError('Reading .toml rig files needs Python 3.11 or later.')
+        with open(rig_file, 'rb') as f:
+            return tomllib.load(f)
+    elif ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Reading .yaml rig files needs PyYAML.')
+        with open(rig_file, 'r') as f:
+            return yaml.safe_load(f)
+    else:
+        raise ValueError('Unsupported rig file: %s'% rig_file)
+
+
+def flatten(latest):
+    '''
+    Flatten a decoded packet (nested tuples, lists and numpy arrays) into a list of numbers.
+    '''
+    row = []
+    for x in latest:
+        if isinstance(x, (numbers.Number, bool)):
+            row.append(x)
+        elif isinstance(x, (bytes, bytearray)):
+            row.extend(list(x))
+        else:
+            row.extend(flatten(x))
+    return row
+
+
+def format_row(row, fmt=None):
+    '''
+    A line of a log, row formatted by fmt or written by repr if fmt is None.
+    '''
+    if fmt is not None:
+        return fmt% tuple(row)
+    return ', '.join(repr(float(x)) for x in row) + '\n'
+
+
+def resolve(func):
+    '''
+    A function, or a function named 'module.function'.
+    '''
+    if func is None or callable(func):
+        return func
+    module, name = func.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+class csv_writer:
+    '''
+    Write decoded packets to a csv file. It is used as the pipe of a reader, so
+    packets are written in the reader process without any inter-process transport.
+    '''
+    def __init__(self, file_name, packet_type, flush_every=100, gps=False,\
+                 columns=None, header=None, fmt=None):
+        '''
+        Args:
+            gps: also tag each row with the GPS week and seconds of week of the host clock
+            columns: fields of a row, instead of the host time and all fields of the
+                packet: 'host_time', 'recv_interval' (s since the previous packet) or
+                the index of a field of the decoded packet
+            header: header line of a log with columns
+            fmt: printf format of a row with columns, including the line end. Values
+                are written by repr if None.
+        '''
+        self.file_name = file_name
+        self.packet_type = packet_type
+        self.flush_every = flush_every
+        self.f = open(file_name, 'w+')
+        self.f.truncate()
+        self.header_written = False
+        self.n = 0
+        self.clock = gps_time.host_clock() if gps else None
+        self.columns = columns
+        self.fmt = fmt
+        self.tlast = time.time()
+        if columns is not None and header is not None:
+            self.f.write(header.rstrip('\n') + '\n')
+            self.header_written = True
+
+    def write_header(self, n_cols):
+        names = packet_columns.get(self.packet_type)
+        if names is None or len(names) != n_cols:
+            names = ['c%u'% i for i in range(n_cols)]
+        time_names = 'host_time (s), '
+        if self.clock is not None:
+            time_names += 'gps_week, gps_sow (s), '
+        self.f.write(time_names + ', '.join(names) + '\n')
+        self.header_written = True
+
+    def select(self, latest, tnow):
+        '''
+        Values of the columns of a row.
+        '''
+        row = []
+        for c in self.columns:
+            if c == 'host_time':
+                row.append(tnow)
+            elif c == 'recv_interval':
+                row.append(tnow - self.tlast)
+            else:
+                row.extend(flatten([latest[c]]))
+        self.tlast = tnow
+        return row
+
+    def send(self, latest):
+        if isinstance(latest, str):
+            # 'exit' from the reader
+            self.close()
+            return
+        if self.columns is not None:
+            self.f.write(format_row(self.select(latest, time.time()), self.fmt))
+            self.n += 1
+            if self.n % self.flush_every == 0:
+                self.f.flush()
+            return
+        row = flatten(latest)
+        if not self.header_written:
+            self.write_header(len(row))
+        tnow = time.time()
+        line = '%.6f, '% tnow
+        if self.clock is not None:
+            line += '%u, %.6f, '% self.clock.now(tnow)
+        self.f.write(line + ', '.join(repr(float(x)) for x in row) + '\n')
+        self.n += 1
+        if self.n % self.flush_every == 0:
+            self.f.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+
+def run_unit(unit, file_name, ring=None, conn=None):
+    '''
+    Process target. Create the reader of unit['unit_type'] and log until interrupted.
+    Args:
+        ring: data_bus ring of the live monitor, samples of imu38x units are also
+            written into it if given
+        conn: connection the packets are sent to instead of a csv file, for units
+            merged into one log
+    '''
+    unit_type = unit.get('unit_type', 'imu38x').lower()
+    packet_type = unit.get('packet_type', 'A2')
+    if conn is not None:
+        writer = conn
+    else:
+        writer = csv_writer(file_name, packet_type, gps=unit.get('gps_time', False),\
+                            columns=unit.get('columns'), header=unit.get('header'),\
+                            fmt=unit.get('fmt'))
+    try:
+        if unit_type == 'imu38x':
+            pipe = writer if ring is None else live_monitor.monitor_tap(writer, ring, packet_type)
+            reader = imu38x.imu38x(unit['port'], unit.get('baud', 115200), packet_type,\
+                                   pipe=pipe, ori=unit.get('orientation'),\
+                                   cal=unit.get('calibration'))
+            if 'reset_cmd' in unit:
+                reader.start(reset=unit.get('reset', False), reset_cmd=unit['reset_cmd'])
+            else:
+                reader.start(reset=unit.get('reset', False))
+        elif unit_type == 'ins1000':
+            reader = ins1000.ins1000(unit['port'], unit.get('baud', 230400), pipe=writer)
+            reader.start()
+        elif unit_type == 'openimu':
+            reader = openimu.openimu(unit['port'], unit.get('baud', 115200), pipe=writer)
+            reader.start()
+        else:
+            print('Unsupported unit type: %s'% unit_type)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+
+
+def default_row(latest, fresh, tnow):
+    '''
+    Row of a merged log: the host time and all fields of the latest packet of each
+    unit. No row is written until every unit has sent a packet.
+    '''
+    if any(x is None for x in latest.values()):
+        return None
+    row = [tnow]
+    for name in latest:
+        row.extend(flatten(latest[name]))
+    return row
+
+
+def merge_units(conns, merge, file_name, duration=None):
+    '''
+    Log several units into one file, in the calling process. A row is written each
+    time the first unit (the clock) sends a packet, with the latest packet of the
+    others, as long as it is in time.
+    Args:
+        conns: ordered dict of unit name and the connection its packets come from
+        merge: the "merge" entry of the rig:
+            "row": function(latest, fresh, tnow) returning the values of a row, or
+                None to skip it. latest is a dict of unit name and its latest packet
+                (None before the first one), fresh of unit name and True if the
+                packet is new, tnow the host time. default_row() if not given.
+            "packet": function(name, packet) called with every packet of the units,
+                also those replaced by a later one before a row is written
+            "header": header line, "fmt": printf format of a row, see format_row()
+        duration: stop after this many seconds, None to log until Ctrl-C
+    '''
+    row = resolve(merge.get('row')) or default_row
+    fmt = merge.get('fmt')
+    packet = resolve(merge.get('packet'))
+    names = list(conns.keys())
+    clock = names[0]
+    latest = dict((name, None) for name in names)
+    f = open(file_name, 'w+')
+    f.truncate()
+    if merge.get('header') is not None:
+        f.write(merge['header'].rstrip('\n') + '\n')
+        f.flush()
+    tstart = time.time()
+    try:
+        while True:
+            # the clock blocks, the others have their latest packet taken
+            x = conns[clock].recv()
+            if isinstance(x, str):
+                print('%s stopped.'% clock)
+                break
+            latest[clock] = x
+            if packet is not None:
+                packet(clock, x)
+            fresh = dict((name, name == clock) for name in names)
+            for name in names[1:]:
+                while conns[name].poll():
+                    x = conns[name].recv()
+                    if not isinstance(x, str):
+                        latest[name] = x
+                        fresh[name] = True
+                        if packet is not None:
+                            packet(name, x)
+            tnow = time.time()
+            values = row(latest, fresh, tnow)
+            if values is not None:
+                f.write(format_row(values, fmt))
+                f.flush()
+            if duration is not None and tnow - tstart > duration:
+                print('Data is logged for %s seconds.'% duration)
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        f.close()
+
+
+def run(rig):
+    '''
+    Log all enabled units of a rig until Ctrl-C, the end of "duration" or all
+    readers end, then call "post_process".
+    Args:
+        rig: rig description, a dict or the path of a rig file.
+    Returns:
+        dict of unit name (or "merge" name, "log" by default) and its log file.
+    '''
+    if not isinstance(rig, dict):
+        rig = load_rig(rig)
+    log_dir = rig.get('log_dir', './log_data/')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    cals = None
+    if rig.get('calibration_file'):
+        cals = calibration.load_calibration(rig['calibration_file'])
+    monitor = rig.get('monitor')
+    merge = rig.get('merge')
+    merged = merge.get('units', []) if merge else []
+    duration = rig.get('duration')
+    buses = []
+    processes = []
+    files = {}
+    conns = {}
+    names = []
+    for i, unit in enumerate(rig.get('units', [])):
+        unit = dict(rig.get('defaults', {}), **unit)
+        if not unit.get('enable', True):
+            continue
+        name = unit.get('name', 'unit%u'% i)
+        cal = calibration.get_calibration(cals, name)
+        if cal is not None and 'calibration' not in unit:
+            unit = dict(unit, calibration=cal.to_dict())
+        file_name = None
+        child = None
+        if name in merged:
+            conns[name], child = Pipe()
+        else:
+            file_name = os.path.join(log_dir, unit.get('output', name + '.csv'))
+            files[name] = file_name
+        ring = None
+        if monitor:
+            buses.append(data_bus.data_bus(live_monitor.unit_width))
+            ring = buses[-1].ring
+        names.append(name)
+        p = Process(target=run_unit, args=(unit, file_name, ring, child))
+        p.daemon = True
+        p.start()
+        processes.append(p)
+        print('%s (%s %s) on %s is logged to %s'%\
+              (name, unit.get('unit_type', 'imu38x'), unit.get('packet_type', ''),\
+               unit['port'], file_name if file_name is not None else 'the merged log'))
+    p_monitor = None
+    if monitor:
+        options = monitor if isinstance(monitor, dict) else {}
+        p_monitor = live_monitor.start_monitor(names, buses, **options)
+        for bus in buses:
+            bus.start()
+    # the merged units in the order of the merge, the first one is the clock
+    conns = [(name, conns[name]) for name in merged if name in conns]
+    try:
+        if conns:
+            file_name = os.path.join(log_dir, merge.get('output', 'log.csv'))
+            files[merge.get('name', 'log')] = file_name
+            merge_units(collections.OrderedDict(conns), merge, file_name, duration)
+        else:
+            tstart = time.time()
+            while any(p.is_alive() for p in processes):
+                if duration is not None and time.time() - tstart > duration:
+                    break
+                time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    print('Stop logging...')
+    for p in processes:
+        # readers close their files on Ctrl-C, give them a moment before terminating
+        p.join(1.0)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+    for bus in buses:
+        bus.stop()
+    if p_monitor is not None:
+        p_monitor.terminate()
+    post = rig.get('post_process')
+    if post:
+        resolve(post[0])(*post[1:])
+    return files
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Usage: python rig.py rig_file')
+        exit()
+    run(sys.argv[1])
@@ -0,0 +1,148 @@
+"""
+Trajectory simplification for KML export.
+
+Positions are converted to a local NED frame and simplified there, so tolerances
+are in metres. Ramer-Douglas-Peucker keeps every point needed for the simplified
+track to stay within the tolerance of the original one: few points on straight
+roads, many in turns. It is done breadth first, all segments of a level of the
+recursion at once, so each pass is a few array operations over the whole track.
+A cheaper distance / heading change threshold is also available.
+"""
+
+import numpy as np
+import geodesy
+import attitude
+
+# largest distance of the original track from the simplified one, m
+default_tolerance = 1.0
+# distance / heading change method: a point at least every min_distance (m) along
+# the track and every max_heading_change (deg) of course change
+min_distance = 50.0
+max_heading_change = 10.0
+# the course is measured over this distance along the track, m
+course_baseline = 5.0
+
+
+def local_xy(lla, ref_lla=None, use_alt=False):
+    '''
+    Positions in the local NED frame of ref_lla (the first position if None).
+    Returns:
+        nx2 [north east], or nx3 NED if use_alt, m
+    '''
+    lla = np.asarray(lla, dtype=np.float64)
+    if ref_lla is None:
+        ref_lla = lla[0]
+    ned = np.atleast_2d(geodesy.lla2ned(lla, ref_lla))
+    return ned if use_alt else ned[:, 0:2]
+
+
+def segment_distance(p, a, b):
+    '''
+    Distance of each point p from the segment [a, b] of the same row.
+    Args:
+        p, a, b: nxk
+    '''
+    ab = b - a
+    ap = p - a
+    # sums over the few columns are faster column by column than with axis=1
+    len2 = 0.0
+    dot = 0.0
+    for j in range(ab.shape[1]):
+        len2 = len2 + ab[:, j] * ab[:, j]
+        dot = dot + ap[:, j] * ab[:, j]
+    u = np.clip(np.where(len2 > 0, dot / np.where(len2 > 0, len2, 1.0), 0.0), 0.0, 1.0)
+    d2 = 0.0
+    for j in range(ab.shape[1]):
+        e = ap[:, j] - u * ab[:, j]
+        d2 = d2 + e * e
+    return np.sqrt(d2)
+
+
+def rdp(xy, tolerance=default_tolerance):
+    '''
+    Ramer-Douglas-Peucker simplification of a polyline.
+    Args:
+        xy: nxk points in a metric frame
+        tolerance: largest distance of a dropped point from the simplified line
+    Returns:
+        n bool, True for points kept. The first and the last are always kept.
+    '''
+    xy = np.asarray(xy, dtype=np.float64)
+    n = xy.shape[0]
+    keep = np.zeros((n,), dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    # points of segments that may still need splitting
+    pts = np.arange(1, n - 1)
+    while pts.shape[0]:
+        # ends of the segment of each point, the kept points around it
+        kept = np.flatnonzero(keep)
+        i = np.searchsorted(kept, pts)
+        seg = kept[i - 1]
+        d = segment_distance(xy[pts], xy[seg], xy[kept[i]])
+        # farthest point of each segment
+        first = np.flatnonzero(np.concatenate(([True], seg[1:] != seg[:-1])))
+        counts = np.diff(np.append(first, d.shape[0]))
+        dmax = np.maximum.reduceat(d, first)
+        cand = np.flatnonzero(d == np.repeat(dmax, counts))
+        far = cand[np.unique(np.repeat(np.arange(first.shape[0]), counts)[cand], return_index=True)[1]]
+        split = dmax > tolerance
+        keep[pts[far[split]]] = True
+        # points of segments within tolerance are done
+        todo = np.repeat(split, counts)
+        pts = pts[todo & ~keep[pts]]
+    return keep
+
+
+def distance_heading(xy, min_dist=min_distance, max_heading=max_heading_change,\
+                     baseline=course_baseline):
+    '''
+    Keep a point whenever the distance along the track crosses a multiple of min_dist
+    or the course crosses a multiple of max_heading. The course is taken between
+    points baseline apart along the track, so that position noise does not look like
+    course changes.
+    Returns:
+        n bool, True for points kept. The first and the last are always kept.
+    '''
+    xy = np.asarray(xy, dtype=np.float64)
+    n = xy.shape[0]
+    keep = np.zeros((n,), dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    step = np.diff(xy[:, 0:2], axis=0)
+    dist = np.concatenate(([0.0], np.cumsum(np.hypot(step[:, 0], step[:, 1]))))
+    keep[1:] |= np.diff(np.floor(dist / min_dist)) != 0
+    # points about baseline apart along the track
+    pts = np.concatenate(([0], np.flatnonzero(np.diff(np.floor(dist / baseline)) != 0) + 1))
+    if pts.shape[0] > 2:
+        d = np.diff(xy[pts, 0:2], axis=0)
+        course = np.unwrap(np.arctan2(d[:, 1], d[:, 0])) * attitude.R2D
+        keep[pts[2:][np.diff(np.floor(course / max_heading)) != 0]] = True
+    return keep
+
+
+def simplify(lla, tolerance=default_tolerance, method='rdp', ref_lla=None, use_alt=False):
+    '''
+    Indices of the positions kept by trajectory simplification.
+    Args:
+        lla: nx3 [lat lon alt], [deg deg m]
+        tolerance: for 'rdp', m
+        method: 'rdp' or 'distance_heading' (thresholds min_distance and
+            max_heading_change)
+        use_alt: also keep the altitude within the tolerance
+    Returns:
+        increasing indices, the first and the last position included
+    '''
+    lla = np.asarray(lla, dtype=np.float64)
+    if lla.shape[0] == 0:
+        return np.zeros((0,), dtype=np.int64)
+    xy = local_xy(lla, ref_lla, use_alt)
+    if method == 'rdp':
+        keep = rdp(xy, tolerance)
+    elif method == 'distance_heading':
+        keep = distance_heading(xy)
+    else:
+        raise ValueError('Unsupported simplification: %s'% method)
+    return np.flatnonzero(keep)
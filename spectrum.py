@@ -0,0 +1,255 @@
+"""
+Welch PSD and spectrogram of decoded sensor data.
+
+Samples are fed block by block to an accumulator that keeps only the tail of the
+last segment, so the memory of a PSD does not depend on the length of the data.
+Segments of a block are windowed and transformed together with numpy's rfft.
+"""
+
+import sys
+import numpy as np
+
+# samples in each FFT segment
+segment_samples = 1024
+# overlap of adjacent segments, ratio of the segment
+segment_overlap = 0.5
+# samples fed to the accumulator at a time
+chunk_samples = 1 << 20
+# axes of the accel/gyro arrays of post processing
+axis_names = ['ax', 'ay', 'az', 'wx', 'wy', 'wz']
+# results of this session, see psd_cached()
+_cache = {}
+
+
+def hann(n):
+    '''
+    Periodic Hann window.
+    '''
+    return 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n) / n)
+
+
+class welch_psd:
+    '''
+    Streaming Welch PSD of one or more channels.
+    '''
+    def __init__(self, fs, nperseg=segment_samples, overlap=segment_overlap, detrend=True):
+        '''
+        Args:
+            fs: sample rate, Hz
+            nperseg: samples in each segment
+            overlap: overlap of adjacent segments, [0, 1)
+            detrend: remove the mean of each segment
+        '''
+        self.fs = float(fs)
+        self.nperseg = int(nperseg)
+        self.step = max(int(round(self.nperseg * (1.0 - overlap))), 1)
+        self.detrend = detrend
+        self.window = hann(self.nperseg)
+        # one-sided density scaling
+        self.scale = 1.0 / (self.fs * np.dot(self.window, self.window))
+        self.tail = None
+        self.total = None
+        self.segments = 0
+
+    def segment_spectra(self, y):
+        '''
+        Spectra of all complete segments of y.
+        Args:
+            y: nxk array
+        Returns:
+            n_segxfxk power of each segment, number of samples consumed
+        '''
+        n = y.shape[0]
+        if n < self.nperseg:
+            return None, 0
+        n_seg = (n - self.nperseg) // self.step + 1
+        idx = np.arange(n_seg)[:, None] * self.step + np.arange(self.nperseg)
+        seg = y[idx]
+        if self.detrend:
+            seg = seg - seg.mean(axis=1, keepdims=True)
+        spec = np.fft.rfft(seg * self.window[None, :, None], axis=1)
+        p = (spec.real**2 + spec.imag**2) * self.scale
+        # one-sided, DC and Nyquist are not doubled
+        p[:, 1:] *= 2.0
+        if self.nperseg % 2 == 0:
+            p[:, -1] /= 2.0
+        return p, n_seg * self.step
+
+    def update(self, y):
+        '''
+        Add a block of samples.
+        Args:
+            y: n samples of one channel, or nxk samples of k channels
+        '''
+        y = np.asarray(y, dtype=np.float64)
+        if y.ndim == 1:
+            y = y[:, None]
+        if self.tail is not None:
+            y = np.vstack((self.tail, y))
+        p, used = self.segment_spectra(y)
+        if p is not None:
+            s = p.sum(axis=0)
+            self.total = s if self.total is None else self.total + s
+            self.segments += p.shape[0]
+        self.tail = y[used:].copy()
+
+    def freqs(self):
+        return np.fft.rfftfreq(self.nperseg, 1.0 / self.fs)
+
+    def result(self):
+        '''
+        Returns:
+            f: frequencies, Hz
+            psd: fxk power spectral density, unit^2/Hz. None if no segment is complete.
+        '''
+        if self.segments == 0:
+            return self.freqs(), None
+        return self.freqs(), self.total / self.segments
+
+
+def psd(y, fs, nperseg=segment_samples, overlap=segment_overlap, chunk=chunk_samples):
+    '''
+    Welch PSD of an array or memmap of any length, chunk by chunk.
+    Args:
+        y: n or nxk array
+    Returns:
+        f, psd as welch_psd.result()
+    '''
+    acc = welch_psd(fs, nperseg, overlap)
+    for start in range(0, y.shape[0], chunk):
+        acc.update(y[start:start+chunk])
+    return acc.result()
+
+
+def spectrogram(y, fs, nperseg=segment_samples, overlap=segment_overlap,\
+                average=1, chunk=chunk_samples):
+    '''
+    Spectrogram of one channel, chunk by chunk.
+    Args:
+        y: n samples
+        average: number of adjacent segments averaged into one column, to bound the
+            size of the result of very long data
+    Returns:
+        t: center time of each column, s
+        f: frequencies, Hz
+        sxx: fxm power spectral density
+    '''
+    acc = welch_psd(fs, nperseg, overlap)
+    cols = []
+    pending = []
+    n_pending = 0
+    times = []
+    t_pending = []
+    for start in range(0, y.shape[0], chunk):
+        block = np.asarray(y[start:start+chunk], dtype=np.float64)[:, None]
+        tail = 0 if acc.tail is None else acc.tail.shape[0]
+        if acc.tail is not None:
+            block = np.vstack((acc.tail, block))
+        p, used = acc.segment_spectra(block)
+        if p is not None:
+            # start of the first segment of this block, in samples
+            first = start - tail
+            centers = first + np.arange(p.shape[0]) * acc.step + acc.nperseg / 2.0
+            pending.append(p[:, :, 0])
+            t_pending.append(centers)
+            n_pending += p.shape[0]
+            if n_pending >= average:
+                p_all = np.vstack(pending)
+                t_all = np.concatenate(t_pending)
+                n_full = (n_pending // average) * average
+                cols.append(p_all[:n_full].reshape(-1, average, p_all.shape[1]).mean(axis=1))
+                times.append(t_all[:n_full].reshape(-1, average).mean(axis=1))
+                pending = [p_all[n_full:]]
+                t_pending = [t_all[n_full:]]
+                n_pending -= n_full
+        acc.tail = block[used:].copy()
+    f = acc.freqs()
+    if not cols:
+        return np.zeros((0,)), f, np.zeros((f.shape[0], 0))
+    return np.concatenate(times) / fs, f, np.vstack(cols).T
+
+
+def _key(y, fs, nperseg, overlap, name):
+    # the data are never read for the key, they may be a memmap larger than RAM
+    return (name, tuple(y.shape), float(fs), int(nperseg), float(overlap))
+
+
+def psd_cached(y, fs, nperseg=segment_samples, overlap=segment_overlap, name=None):
+    '''
+    psd() with results kept for the session, so comparing units again with other
+    plot settings does not recompute the spectra.
+    Args:
+        name: key of the data, for example the hash of the log file and the unit
+            (see product_cache.file_hash). Not cached if None.
+    '''
+    if name is None:
+        return psd(y, fs, nperseg, overlap)
+    key = _key(y, fs, nperseg, overlap, name)
+    if key not in _cache:
+        _cache[key] = psd(y, fs, nperseg, overlap)
+    return _cache[key]
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def compare(units, fs, nperseg=segment_samples, overlap=segment_overlap, source=None):
+    '''
+    PSD of the same axes of several units.
+    Args:
+        units: dict of unit name and nxk array, for example {'nxp': ..., 'bosch': ...}
+        source: what the data are from, for example the hash of the log file. The
+            spectra are kept for the session under it and the unit name if given.
+    Returns:
+        dict of unit name and (f, psd)
+    '''
+    return {name: psd_cached(units[name], fs, nperseg, overlap,\
+                             None if source is None else (source, name)) for name in units}
+
+
+def plot_compare(results, names=axis_names, block=True):
+    '''
+    One subplot per axis, the ASD of all units overlaid.
+    Args:
+        results: output of compare()
+    '''
+    import matplotlib.pyplot as plt
+    k = max(r[1].shape[1] for r in results.values() if r[1] is not None)
+    rows = (k + 2) // 3
+    fig, axes = plt.subplots(rows, min(k, 3), squeeze=False, sharex=True)
+    for i in range(k):
+        ax = axes[i // 3][i % 3]
+        for unit in results:
+            f, p = results[unit]
+            if p is None or i >= p.shape[1]:
+                continue
+            ax.loglog(f[1:], np.sqrt(p[1:, i]), label=unit)
+        ax.set_title(names[i] if i < len(names) else 'c%u'% i)
+        ax.grid(True, which='both')
+        ax.legend()
+    for ax in axes[-1]:
+        ax.set_xlabel('Hz')
+    plt.show(block=block)
+    return fig
+
+
+def save_psd(file_name, f, p, names=axis_names):
+    '''
+    Save a PSD to a csv file, one column per axis.
+    '''
+    header = 'freq (Hz),' + ','.join('%s (unit^2/Hz)'% (names[i] if i < len(names) else 'c%u'% i)\
+                                    for i in range(p.shape[1]))
+    np.savetxt(file_name, np.hstack((f[:, None], p)), header=header, delimiter=',', comments='')
+
+
+if __name__ == "__main__":
+    # python spectrum.py log.csv [fs]
+    # log of log_for_freeintegration, the two units are compared
+    if len(sys.argv) < 2:
+        print('Usage: python spectrum.py log_file [sample_rate]')
+        exit()
+    fs = float(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+    data = np.genfromtxt(sys.argv[1], delimiter=',', skip_header=1)
+    res = compare({'nxp': data[:, 2:8], 'bosch': data[:, 8:14]}, fs)
+    plot_compare(res)
@@ -0,0 +1,263 @@
+"""
+Binary UDP telemetry protocol, version 1.
+
+Every datagram starts with a header, little endian:
+    0   magic       2s  b'OT'
+    2   version     B   protocol version
+    3   msg_type    B   0: schema, 1: data
+    4   stream_id   H   id of the stream, so several loggers can share one port
+    6   seq         I   data: index of the first sample in this datagram
+                        schema: index of the next sample
+    10  n           H   data: number of samples in this datagram; schema: 0
+    12  reserved    H
+Schema payload is utf-8 json:
+    {"version": 1, "stream_id": 0, "name": "...",
+     "fields": [["time", "<f8"], ["roll", "<f4"], ...]}
+Data payload is n packed records of the fields in the schema. The first field is
+always the timestamp of the sample in seconds.
+Receivers detect lost samples from gaps in seq. When fed by a data_bus, seq counts
+the decimated samples of the bus, so samples the bus lost also leave a gap. The
+timestamp should be a column of the bus samples, the time the sample was logged;
+the send time is only used when there is none. The schema is sent when the sender
+starts and then periodically, so receivers can join at any time.
+"""
+
+import sys
+import time
+import json
+import socket
+import struct
+import numpy as np
+
+version = 1
+magic = b'OT'
+header_fmt = '<2sBBHIHH'
+header_size = struct.calcsize(header_fmt)
+msg_schema = 0
+msg_data = 1
+# payload size that fits in an Ethernet frame without fragmentation
+default_mtu = 1472
+default_port = 10601
+default_network = '<broadcast>'
+
+
+def make_dtype(fields):
+    '''
+    Build the numpy record type of a data sample.
+    Args:
+        fields: list of [name, dtype], dtype is a numpy type string such as '<f4'.
+            The timestamp ('time', '<f8') is added if the first field is not 'time'.
+    Returns:
+        numpy dtype, packed and little endian.
+    '''
+    fields = [(str(x[0]), np.dtype(x[1]).newbyteorder('<').str) for x in fields]
+    if len(fields) == 0 or fields[0][0] != 'time':
+        fields.insert(0, ('time', '<f8'))
+    return np.dtype(fields)
+
+
+class telemetry_sender:
+    '''
+    Pack samples into as few datagrams as the MTU allows.
+    '''
+    def __init__(self, fields, stream_id=0, name='', port=default_port,\
+                 network=default_network, mtu=default_mtu, schema_period=1.0):
+        '''
+        Args:
+            fields: list of [name, dtype] of each column of a sample, see make_dtype.
+                Use '<f4' where float32 precision is enough, '<f8' for lat/lon.
+            stream_id: id of this stream.
+            name: name of the stream, only informative.
+            mtu: max UDP payload size in bytes.
+            schema_period: interval to resend the schema message, s.
+        '''
+        self.dtype = make_dtype(fields)
+        self.stream_id = stream_id
+        self.name = name
+        self.port = port
+        self.network = network
+        self.max_samples = (mtu - header_size) // self.dtype.itemsize
+        if self.max_samples < 1:
+            raise ValueError('Sample of %u bytes does not fit in MTU %u.'% (self.dtype.itemsize, mtu))
+        self.schema_period = schema_period
+        self.last_schema_time = None
+        self.seq = 0
+        self.s = None
+
+    def open(self):
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def close(self):
+        if self.s is not None:
+            self.s.close()
+            self.s = None
+
+    def schema(self):
+        '''
+        Schema datagram.
+        '''
+        desc = {'version': version,\
+                'stream_id': self.stream_id,\
+                'name': self.name,\
+                'fields': [[n, self.dtype[n].str] for n in self.dtype.names]}
+        header = struct.pack(header_fmt, magic, version, msg_schema, self.stream_id,\
+                             self.seq & 0xffffffff, 0, 0)
+        return header + json.dumps(desc).encode('utf-8')
+
+    def pack(self, samples, timestamps=None):
+        '''
+        Pack samples into datagrams.
+        Args:
+            samples: nxm numpy array, m is the number of fields excluding time.
+            timestamps: n timestamps, s. Host time is used if None.
+        Returns:
+            list of datagrams, bytes.
+        '''
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples.reshape(1, -1)
+        n = samples.shape[0]
+        if timestamps is None:
+            timestamps = np.full((n,), time.time())
+        records = np.empty((n,), dtype=self.dtype)
+        records['time'] = timestamps
+        names = self.dtype.names
+        for i in range(1, len(names)):
+            records[names[i]] = samples[:, i-1]
+        datagrams = []
+        for i in range(0, n, self.max_samples):
+            chunk = records[i:i+self.max_samples]
+            header = struct.pack(header_fmt, magic, version, msg_data, self.stream_id,\
+                                 self.seq & 0xffffffff, chunk.shape[0], 0)
+            datagrams.append(header + chunk.tobytes())
+            self.seq += chunk.shape[0]
+        return datagrams
+
+    def send(self, samples, timestamps=None):
+        if self.s is None:
+            self.open()
+        tnow = time.time()
+        if self.last_schema_time is None or tnow - self.last_schema_time > self.schema_period:
+            self.s.sendto(self.schema(), (self.network, self.port))
+            self.last_schema_time = tnow
+        for d in self.pack(samples, timestamps):
+            self.s.sendto(d, (self.network, self.port))
+
+
+class telemetry_publisher(telemetry_sender):
+    '''
+    data_bus handler sending the telemetry protocol.
+    Args:
+        time_col: column of the sample holding the timestamp. If None, the time when
+            the samples are sent is used.
+        cols: columns of the sample to send, after removing time_col.
+    '''
+    # called with the sequence number of the samples, see data_bus.run_publisher
+    indexed = True
+
+    def __init__(self, fields, time_col=None, cols=None, **kwargs):
+        telemetry_sender.__init__(self, fields, **kwargs)
+        self.time_col = time_col
+        self.cols = cols
+
+    def __call__(self, samples, seq=None):
+        if seq is not None:
+            self.seq = seq
+        timestamps = None
+        if self.time_col is not None:
+            timestamps = samples[:, self.time_col]
+            samples = np.delete(samples, self.time_col, axis=1)
+        if self.cols is not None:
+            samples = samples[:, self.cols]
+        self.send(samples, timestamps)
+
+
+class telemetry_receiver:
+    '''
+    Reference receiver. Decode datagrams straight into numpy record arrays and keep
+    track of lost and out-of-order (including duplicated) samples per stream.
+    '''
+    def __init__(self, port=default_port, timeout=1.0):
+        self.port = port
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.s.bind(('', port))
+        self.s.settimeout(timeout)
+        # stream_id: {'name', 'dtype', 'next_seq', 'received', 'lost', 'out_of_order'}
+        self.streams = {}
+
+    def decode(self, datagram):
+        '''
+        Decode one datagram.
+        Returns:
+            (stream_id, records) for data of a known stream, records is a numpy
+            record array. None for a schema or a datagram that cannot be decoded.
+        '''
+        if len(datagram) < header_size:
+            return None
+        m, ver, msg_type, stream_id, seq, n, _ = struct.unpack(header_fmt, datagram[0:header_size])
+        if m != magic or ver != version:
+            return None
+        if msg_type == msg_schema:
+            desc = json.loads(datagram[header_size:].decode('utf-8'))
+            dtype = make_dtype(desc['fields'])
+            if stream_id not in self.streams or self.streams[stream_id]['dtype'] != dtype:
+                self.streams[stream_id] = {'name': desc.get('name', ''),\
+                                           'dtype': dtype,\
+                                           'next_seq': None,\
+                                           'received': 0,\
+                                           'lost': 0,\
+                                           'out_of_order': 0}
+            return None
+        if msg_type != msg_data or stream_id not in self.streams:
+            return None
+        stream = self.streams[stream_id]
+        dtype = stream['dtype']
+        if len(datagram) != header_size + n * dtype.itemsize:
+            return None
+        records = np.frombuffer(datagram, dtype=dtype, count=n, offset=header_size)
+        # sequence check, seq is 32-bit and wraps around
+        if stream['next_seq'] is not None:
+            gap = (seq - stream['next_seq']) & 0xffffffff
+            if gap >= 0x80000000:
+                stream['out_of_order'] += n
+            else:
+                stream['lost'] += gap
+        if stream['next_seq'] is None or ((seq - stream['next_seq']) & 0xffffffff) < 0x80000000:
+            stream['next_seq'] = (seq + n) & 0xffffffff
+        stream['received'] += n
+        return stream_id, records
+
+    def receive(self):
+        '''
+        Wait for one datagram and decode it. Returns None on timeout.
+        '''
+        try:
+            datagram, _ = self.s.recvfrom(65536)
+        except socket.timeout:
+            return None
+        return self.decode(datagram)
+
+    def close(self):
+        self.s.close()
+
+
+if __name__ == "__main__":
+    port = default_port
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    rx = telemetry_receiver(port)
+    print('Listening on UDP port %u' % port)
+    tstart = time.time()
+    try:
+        while True:
+            rx.receive()
+            if time.time() - tstart > 1.0:
+                tstart = time.time()
+                for k in rx.streams:
+                    st = rx.streams[k]
+                    print('stream %u %s: received %u, lost %u, out of order %u'%\
+                          (k, st['name'], st['received'], st['lost'], st['out_of_order']))
+    except KeyboardInterrupt:
+        rx.close()
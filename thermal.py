@@ -0,0 +1,244 @@
+"""
+Temperature compensation of S0/S1/SH accel and gyro.
+
+A temperature sweep is reduced in one pass to per-bin sums (count, mean, and
+products with an optional reference input), with np.bincount over whole chunks.
+Per-axis polynomial bias and scale models are then fitted to the bins with one
+batched weighted least squares, and applied to decoded arrays with Horner's rule.
+"""
+
+import sys
+import json
+import numpy as np
+
+# width of the temperature bins, C
+bin_width = 0.5
+# temperature range of the bins, C. Samples outside are ignored.
+temp_min = -60.0
+temp_max = 120.0
+# default degree of the polynomials
+poly_degree = 3
+# polynomials are in (T - temp_center)
+temp_center = 25.0
+# bins with fewer samples are not used in the fit
+min_bin_count = 10
+# temperature channel of each axis. S0/S1 decode x/y/z rate temp and board temp,
+# SH only one temperature.
+temp_channels = {'gyro': [0, 1, 2], 'acc': [3, 3, 3]}
+
+
+class temp_binner:
+    '''
+    One-pass per-temperature-bin statistics of k axes.
+    '''
+    def __init__(self, n_axes, width=bin_width, t_min=temp_min, t_max=temp_max):
+        self.k = n_axes
+        self.width = float(width)
+        self.t_min = float(t_min)
+        self.n_bins = int(np.ceil((t_max - t_min) / width))
+        shape = (self.n_bins, self.k)
+        self.count = np.zeros(shape)
+        self.st = np.zeros(shape)
+        self.sx = np.zeros(shape)
+        self.sxx = np.zeros(shape)
+        self.sr = np.zeros(shape)
+        self.srr = np.zeros(shape)
+        self.sxr = np.zeros(shape)
+
+    def update(self, x, temp, ref=None):
+        '''
+        Add a block of samples.
+        Args:
+            x: nxk measurements
+            temp: nxk temperature of each axis, or n temperatures shared by all axes
+            ref: nxk true input (rate table rate, gravity projection...), None if static
+                with zero input
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        temp = np.asarray(temp, dtype=np.float64)
+        if temp.ndim == 1:
+            temp = np.repeat(temp[:, None], self.k, axis=1)
+        b = np.floor((temp - self.t_min) / self.width).astype(np.int64)
+        ok = (b >= 0) & (b < self.n_bins)
+        flat = (b * self.k + np.arange(self.k)[None, :])[ok]
+        size = self.n_bins * self.k
+        shape = (self.n_bins, self.k)
+
+        def acc(w):
+            return np.bincount(flat, weights=w[ok], minlength=size).reshape(shape)
+        self.count += np.bincount(flat, minlength=size).reshape(shape)
+        self.st += acc(temp)
+        self.sx += acc(x)
+        self.sxx += acc(x * x)
+        if ref is not None:
+            ref = np.asarray(ref, dtype=np.float64)
+            self.sr += acc(ref)
+            self.srr += acc(ref * ref)
+            self.sxr += acc(x * ref)
+
+    def merge(self, other):
+        '''
+        Add the statistics of another binner with the same bins, e.g. another capture.
+        '''
+        for name in ('count', 'st', 'sx', 'sxx', 'sr', 'srr', 'sxr'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def bins(self, min_count=min_bin_count):
+        '''
+        Per-bin bias and scale.
+        Returns:
+            temp: n_binsxk mean temperature of each bin
+            bias: n_binsxk bias at zero input
+            scale: n_binsxk scale factor error, zero if there is no reference input
+            weight: n_binsxk number of samples, zero for unusable bins
+        '''
+        n = self.count
+        valid = n >= min_count
+        nn = np.where(valid, n, 1.0)
+        temp = self.st / nn
+        # x = (1 + s) * r + b in each bin
+        den = n * self.srr - self.sr * self.sr
+        has_ref = valid & (np.abs(den) > 1e-12 * np.maximum(n * self.srr, 1.0))
+        den = np.where(has_ref, den, 1.0)
+        scale = np.where(has_ref, (n * self.sxr - self.sx * self.sr) / den - 1.0, 0.0)
+        bias = (self.sx - (1.0 + scale) * self.sr) / nn
+        weight = np.where(valid, n, 0.0)
+        return temp, bias, scale, weight
+
+
+def fit_poly(t, y, w, degree=poly_degree, center=temp_center):
+    '''
+    Weighted polynomial fit of all axes at once.
+    Args:
+        t, y, w: mxk temperature, value and weight of m points of k axes
+    Returns:
+        (degree+1)xk coefficients, lowest power first, in (t - center). NaN for
+        axes without enough points.
+    '''
+    dt = t - center
+    # mxkx(degree+1) Vandermonde
+    v = dt[:, :, None] ** np.arange(degree + 1)
+    a = np.einsum('mk,mki,mkj->kij', w, v, v)
+    b = np.einsum('mk,mki,mk->ki', w, v, y)
+    coef = np.full((degree + 1, t.shape[1]), np.nan)
+    enough = (w > 0).sum(axis=0) > degree
+    if enough.any():
+        coef[:, enough] = np.linalg.solve(a[enough], b[enough][:, :, None])[:, :, 0].T
+    return coef
+
+
+def poly_eval(coef, t, center=temp_center):
+    '''
+    Evaluate polynomials of fit_poly() at nxk temperatures, Horner's rule.
+    '''
+    dt = t - center
+    y = np.broadcast_to(coef[-1], dt.shape).copy()
+    for p in range(coef.shape[0] - 2, -1, -1):
+        y *= dt
+        y += coef[p]
+    return y
+
+
+def fit(binner, degree=poly_degree, min_count=min_bin_count, temp_idx=None):
+    '''
+    Fit the bias and scale models of the axes of a binner.
+    Returns:
+        dict of 'bias', 'scale' coefficients, 'center' and 'temp' channels
+    '''
+    t, bias, scale, w = binner.bins(min_count)
+    return {'bias': fit_poly(t, bias, w, degree).tolist(),\
+            'scale': fit_poly(t, scale, w, degree).tolist(),\
+            'center': temp_center,\
+            'temp': list(temp_idx) if temp_idx is not None else None}
+
+
+def _axis_temp(temp, idx, k):
+    temp = np.asarray(temp, dtype=np.float64)
+    if temp.ndim == 1:
+        temp = temp[:, None]
+    if idx is None or temp.shape[1] == 1:
+        return np.repeat(temp[:, :1], k, axis=1)
+    return temp[:, idx]
+
+
+def compensate(model, x, temp):
+    '''
+    Remove bias and scale errors, (x - b(T)) / (1 + s(T)).
+    Args:
+        model: one entry of a model, see fit()
+        x: nxk or k measurements
+        temp: temperature channels of the packet, nxc or c, see temp_channels
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    single = x.ndim == 1
+    x = np.atleast_2d(x)
+    temp = np.atleast_2d(temp) if single else temp
+    t = _axis_temp(temp, model['temp'], x.shape[1])
+    bias = np.nan_to_num(np.array(model['bias']))
+    scale = np.nan_to_num(np.array(model['scale']))
+    y = (x - poly_eval(bias, t, model['center'])) / (1.0 + poly_eval(scale, t, model['center']))
+    return y[0] if single else y
+
+
+def apply(model, data):
+    '''
+    Compensate a dict of bulk_decode output in place, 'gyro' and 'acc' with 'temp'.
+    '''
+    for name in ('gyro', 'acc'):
+        if name in model and name in data and 'temp' in data:
+            data[name] = compensate(model[name], data[name], data['temp'])
+    return data
+
+
+def fit_files(file_names, packet_type, degree=poly_degree, width=bin_width, refs=None):
+    '''
+    Fit gyro and accel models from static temperature sweep captures, one pass over
+    each file, chunk by chunk.
+    Args:
+        refs: optional dict of 'gyro'/'acc' true input, a k vector (for example the
+            gravity in the body frame of a static unit), else zero. Scale is only
+            observable with at least two different inputs in a bin, see temp_binner.
+    Returns:
+        model, a dict of 'gyro' and 'acc' entries
+    '''
+    import bulk_decode
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    binners = {'gyro': temp_binner(3, width), 'acc': temp_binner(3, width)}
+    for file_name in file_names:
+        for offsets, frames in bulk_decode.iter_frames(file_name, packet_type):
+            data = bulk_decode.decode(frames, packet_type)
+            for name in binners:
+                t = _axis_temp(data['temp'], temp_channels[name], 3)
+                ref = None
+                if refs is not None and refs.get(name) is not None:
+                    ref = np.broadcast_to(np.asarray(refs[name], dtype=np.float64), data[name].shape)
+                binners[name].update(data[name], t, ref)
+    return {name: fit(binners[name], degree, temp_idx=temp_channels[name]) for name in binners}
+
+
+def ingest_file(file_name, packet_type, model):
+    '''
+    Decode a capture and compensate it.
+    '''
+    import bulk_decode
+    return apply(model, bulk_decode.decode_file(file_name, packet_type))
+
+
+def save_model(file_name, model):
+    with open(file_name, 'w') as f:
+        json.dump(model, f, indent=4)
+
+
+def load_model(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print('Usage: python thermal.py packet_type model.json capture_file [capture_file ...]')
+        exit()
+    model = fit_files(sys.argv[3:], sys.argv[1])
+    save_model(sys.argv[2], model)
+    print('Model saved to %s'% sys.argv[2])
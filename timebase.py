@@ -0,0 +1,304 @@
+"""
+Device timebase of 5555 packets.
+
+S0/S1/SH packets carry a 16-bit rolling counter and A1/A2 the GPS ITOW in ms,
+which rolls over at the end of each GPS week. Unwrapping them gives a monotonic
+device time, and the steps between packets tell dropped, duplicated and
+out-of-order frames, independently of when the host happened to read them.
+"""
+
+import sys
+import collections
+import numpy as np
+
+# span of the counters
+counter_span = 1 << 16
+# ITOW rolls over every week, ms
+itow_span = 7 * 24 * 3600 * 1000
+
+# time field of each packet type in bulk_decode output, and its span
+time_fields = {'S0': ['counter', counter_span],\
+               'S1': ['counter', counter_span],\
+               'SH': ['counter', counter_span],\
+               'A1': ['itow', itow_span],\
+               'A2': ['itow', itow_span]}
+# duration of one tick, s. The counters count packets, their tick is 1/ODR.
+tick_seconds = {'A1': 0.001,\
+                'A2': 0.001}
+
+
+def unwrap(x, span=counter_span, start=None):
+    '''
+    Unwrap a rolling counter into a monotonic one. Steps larger than half the span
+    are taken as roll overs (forward) or out-of-order packets (backward).
+    Args:
+        x: n integer array
+        span: the counter rolls over at span
+        start: unwrapped value of the sample before x[0], x[0] is kept as is if None
+    Returns:
+        n int64 array
+    '''
+    x = np.asarray(x, dtype=np.int64)
+    if x.shape[0] == 0:
+        return x
+    if start is None:
+        d = np.diff(x)
+        first = x[0]
+    else:
+        d = np.diff(np.concatenate(([start % span], x)))
+        first = start
+    d[d < -span // 2] += span
+    d[d > span // 2] -= span
+    if start is None:
+        return first + np.concatenate(([0], np.cumsum(d)))
+    return first + np.cumsum(d)
+
+
+def estimate_step(ticks):
+    '''
+    Nominal step between packets, the median of the forward steps.
+    '''
+    d = np.diff(ticks)
+    d = d[d > 0]
+    if d.shape[0] == 0:
+        return 1
+    return max(int(np.median(d)), 1)
+
+
+def analyze(x, span=counter_span, step=None):
+    '''
+    Unwrap a counter and account for packet loss.
+    Args:
+        x: n raw counter or ITOW values, in the order received
+        span: span of the counter
+        step: nominal step between packets, estimated if None
+    Returns:
+        ticks: n unwrapped values
+        report: dict of
+            'packets': number of packets received
+            'step': nominal step
+            'expected': number of packets between the first and the last tick
+            'lost': number of packets never received
+            'duplicates': number of repeated ticks
+            'out_of_order': number of packets older than the one before
+            'rollovers': number of forward roll overs
+            'gaps': number of places where packets are missing
+            'max_gap': most packets missing in a row
+            'loss_rate': lost / expected
+    '''
+    x = np.asarray(x, dtype=np.int64)
+    ticks = unwrap(x, span)
+    n = ticks.shape[0]
+    report = {'packets': n, 'step': 1, 'expected': n, 'lost': 0, 'duplicates': 0,\
+              'out_of_order': 0, 'rollovers': 0, 'gaps': 0, 'max_gap': 0, 'loss_rate': 0.0}
+    if n == 0:
+        return ticks, report
+    if step is None:
+        step = estimate_step(ticks)
+    d = np.diff(ticks)
+    # ticks off the nominal grid are counted to the nearest slot
+    slots = np.round((ticks - ticks.min()) / float(step)).astype(np.int64)
+    unique = np.unique(slots).shape[0]
+    expected = int(slots.max()) + 1
+    missing = np.round(d / float(step)).astype(np.int64) - 1
+    missing = missing[missing > 0]
+    report['step'] = int(step)
+    report['expected'] = expected
+    report['lost'] = expected - unique
+    report['duplicates'] = n - unique
+    report['out_of_order'] = int(np.count_nonzero(d < 0))
+    report['rollovers'] = int(np.count_nonzero(np.diff(x) < -span // 2))
+    report['gaps'] = missing.shape[0]
+    report['max_gap'] = int(missing.max()) if missing.shape[0] else 0
+    report['loss_rate'] = report['lost'] / float(expected)
+    return ticks, report
+
+
+def monotonic(ticks):
+    '''
+    Index of the packets that make a strictly increasing timebase, the first copy of
+    duplicated packets and no late packets.
+    '''
+    ticks = np.asarray(ticks)
+    if ticks.shape[0] == 0:
+        return np.zeros((0,), dtype=np.int64)
+    prev_max = np.maximum.accumulate(ticks)
+    keep = np.ones(ticks.shape, dtype=bool)
+    keep[1:] = ticks[1:] > prev_max[:-1]
+    return np.flatnonzero(keep)
+
+
+def device_time(ticks, tick):
+    '''
+    Device time in seconds since the first packet.
+    Args:
+        ticks: unwrapped ticks
+        tick: duration of one tick, s
+    '''
+    ticks = np.asarray(ticks, dtype=np.int64)
+    if ticks.shape[0] == 0:
+        return ticks.astype(np.float64)
+    return (ticks - ticks[0]) * tick
+
+
+class tracker:
+    '''
+    Incremental version of analyze() for live streams, O(1) per packet.
+    '''
+    def __init__(self, span=counter_span, step=None, history=64):
+        '''
+        Args:
+            span: span of the counter
+            step: nominal step between packets, the first forward step if None
+            history: number of recent ticks kept to tell duplicates from late packets
+        '''
+        self.span = span
+        self.step = step
+        self.last = None
+        self.max = None
+        self.recent = collections.deque(maxlen=history)
+        self.recent_set = collections.Counter()
+        self.packets = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.rollovers = 0
+        self.gaps = 0
+        self.max_gap = 0
+
+    def _remember(self, t):
+        if len(self.recent) == self.recent.maxlen:
+            old = self.recent[0]
+            self.recent_set[old] -= 1
+            if self.recent_set[old] == 0:
+                del self.recent_set[old]
+        self.recent.append(t)
+        self.recent_set[t] += 1
+
+    def update(self, x):
+        '''
+        Account for a new packet.
+        Args:
+            x: raw counter or ITOW value
+        Returns:
+            unwrapped tick
+        '''
+        x = int(x)
+        self.packets += 1
+        if self.last is None:
+            t = x
+            self.max = t
+        else:
+            d = x - (self.last % self.span)
+            if d < -self.span // 2:
+                d += self.span
+                self.rollovers += 1
+            elif d > self.span // 2:
+                d -= self.span
+            t = self.last + d
+            if t in self.recent_set:
+                self.duplicates += 1
+            elif t < self.max:
+                # a late packet was counted as lost when the gap was seen
+                self.out_of_order += 1
+                self.lost = max(self.lost - 1, 0)
+            elif t > self.max:
+                if self.step is None:
+                    self.step = t - self.max
+                missing = int(round((t - self.max) / float(self.step))) - 1
+                if missing > 0:
+                    self.lost += missing
+                    self.gaps += 1
+                    self.max_gap = max(self.max_gap, missing)
+                self.max = t
+        self.last = t
+        self._remember(t)
+        return t
+
+    def update_block(self, x):
+        '''
+        Account for a block of packets, vectorized. Duplicates and late packets are
+        only checked within the block.
+        Returns:
+            unwrapped ticks of the block
+        '''
+        x = np.asarray(x, dtype=np.int64)
+        if x.shape[0] == 0:
+            return x
+        ticks = unwrap(x, self.span, self.last)
+        if self.step is None:
+            self.step = estimate_step(np.concatenate(([self.max], ticks)) if self.max is not None else ticks)
+        _, rep = analyze(x, self.span, self.step)
+        self.packets += x.shape[0]
+        self.duplicates += rep['duplicates']
+        self.out_of_order += rep['out_of_order']
+        self.rollovers += rep['rollovers']
+        self.lost += rep['lost']
+        self.gaps += rep['gaps']
+        self.max_gap = max(self.max_gap, rep['max_gap'])
+        if self.last is not None:
+            # the step into the block
+            if x[0] < (self.last % self.span) - self.span // 2:
+                self.rollovers += 1
+            missing = int(round((ticks.min() - self.max) / float(self.step))) - 1
+            if missing > 0:
+                self.lost += missing
+                self.gaps += 1
+                self.max_gap = max(self.max_gap, missing)
+        self.max = max(int(ticks.max()), self.max) if self.max is not None else int(ticks.max())
+        self.last = int(ticks[-1])
+        for t in ticks[-self.recent.maxlen:]:
+            self._remember(int(t))
+        return ticks
+
+    def report(self):
+        '''
+        The same statistics as analyze().
+        '''
+        expected = self.packets - self.duplicates + self.lost
+        return {'packets': self.packets,\
+                'step': self.step if self.step is not None else 1,\
+                'expected': expected,\
+                'lost': self.lost,\
+                'duplicates': self.duplicates,\
+                'out_of_order': self.out_of_order,\
+                'rollovers': self.rollovers,\
+                'gaps': self.gaps,\
+                'max_gap': self.max_gap,\
+                'loss_rate': self.lost / float(expected) if expected else 0.0}
+
+
+def analyze_file(file_name, packet_type, step=None):
+    '''
+    Unwrap the time field of all packets in a capture file and account for loss.
+    Returns:
+        ticks, report of analyze(), and device time in s (ticks if the tick is unknown)
+    '''
+    import bulk_decode
+    if packet_type not in time_fields:
+        raise ValueError('Packet type %s has no counter or ITOW.'% packet_type)
+    field, span = time_fields[packet_type]
+    data = bulk_decode.decode_file(file_name, packet_type)
+    x = data[field] if field in data else np.zeros((0,), dtype=np.int64)
+    ticks, report = analyze(x, span, step)
+    t = device_time(ticks, tick_seconds.get(packet_type, 1))
+    return ticks, report, t
+
+
+def format_report(report, name=''):
+    '''
+    One-line loss report.
+    '''
+    return '%s%u packets, %u expected, %u lost (%.3f%%) in %u gaps (max %u),'\
+           ' %u duplicates, %u out of order, %u rollovers'%\
+           ((name + ': ') if name else '', report['packets'], report['expected'],\
+            report['lost'], 100.0 * report['loss_rate'], report['gaps'], report['max_gap'],\
+            report['duplicates'], report['out_of_order'], report['rollovers'])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print('Usage: python timebase.py capture_file packet_type')
+        exit()
+    ticks, report, t = analyze_file(sys.argv[1], sys.argv[2])
+    print(format_report(report, sys.argv[1]))